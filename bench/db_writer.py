@@ -0,0 +1,45 @@
+"""Messages/sec through DBWriter: one commit per op vs group commit, at several client counts.
+
+    python bench/db_writer.py [--messages 2000] [--clients 1,8,32]
+    SQLITE_SYNCHRONOUS=FULL python bench/db_writer.py
+
+Each client is an asyncio task posting messages with _insert_message (seq allocation, version
+bump and insert, as in post_message) to its own drop. Runs against a throwaway DATA_DIR.
+"""
+import argparse, asyncio, logging, os, sys, tempfile, time
+from pathlib import Path
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-db-writer-")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+logging.disable(logging.WARNING)
+import main  # noqa: E402
+
+async def run(writer: main.DBWriter, messages: int, clients: int) -> float:
+    main.db_writer = writer  # _insert_message looks the writer up at call time
+    run_id = os.urandom(4).hex()
+    async def client(n: int):
+        drop_id = f"bench-{run_id}-{n}"
+        for i in range(messages // clients):
+            ts = int(time.time() * 1000)
+            await main._insert_message(drop_id, {
+                "id": os.urandom(8).hex(), "ts": ts, "created_at": ts, "updated_at": ts, "user": "E",
+                "message_type": "text", "text": f"message {i}", "reactions": "{}", "delivered_at": ts})
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return (messages // clients) * clients / (time.perf_counter() - start)
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--clients", default="1,8,32")
+    args = parser.parse_args()
+    main.init_db()
+    print(f"synchronous={main.SQLITE_SYNCHRONOUS}, {args.messages} messages")
+    print(f"{'clients':>8} {'per-op commit':>14} {'group commit':>13}")
+    for clients in (int(c) for c in args.clients.split(",")):
+        single = asyncio.run(run(main.DBWriter(max_batch=1, max_latency_ms=0), args.messages, clients))
+        grouped = asyncio.run(run(main.DBWriter(), args.messages, clients))
+        print(f"{clients:>8} {single:>12.0f}/s {grouped:>11.0f}/s")
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,44 @@
+"""Cost of _verify_token with and without the session TokenCache.
+
+    python bench/token_cache.py [--calls 200000]
+
+Also counts HMAC computations, to show that a cache hit skips signature checking entirely.
+"""
+import argparse, logging, os, sys, tempfile, timeit
+from pathlib import Path
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-token-cache-")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+logging.disable(logging.WARNING)
+import main  # noqa: E402
+
+signs = 0
+_sign = main.sign
+
+def counting_sign(payload: bytes) -> bytes:
+    global signs
+    signs += 1
+    return _sign(payload)
+
+main.sign = counting_sign  # _token_exp looks sign up at call time
+
+def measure(cache_size: int, calls: int):
+    global signs
+    main.token_cache = main.TokenCache(cache_size)
+    token = main._generate_token()
+    assert main._verify_token(token)  # warm the cache, if any
+    signs = 0
+    per_call = min(timeit.repeat(lambda: main._verify_token(token), number=calls, repeat=3)) / calls
+    return per_call * 1e6, signs / (3 * calls)
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+    print(f"{args.calls} calls, best of 3")
+    for label, size in (("cache disabled (size=0)", 0), (f"cached (size={main.SESSION_CACHE_SIZE})", main.SESSION_CACHE_SIZE)):
+        us, hmacs = measure(size, args.calls)
+        print(f"{label:<28} {us:6.2f} us/call  {hmacs:.2f} HMACs/call")
+
+if __name__ == "__main__":
+    main_()
@@ -18,13 +18,20 @@ var API = {
     return fetch(url, Object.assign({}, opts, { headers: headers, credentials: 'include' }));
   },
 
-  fetchDrop: async function(dropId){
+  fetchDrop: async function(dropId, since){
     // ⚡ OPTIMIZED: This now returns BOTH messages AND images in one call!
     // Response format: { dropId, version, messages, activeCall, images: [...] }
+    // With `since` the server may answer with { delta: true, messages, deleted, images }
+    // holding only what changed after that version (see Messages.applyDelta)
     // Updated endpoint from /drop3/ to /chat/
-    var url = this.bust(CONFIG.API_BASE_URL.replace(/\/$/,'') + '/chat/' + dropId);
+    var path = '/chat/' + dropId;
+    if(since != null) path += '?since=' + encodeURIComponent(since);
+    var url = CONFIG.API_BASE_URL.replace(/\/$/,'') + path;
+    // No cache-busting: the server sends an ETag, and 'no-cache' makes the browser revalidate
+    // each poll so an unchanged drop comes back as a 304 served from the HTTP cache
     var res = await fetch(url, { 
       method:'GET', 
+      cache:'no-cache',
       credentials:'include'  // Send session cookie
     });
     if (!res.ok){ 
@@ -99,15 +106,63 @@ var API = {
   },
 
   uploadImage: async function(dropId, file){
-    var fd = new FormData();
-    fd.append('file', file);
+    // Resumable upload: init a session, PUT chunks at the offset the server acknowledged,
+    // commit, then post the message. After a dropped connection we ask the server how far
+    // it got and continue from there instead of starting over.
+    var base = '/chat/' + dropId + '/uploads';
+    var res = await this.api(base, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ size: file.size, mime: file.type, filename: file.name })
+    });
+    if(!res.ok) throw new Error('Upload failed: '+res.status);
+    var session = await res.json();
+    var path = base + '/' + session.uploadId;
+    var offset = 0;
+    var failures = 0;
+    var leaseWaits = 0;
+    while(offset < file.size){
+      var status = 0;
+      try{
+        res = await this.api(path + '?offset=' + offset, {
+          method: 'PUT',
+          body: file.slice(offset, offset + session.chunkSize)
+        });
+        status = res.status;
+        if(res.ok){
+          offset = (await res.json()).offset;
+          failures = 0;
+          leaseWaits = 0;
+          continue;
+        }
+      }catch(e){
+        console.log('[Upload] Chunk at ' + offset + ' failed: ' + (e.message || e));
+      }
+      // 409 = offset mismatch, 5xx / network = try again; anything else is final
+      if(status && status !== 409 && status < 500) throw new Error('Upload failed: '+status);
+      // 409 with Retry-After: another request still holds the upload (typically our own earlier
+      // PUT, stalled on a dead link) until its lease lapses. Wait that out; it isn't a failure.
+      var leaseWait = status === 409 ? Number(res.headers.get('Retry-After')) : 0;
+      if(leaseWait > 0){
+        if(++leaseWaits > 3) throw new Error('Upload failed: upload busy');
+        await new Promise(function(resolve){ setTimeout(resolve, Math.min(leaseWait, 60) * 1000 + 250); });
+      }else{
+        if(++failures > 5) throw new Error('Upload failed: connection lost');
+        await new Promise(function(resolve){ setTimeout(resolve, 500 * failures); });
+      }
+      try{
+        var st = await this.api(path, { method: 'GET' });
+        if(st.ok) offset = (await st.json()).offset;
+      }catch(e){}
+    }
+    res = await this.api(path + '/commit', { method: 'POST' });
+    if(!res.ok) throw new Error('Upload failed: '+res.status);
     // Add user field so backend knows who uploaded the image
     var userRole = App.myRole || Storage.getRole(dropId) || 'E';
-    fd.append('user', userRole);
-    var res = await fetch(CONFIG.API_BASE_URL.replace(/\/$/,'') + '/chat/'+dropId, {
-      method:'POST',
-      body: fd,
-      credentials: 'include'
+    res = await this.api('/chat/' + dropId, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ uploadId: session.uploadId, user: userRole })
     });
     if(!res.ok) throw new Error('Upload failed: '+res.status);
     return await res.json();
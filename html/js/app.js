@@ -75,16 +75,7 @@ var App = {
       var data = await API.fetchDrop(this.dropId);
       Messages.applyDrop(data);
       
-      if(data.images){
-        Images.list = data.images.map(function(im){
-          return {
-            id: im.imageId,
-            urls: { thumb: im.thumbUrl, original: im.originalUrl },
-            uploadedAt: im.uploadedAt
-          };
-        });
-        Images.render();
-      }
+      Images.applyDrop(data);
       
       if(typeof Streak !== 'undefined'){
         Streak.fetch(this.dropId).catch(function(e){
@@ -360,19 +351,11 @@ var App = {
     var self = this;
     this.pollTimer=setInterval(async function(){ 
       try{
-        var data = await API.fetchDrop(self.dropId);
+        // Delta poll: only changes since our version (falls back to full when too far behind)
+        var data = await API.fetchDrop(self.dropId, Messages.currentVersion);
         Messages.applyDrop(data);
         
-        if(data.images){
-          Images.list = data.images.map(function(im){
-            return {
-              id: im.imageId,
-              urls: { thumb: im.thumbUrl, original: im.originalUrl },
-              uploadedAt: im.uploadedAt
-            };
-          });
-          Images.render();
-        }
+        Images.applyDrop(data);
       }catch(e){
         console.error('Poll error:', e);
       }
@@ -521,16 +504,7 @@ var App = {
         var data = await API.fetchDrop(this.dropId);
         Messages.applyDrop(data);
         
-        if(data.images){
-          Images.list = data.images.map(function(im){
-            return {
-              id: im.imageId,
-              urls: { thumb: im.thumbUrl, original: im.originalUrl },
-              uploadedAt: im.uploadedAt
-            };
-          });
-          Images.render();
-        }
+        Images.applyDrop(data);
       }.bind(this), 100);
       
     }catch(e){ 
@@ -1,6 +1,8 @@
 // Camera/Webcam viewer for Frigate stream
 var Camera = {
   streamUrl: '/api/camera/stream',
+  snapshotUrl: '/api/camera/snapshot',
+  pendingStream: false,
   modal: null,
   stream: null,
   loading: null,
@@ -33,9 +35,14 @@ var Camera = {
 
     this.stream.addEventListener('load', function() {
       if (self.loading) self.loading.classList.add('hidden');
+      self.startStream();
     });
 
     this.stream.addEventListener('error', function() {
+      if (self.pendingStream) {
+        self.startStream();
+        return;
+      }
       if (self.loading) self.loading.classList.add('hidden');
       console.error('Camera: stream failed to load');
     });
@@ -57,14 +64,27 @@ var Camera = {
     }
 
     if (this.loading) this.loading.classList.remove('hidden');
-    this.stream.src = this.streamUrl + '?t=' + Date.now();
+    // Show the latest still right away, then switch to the live stream once it has loaded
+    this.pendingStream = true;
+    this.stream.src = this.snapshotUrl;
     this.modal.classList.add('show');
     document.body.classList.add('no-scroll');
     this.isOpen = true;
   },
 
+  startStream: function() {
+    if (!this.pendingStream || !this.isOpen) return;
+    this.pendingStream = false;
+    var url = this.streamUrl + '?t=' + Date.now();
+    // Let the server skip frames for phones on slow or metered connections
+    var conn = navigator.connection;
+    if (conn && (conn.saveData || /(^|-)(2g|3g)$/.test(conn.effectiveType || ''))) url += '&fps=2';
+    this.stream.src = url;
+  },
+
   hide: function() {
     if (!this.modal) return;
+    this.pendingStream = false;
     if (this.stream) this.stream.src = '';
     this.modal.classList.remove('show');
     document.body.classList.remove('no-scroll');
@@ -7,19 +7,39 @@ var Images = {
       var data = await API.fetchImages(dropId, force);
       if(!data) return;
       var raw = (data && data.images) || [];
-      this.list = raw.map(function(im){
-        return {
-          id: im.imageId,
-          urls: { thumb: im.thumbUrl, original: im.originalUrl },
-          uploadedAt: im.uploadedAt
-        };
-      });
+      this.list = raw.map(this.toEntry);
       this.render();
     }catch(e){
       console.error('fetchImages error:', e);
     }
   },
 
+  toEntry: function(im){
+    return {
+      id: im.imageId,
+      seq: im.seq,
+      urls: { thumb: im.thumbUrl, medium: im.mediumUrl, original: im.originalUrl },
+      uploadedAt: im.uploadedAt
+    };
+  },
+
+  // Refresh the gallery from a drop payload (full list, or a {delta: true} change set)
+  applyDrop: function(data){
+    if(!data || !data.images) return;
+    if(data.delta){
+      var changed = {};
+      (data.deleted || []).forEach(function(seq){ changed[seq] = true; });
+      (data.messages || []).forEach(function(msg){ changed[msg.seq] = true; });
+      var kept = this.list.filter(function(im){ return !changed[im.seq]; });
+      var added = data.images.map(this.toEntry);
+      if(kept.length === this.list.length && added.length === 0) return;
+      this.list = kept.concat(added).sort(function(a, b){ return (a.seq || 0) - (b.seq || 0); });
+    } else {
+      this.list = data.images.map(this.toEntry);
+    }
+    this.render();
+  },
+
   render: function(){
     var thumbContainer = document.getElementById('thumbStrip');
     if(!thumbContainer) return;
@@ -41,7 +61,6 @@ var Images = {
       
       var thumbUrl = im.urls && im.urls.thumb;
       if(thumbUrl){
-        thumbUrl += '?t=' + Date.now();
         div.style.backgroundImage = "url('" + thumbUrl + "')";
       }
       
@@ -59,9 +78,6 @@ var Images = {
       div.addEventListener('click', function(e){
         if(e.target===trash || trash.contains(e.target)) return;
         var originalUrl = (im.urls && im.urls.original) || (im.urls && im.urls.thumb) || '';
-        if(originalUrl){
-          originalUrl += '?t=' + Date.now();
-        }
         UI.openLightbox(originalUrl);
       });
       
@@ -102,13 +118,7 @@ var Images = {
           // Success path
           var data = await res.json().catch(function(){ return null; });
           if (data && Array.isArray(data.images)) {
-            this.list = data.images.map(function(im){
-              return {
-                id: im.imageId,
-                urls: { thumb: im.thumbUrl, original: im.originalUrl },
-                uploadedAt: im.uploadedAt
-              };
-            });
+            this.list = data.images.map(this.toEntry);
             this.render();
           } else {
             setTimeout(function(){ this.fetch(dropId).catch(function(){}); }.bind(this), 250);
@@ -153,12 +163,7 @@ var Images = {
       if(res && res.messages){
         Messages.applyDrop(res);
       }
-      if(res && res.images){
-        Images.list = res.images.map(function(im){
-          return { id: im.imageId, urls: { thumb: im.thumbUrl, original: im.originalUrl }, uploadedAt: im.uploadedAt };
-        });
-        Images.render();
-      }
+      Images.applyDrop(res);
       this.hideUploadStatus();
       setTimeout(function(){ if(UI.els.chatContainer){ UI.els.chatContainer.scrollTop = UI.els.chatContainer.scrollHeight; } }, 100);
     }catch(err){ 
@@ -104,34 +104,64 @@ var Messages = {
     if(replyPreview) replyPreview.classList.remove('show');
   },
 
+  normalizeMessage: function(msg){
+    return {
+      message: msg.message || '',
+      seq: msg.seq || 0,
+      version: msg.seq || 0,
+      createdAt: msg.createdAt || msg.updatedAt,
+      updatedAt: msg.updatedAt,
+      reactions: msg.reactions || {},
+      user: msg.user || null,
+      clientId: msg.clientId || null,
+      messageType: msg.messageType || 'text',
+      gifUrl: msg.gifUrl || null,
+      gifPreview: msg.gifPreview || null,
+      gifWidth: msg.gifWidth || null,
+      gifHeight: msg.gifHeight || null,
+      imageUrl: msg.imageUrl || null,
+      imageThumb: msg.imageThumb || null,
+      imageMedium: msg.imageMedium || null,
+      replyToSeq: msg.replyToSeq || null,
+      deliveredAt: msg.deliveredAt || null,
+      readAt: msg.readAt || null
+    };
+  },
+
   applyDrop: function(data){
     if(!data) return;
     
+    if(data.delta){
+      this.applyDelta(data);
+      return;
+    }
+    
     this.currentVersion = data.version || 0;
     
     if(data.messages && Array.isArray(data.messages)){
-      this.history = data.messages.map(function(msg){
-        return {
-          message: msg.message || '',
-          seq: msg.seq || 0,
-          version: msg.seq || 0,
-          createdAt: msg.createdAt || msg.updatedAt,
-          updatedAt: msg.updatedAt,
-          reactions: msg.reactions || {},
-          user: msg.user || null,
-          clientId: msg.clientId || null,
-          messageType: msg.messageType || 'text',
-          gifUrl: msg.gifUrl || null,
-          gifPreview: msg.gifPreview || null,
-          gifWidth: msg.gifWidth || null,
-          gifHeight: msg.gifHeight || null,
-          imageUrl: msg.imageUrl || null,
-          imageThumb: msg.imageThumb || null,
-          replyToSeq: msg.replyToSeq || null,
-          deliveredAt: msg.deliveredAt || null,
-          readAt: msg.readAt || null
-        };
-      });
+      this.history = data.messages.map(this.normalizeMessage);
+      this.render();
+      this.sendReadReceipts();
+    }
+    
+    if(UI.setLive) UI.setLive('Connected');
+  },
+
+  // Merge a {delta: true} response: changed messages replace by seq, deleted seqs are dropped
+  applyDelta: function(data){
+    if((data.version || 0) < this.currentVersion) return;
+    this.currentVersion = data.version || 0;
+    
+    var changed = (data.messages || []).map(this.normalizeMessage);
+    var deleted = data.deleted || [];
+    
+    if(changed.length || deleted.length){
+      var drop = {};
+      deleted.forEach(function(seq){ drop[seq] = true; });
+      changed.forEach(function(msg){ drop[msg.seq] = true; });
+      this.history = this.history.filter(function(msg){ return !drop[msg.seq]; })
+        .concat(changed)
+        .sort(function(a, b){ return a.seq - b.seq; });
       this.render();
       this.sendReadReceipts();
     }
@@ -180,6 +210,10 @@ var Messages = {
     
     if(!upToSeq || !reader || !readAt) return;
     
+    if(data.version != null && data.version > this.currentVersion){
+      this.currentVersion = data.version;
+    }
+    
     var updated = false;
     
     this.history.forEach(function(msg){
@@ -265,7 +299,8 @@ var Messages = {
         imageContainer.className = 'image-container';
         
         var img = document.createElement('img');
-        img.src = msg.imageThumb || msg.imageUrl;
+        // Server-rendered variants arrive in a later delta; the original stands in until then
+        img.src = msg.imageMedium || msg.imageThumb || msg.imageUrl;
         img.alt = msg.message || 'Image';
         img.className = 'image-thumbnail';
         img.loading = 'lazy';
@@ -300,7 +335,7 @@ var Messages = {
           
           function openLightbox(){
             if(fullUrl && UI.openLightbox){
-              UI.openLightbox(fullUrl + '?t=' + Date.now());
+              UI.openLightbox(fullUrl);
             }
           }
           
@@ -442,7 +477,7 @@ var Messages = {
           
           function openLightbox(){
             if(fullUrl && UI.openLightbox){
-              UI.openLightbox(fullUrl + '?t=' + Date.now());
+              UI.openLightbox(fullUrl);
             }
           }
           
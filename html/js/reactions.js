@@ -100,7 +100,7 @@ var Reactions = {
             url = this.currentMsg.imageUrl || this.currentMsg.imageThumb;
           }
           if(url && UI.openLightbox){
-            UI.openLightbox(url + '?t=' + Date.now());
+            UI.openLightbox(url);
           } else if(url && UI.showLightbox){
             UI.showLightbox(url);
           }
@@ -7,6 +7,7 @@ var WebSocketManager = {
   dropId: null,
   userLabel: null,
   lastTypingSent: 0,
+  lastResyncSent: 0,
   typingState: new Map(),
   typingTimeouts: new Map(),
   onUpdateCallback: null,
@@ -94,13 +95,24 @@ var WebSocketManager = {
               if(this.onUpdateCallback) this.onUpdateCallback(msg.data);
             } else {
               if(this.onUpdateCallback && typeof API !== 'undefined'){
-                API.fetchDrop(this.dropId).then(function(data){
+                var since = (typeof Messages !== 'undefined') ? Messages.currentVersion : null;
+                API.fetchDrop(this.dropId, since).then(function(data){
                   if(this.onUpdateCallback) this.onUpdateCallback(data);
                 }.bind(this)).catch(function(e){
                   console.error('[WS] Failed to fetch drop:', e);
                 });
               }
             }
+          } else if(msg.type === 'delta' && msg.data){
+            // Single-message change set; if we missed a version, ask for a full snapshot instead
+            var current = (typeof Messages !== 'undefined') ? Messages.currentVersion : null;
+            if(current != null && msg.data.version <= current){
+              // Already have it
+            } else if(current != null && msg.data.since > current){
+              this.requestResync();
+            } else if(this.onUpdateCallback){
+              this.onUpdateCallback(msg.data);
+            }
           } else if(msg.type === 'typing' && msg.payload){
             if(this.onTypingCallback) this.onTypingCallback(msg.payload);
           } else if(msg.type === 'presence' && msg.data){
@@ -118,7 +130,11 @@ var WebSocketManager = {
               Messages.handleDeliveryReceipt(msg.data);
             }
           } else if(msg.type === 'read_receipt' && msg.data){
-            if(typeof Messages !== 'undefined' && Messages.handleReadReceipt){
+            // Receipts that changed read state carry the version they produced, like a delta
+            var readCurrent = (typeof Messages !== 'undefined') ? Messages.currentVersion : null;
+            if(msg.data.version != null && readCurrent != null && msg.data.since > readCurrent){
+              this.requestResync();
+            } else if(typeof Messages !== 'undefined' && Messages.handleReadReceipt){
               Messages.handleReadReceipt(msg.data);
             }
           } else if(msg.type === 'error'){
@@ -295,6 +311,20 @@ var WebSocketManager = {
     }
   },
 
+  requestResync: function(){
+    if(!this.ws || this.ws.readyState !== 1) return;
+    
+    var now = Date.now();
+    if(now - this.lastResyncSent < 1000) return;
+    this.lastResyncSent = now;
+    
+    try {
+      this.ws.send(JSON.stringify({ action: 'resync' }));
+    } catch(e){
+      console.error('[WS] Request resync failed:', e);
+    }
+  },
+
   requestPresence: function(){
     if(!this.ws || this.ws.readyState !== 1) return;
     
@@ -1,15 +1,28 @@
-import os, json, hmac, hashlib, time, secrets, mimetypes, logging
-from typing import Optional, Dict, Any, List
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Request, HTTPException, Response
+import os, re, io, json, hmac, hashlib, shutil, struct, time, secrets, mimetypes, logging, asyncio, threading, queue
+import concurrent.futures, contextlib, fcntl, math
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Request, HTTPException, Response, Body
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.responses import RedirectResponse, HTMLResponse
 import httpx
 from fastapi.staticfiles import StaticFiles
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, event, bindparam
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 import aiofiles
 from pathlib import Path
+from email.utils import formatdate, parsedate_to_datetime
+try:
+    from PIL import Image, ImageOps  # optional: thumbnails; without Pillow the original image is used
+except ImportError:
+    Image = ImageOps = None
+try:
+    import h2  # optional: HTTP/2 for the outbound client (HTTP_CLIENT_HTTP2)
+except ImportError:
+    h2 = None
 
 # --- Config / env ---
 PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "http://localhost:8080")
@@ -44,18 +57,30 @@ UNLOCK_CODE_HASH = os.environ.get("UNLOCK_CODE_HASH", "")
 UNLOCK_CODE      = os.environ.get("UNLOCK_CODE", "")
 
 # Camera stream URL for proxying
-CAMERA_STREAM_URL = "https://cam.efive.org/api/reolink_e1_zoom"
+CAMERA_STREAM_URL = os.environ.get("CAMERA_STREAM_URL", "https://cam.efive.org/api/reolink_e1_zoom")
+
+@contextlib.contextmanager
+def _data_dir_lock(name: str):
+    """Exclusive flock on DATA_DIR/.<name>.lock, shared by every process using DATA_DIR (e.g. uvicorn workers)."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(DATA_DIR / f".{name}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the lock
 
 # Secret to sign sessions; derive from env or generate stable file-based secret
 SESSION_SIGN_KEY = os.environ.get("SESSION_SIGN_KEY")
 if not SESSION_SIGN_KEY:
     keyfile = DATA_DIR / ".sesskey"
-    keyfile.parent.mkdir(parents=True, exist_ok=True)
-    if keyfile.exists():
-        SESSION_SIGN_KEY = keyfile.read_text().strip()
-    else:
-        SESSION_SIGN_KEY = secrets.token_hex(32)
-        keyfile.write_text(SESSION_SIGN_KEY)
+    # Workers starting together must all end up with the first one's key
+    with _data_dir_lock("sesskey"):
+        if keyfile.exists():
+            SESSION_SIGN_KEY = keyfile.read_text().strip()
+        else:
+            SESSION_SIGN_KEY = secrets.token_hex(32)
+            keyfile.write_text(SESSION_SIGN_KEY)
 SESSION_SIGN_KEY_BYTES = SESSION_SIGN_KEY.encode("utf-8")
 
 # --- App & DB ---
@@ -71,111 +96,1267 @@ async def add_cache_headers(request: Request, call_next):
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
     return response
-engine: Engine = create_engine(f"sqlite:///{DB_PATH}", future=True)
+# Reads run on a small thread pool (see DBReader); the pool holds one connection per reader plus the writer
+DB_READ_THREADS = max(1, int(os.environ.get("DB_READ_THREADS", "4")))
+engine: Engine = create_engine(f"sqlite:///{DB_PATH}", future=True,
+                               pool_size=DB_READ_THREADS + 1, max_overflow=DB_READ_THREADS)
+
+# WAL lets readers run alongside the writer; NORMAL sync is durable across app crashes in WAL mode
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+
+@event.listens_for(engine, "connect")
+def _sqlite_on_connect(dbapi_conn, _record):
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work with pysqlite
+    dbapi_conn.isolation_level = None
+    cur = dbapi_conn.cursor()
+    cur.execute("pragma journal_mode=WAL")
+    cur.execute(f"pragma synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute("pragma busy_timeout=5000")
+    cur.close()
+
+@event.listens_for(engine, "begin")
+def _sqlite_on_begin(conn):
+    # Write transactions take the lock up front: a deferred one that reads first cannot wait for
+    # another process's writer when it upgrades, it fails with "database is locked" instead
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("sqlite_immediate") else "BEGIN")
+
+# Engine for transactions that write (DBWriter, migrations); same pool as `engine`
+write_engine = engine.execution_options(sqlite_immediate=True)
 BLOB_DIR.mkdir(parents=True, exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- Blob store ---
+# Content-addressed: a blob's id is the sha256 of its bytes, so identical uploads share one file.
+# Files are fanned out as BLOB_DIR/ab/cd/<id> by hash prefix. The blobs table indexes them
+# (size, mime, created_at, owner drop) and refcounts the messages pointing at each one.
+_BLOB_ID_RE = re.compile(r"[0-9a-f]{64}")
+
+class _FilesLock:
+    """A threading.Lock that also holds an flock on DATA_DIR/.<name>.lock, so it excludes other
+    processes sharing DATA_DIR (uvicorn workers) as well as other threads."""
+    def __init__(self, name: str):
+        self.name = name
+        self.local = threading.Lock()
+        self.fd: Optional[int] = None
+
+    def __enter__(self):
+        self.local.acquire()
+        try:
+            if self.fd is None:
+                self.fd = os.open(DATA_DIR / f".{self.name}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except BaseException:
+            self.local.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.local.release()
+
+_blob_files_lock = _FilesLock("blobs")  # orders file placement against unlinks, across workers
+
+def _is_blob_id(blob_id: Optional[str]) -> bool:
+    return bool(blob_id) and bool(_BLOB_ID_RE.fullmatch(blob_id))
+
+def _blob_path(blob_id: str) -> Path:
+    return BLOB_DIR / blob_id[:2] / blob_id[2:4] / blob_id
+
+# Downscaled JPEG renditions stored next to an image blob: name -> longest edge in px
+IMAGE_VARIANTS = {"thumb": 256, "medium": 1024}
+
+def _variant_path(blob_id: str, name: str) -> Path:
+    path = _blob_path(blob_id)
+    return path.with_name(f"{path.name}.{name}.jpg")
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Largest file accepted, enforced while streaming (multipart posts and resumable uploads alike)
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Small blobs recently uploaded or viewed are kept in memory: a new image is fetched by every
+# connected client within moments of being posted. 0 disables.
+BLOB_MEM_CACHE_BYTES = int(os.environ.get("BLOB_MEM_CACHE_BYTES", str(64 * 1024 * 1024)))
+BLOB_MEM_CACHE_ITEM_MAX = int(os.environ.get("BLOB_MEM_CACHE_ITEM_MAX", str(512 * 1024)))
+
+class BlobCache:
+    """LRU of small blob/variant files keyed by file name, as (data, mtime, media type), under a byte budget.
+
+    Uploads are added by _place_blob and removed by _release_blobs, both under _blob_files_lock.
+    Fills from disk pass the generation read before touching the file, so a fill racing an
+    invalidation is dropped instead of resurrecting a deleted blob.
+    """
+    def __init__(self, budget: int = BLOB_MEM_CACHE_BYTES, item_max: int = BLOB_MEM_CACHE_ITEM_MAX):
+        self.budget = budget
+        self.item_max = min(item_max, budget)
+        self.entries: "OrderedDict[str, Tuple[bytes, float, str]]" = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytesSaved": 0, "fills": 0, "evictions": 0, "invalidations": 0}
+
+    def fits(self, size: int) -> bool:
+        return 0 < size <= self.item_max
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float, str]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: str, data: bytes, mtime: float, media_type: str, generation: Optional[int] = None):
+        if not self.fits(len(data)):
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[key] = (data, mtime, media_type)
+            self.size += len(data)
+            self.stats["fills"] += 1
+            while self.size > self.budget:
+                _, (evicted, _, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, keys: List[str]):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.size -= len(entry[0])
+                    self.stats["invalidations"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            looked = self.stats["hits"] + self.stats["misses"]
+            return {**self.stats, "hitRate": round(self.stats["hits"] / looked, 3) if looked else None,
+                    "items": len(self.entries), "bytes": self.size, "budget": self.budget}
+
+blob_cache = BlobCache()
+
+# Optional pack-file backend: with BLOB_BACKEND=packs, new blobs up to PACK_ITEM_MAX bytes are
+# appended to BLOB_DIR/packs/pack-NNNNNN.dat and located through blobs.pack_id/pack_offset
+# instead of getting a file (and inode) each. Larger blobs and image variants stay files.
+# Packed blobs stay readable whichever backend is configured.
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "files").lower()
+PACK_DIR = BLOB_DIR / "packs"
+PACK_ITEM_MAX = int(os.environ.get("PACK_ITEM_MAX", str(256 * 1024)))
+PACK_TARGET_BYTES = int(os.environ.get("PACK_TARGET_BYTES", str(64 * 1024 * 1024)))
+PACK_COMPACT_GARBAGE = float(os.environ.get("PACK_COMPACT_GARBAGE", "0.5"))
+PACK_COMPACT_INTERVAL_SECONDS = float(os.environ.get("PACK_COMPACT_INTERVAL_SECONDS", "3600"))
+PACK_COMPACT_GRACE_SECONDS = float(os.environ.get("PACK_COMPACT_GRACE_SECONDS", "300"))
+_PACK_NAME_RE = re.compile(r"pack-(\d{6})\.dat")
+
+class PackStore:
+    """Append-only pack files. A record is a header (sha256 digest, length) followed by the bytes;
+    blobs.pack_offset points just past the header. Released blobs leave holes, which compact()
+    reclaims by copying a mostly-dead pack's live records to the active pack and deleting it.
+
+    Packs stay open, so a read is one pread() instead of an open() per blob. Worker processes
+    sharing DATA_DIR all append to the newest pack: `lock` is also an flock, and the append offset
+    is taken from the file's size under it, not from what this process last wrote.
+    """
+    HEADER = struct.Struct("<32sI")
+
+    def __init__(self, directory: Path = PACK_DIR, enabled: bool = BLOB_BACKEND == "packs",
+                 item_max: int = PACK_ITEM_MAX, target: int = PACK_TARGET_BYTES):
+        self.dir = directory
+        self.enabled = enabled
+        self.item_max = item_max
+        self.target = target
+        self.lock = _FilesLock("packs")
+        self.fds: Dict[int, int] = {}
+        self.retired: List[int] = []  # fds of deleted packs, closed on the next compaction
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"appended": 0, "appendedBytes": 0, "reads": 0, "compactions": 0, "bytesReclaimed": 0}
+
+    def accepts(self, size: int) -> bool:
+        return self.enabled and 0 < size <= self.item_max
+
+    def _path(self, pack_id: int) -> Path:
+        return self.dir / f"pack-{pack_id:06d}.dat"
+
+    def pack_ids(self) -> List[int]:
+        try:
+            names = os.listdir(self.dir)
+        except FileNotFoundError:
+            return []
+        return sorted(int(m.group(1)) for m in map(_PACK_NAME_RE.fullmatch, names) if m)
+
+    def _fd(self, pack_id: int) -> int:
+        fd = self.fds.get(pack_id)
+        if fd is None:
+            with self.lock:
+                fd = self.fds.get(pack_id)
+                if fd is None:
+                    fd = self.fds[pack_id] = os.open(self._path(pack_id), os.O_RDWR)
+        return fd
+
+    def _create(self, pack_id: int) -> int:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        fd = self.fds[pack_id] = os.open(self._path(pack_id), os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        return fd
+
+    def append(self, blob_id: str, data: bytes) -> Tuple[int, int]:
+        """Write one record to the newest pack; returns (pack_id, offset of the data)."""
+        record = self.HEADER.pack(bytes.fromhex(blob_id), len(data)) + data
+        with self.lock:
+            # Listed each time: another worker may have rotated, or compacted our last pack away
+            ids = self.pack_ids()
+            if not ids:
+                pack_id, fd, offset = 1, self._create(1), 0
+            else:
+                pack_id = ids[-1]
+                fd = self.fds.get(pack_id)
+                if fd is None:
+                    fd = self.fds[pack_id] = os.open(self._path(pack_id), os.O_RDWR)
+                offset = os.fstat(fd).st_size
+                if offset and offset + len(record) > self.target:
+                    pack_id, fd, offset = pack_id + 1, self._create(pack_id + 1), 0
+            os.pwrite(fd, record, offset)
+            self.stats["appended"] += 1
+            self.stats["appendedBytes"] += len(data)
+            return pack_id, offset + self.HEADER.size
+
+    def read(self, pack_id: int, offset: int, length: int) -> bytes:
+        data = os.pread(self._fd(pack_id), length, offset)
+        if len(data) != length:
+            raise OSError(f"short read from pack {pack_id} at {offset}")
+        self.stats["reads"] += 1
+        return data
+
+    def compact(self) -> int:
+        """Rewrite sealed packs that are at least PACK_COMPACT_GARBAGE dead space. Runs in a thread;
+        returns the bytes reclaimed."""
+        for fd in self.retired:
+            os.close(fd)
+        self.retired = []
+        with self.lock:
+            # Packs another worker compacted away; closed next time like our own
+            for pack_id, fd in list(self.fds.items()):
+                if os.fstat(fd).st_nlink == 0:
+                    self.retired.append(self.fds.pop(pack_id))
+        with _data_dir_lock("compact"):
+            return self._compact()
+
+    def _compact(self) -> int:
+        # Appends go to the newest pack, which is never compacted. A record lands in the blobs table
+        # a moment after its append (see _record_pack), so packs written to within
+        # PACK_COMPACT_GRACE_SECONDS are skipped too: their live bytes may not all be counted yet.
+        ids = self.pack_ids()
+        with engine.connect() as conn:
+            live = dict(conn.execute(text("""
+                select pack_id, sum(size) + count(*) * :h from blobs where pack_id is not null group by pack_id
+            """), {"h": self.HEADER.size}).all())
+        reclaimed = 0
+        for pack_id in ids[:-1]:
+            try:
+                st = self._path(pack_id).stat()
+            except FileNotFoundError:
+                continue
+            size = st.st_size
+            if time.time() - st.st_mtime < PACK_COMPACT_GRACE_SECONDS:
+                continue
+            if size and live.get(pack_id, 0) <= size * (1 - PACK_COMPACT_GARBAGE):
+                reclaimed += self._rewrite(pack_id, size)
+        return reclaimed
+
+    def _rewrite(self, pack_id: int, size: int) -> int:
+        with engine.connect() as conn:
+            rows = conn.execute(text("select blob_id, pack_offset, size from blobs where pack_id=:p"),
+                                {"p": pack_id}).all()
+        moves, kept = [], 0
+        for blob_id, offset, length in rows:
+            new_pack, new_offset = self.append(blob_id, self.read(pack_id, offset, length))
+            moves.append({"b": blob_id, "p": pack_id, "o": offset, "np": new_pack, "no": new_offset})
+            kept += self.HEADER.size + length
+        if moves:
+            # A blob released meanwhile matches nothing here; its fresh copy is just another hole
+            db_writer.submit(lambda conn: conn.execute(text("""
+                update blobs set pack_id=:np, pack_offset=:no where blob_id=:b and pack_id=:p and pack_offset=:o
+            """), moves)).result()
+        with self.lock:
+            fd = self.fds.pop(pack_id, None)
+            if fd is not None:
+                self.retired.append(fd)  # a reader may still hold the old location
+        self._path(pack_id).unlink(missing_ok=True)
+        self.stats["compactions"] += 1
+        self.stats["bytesReclaimed"] += size - kept
+        logger.info(f"[packs] Compacted pack {pack_id}: kept {len(moves)} blob(s), reclaimed {size - kept} bytes")
+        return size - kept
+
+    def start(self):
+        if not (self.enabled or self.pack_ids()):
+            return
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PACK_COMPACT_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                logger.error(f"[packs] Compaction failed: {e}")
+
+pack_store = PackStore()
+
+def _read_packed(blob_id: str, pack_id: int, offset: int, size: int) -> bytes:
+    """Read a packed blob; if its pack was compacted away meanwhile, look up the new location once."""
+    try:
+        return pack_store.read(pack_id, offset, size)
+    except FileNotFoundError:
+        with engine.connect() as conn:
+            row = conn.execute(text("select pack_id, pack_offset from blobs where blob_id=:b"), {"b": blob_id}).first()
+        if row is None or row.pack_id is None:
+            raise
+        return pack_store.read(row.pack_id, row.pack_offset, size)
+
+def _blob_source(blob_id: str):
+    """A blob's bytes if it is packed, else its file path (for readers that take either)."""
+    with engine.connect() as conn:
+        row = conn.execute(text("select pack_id, pack_offset, size from blobs where blob_id=:b"), {"b": blob_id}).first()
+    if row is not None and row.pack_id is not None:
+        return _read_packed(blob_id, row.pack_id, row.pack_offset, row.size)
+    return str(_blob_path(blob_id))
+
+def _pack_blob(blob_id: str, data: bytes) -> Optional[Tuple[int, int]]:
+    """Append a newly referenced blob to a pack (caller holds _blob_files_lock); returns where, for
+    _record_pack, or None if there is nothing to store."""
+    with engine.connect() as conn:
+        stored = conn.execute(text("select pack_id from blobs where blob_id=:b"), {"b": blob_id}).first()
+    if stored is None or stored.pack_id is not None:
+        return None  # released again already, or packed by an earlier upload
+    return pack_store.append(blob_id, data)
+
+def _record_pack(blob_id: str, pack_id: int, offset: int):
+    """Point the blob at its pack record. Called without _blob_files_lock so other uploads and the GC
+    don't wait on a commit; a blob released (or packed twice) meanwhile just leaves a hole."""
+    db_writer.submit(lambda conn: conn.execute(
+        text("update blobs set pack_id=:p, pack_offset=:o where blob_id=:b and pack_id is null"),
+        {"p": pack_id, "o": offset, "b": blob_id})).result()
+
+async def _receive_blob(file: UploadFile) -> Tuple[str, int, Path, Optional[bytes]]:
+    """Stream an upload to a temp file, hashing as it goes.
+
+    Returns (blob_id, size, temp path, data); data is kept only when small enough for blob_cache.
+    """
+    tmp = BLOB_DIR / f".upload-{secrets.token_hex(8)}"
+    h = hashlib.sha256()
+    size = 0
+    kept: Optional[List[bytes]] = []
+    try:
+        async with aiofiles.open(tmp, "wb") as f:
+            while True:
+                chunk = await file.read(1024 * 1024)
+                if not chunk: break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(413, f"file larger than {UPLOAD_MAX_BYTES} bytes")
+                h.update(chunk)
+                await f.write(chunk)
+                if kept is not None and size <= blob_cache.item_max:
+                    kept.append(chunk)
+                else:
+                    kept = None
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return h.hexdigest(), size, tmp, b"".join(kept) if kept else None
+
+def _place_blob(tmp: Path, blob_id: str, data: Optional[bytes] = None, mime: Optional[str] = None,
+                created_ms: int = 0):
+    """Move an upload into place once its reference has committed (dropped if already stored).
+
+    Small blobs go into a pack instead when the pack backend is on. With `data`, a newly stored
+    blob is also put in blob_cache so the first round of views skips the disk; `created_ms` must
+    match its blobs.created_at, which /blob sends as Last-Modified.
+    """
+    packed = None
+    with _blob_files_lock:
+        dest = _blob_path(blob_id)
+        if dest.exists():
+            tmp.unlink(missing_ok=True)
+            return
+        if pack_store.accepts(len(data) if data is not None else tmp.stat().st_size):
+            packed = _pack_blob(blob_id, data if data is not None else tmp.read_bytes())
+            tmp.unlink(missing_ok=True)
+            if packed is None:
+                return
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, dest)
+    if packed is not None:
+        _record_pack(blob_id, *packed)
+    if data is not None:
+        blob_cache.put(dest.name, data, created_ms / 1000, mime or "application/octet-stream")
+
+def _blob_ref(conn, blob_id: str, drop_id: str, size: Optional[int], mime: Optional[str], now_ms: int):
+    """Count a reference to a blob; the first drop to store it is recorded as its owner."""
+    conn.execute(text("""
+        insert into blobs(blob_id, drop_id, size, mime, refcount, created_at) values(:b, :d, :s, :m, 1, :now)
+        on conflict(blob_id) do update set refcount = refcount + 1
+    """), {"b": blob_id, "d": drop_id, "s": size or 0, "m": mime, "now": now_ms})
+
+def _blob_unref(conn, blob_ids: List[str]) -> List[str]:
+    """Drop one reference per entry (repeats allowed); returns the blobs nobody references any more."""
+    gone = []
+    for blob_id in blob_ids:
+        refcount = conn.execute(text("update blobs set refcount = refcount - 1 where blob_id=:b returning refcount"),
+                                {"b": blob_id}).scalar()
+        if refcount is not None and refcount <= 0:
+            conn.execute(text("delete from blobs where blob_id=:b"), {"b": blob_id})
+            gone.append(blob_id)
+    return gone
+
+def _release_blobs(blob_ids: List[str]) -> int:
+    """Unlink files whose refcount reached zero, unless an upload referenced them again since."""
+    if not blob_ids:
+        return 0
+    removed = 0
+    with _blob_files_lock:
+        with engine.connect() as conn:
+            live = set(conn.execute(text("select blob_id from blobs where blob_id in :ids")
+                                    .bindparams(bindparam("ids", expanding=True)), {"ids": list(blob_ids)}).scalars())
+        for blob_id in blob_ids:
+            if blob_id in live:
+                continue
+            blob_cache.invalidate([blob_id] + [_variant_path(blob_id, name).name for name in IMAGE_VARIANTS])
+            try:
+                _blob_path(blob_id).unlink(missing_ok=True)
+                for name in IMAGE_VARIANTS:
+                    _variant_path(blob_id, name).unlink(missing_ok=True)
+                removed += 1
+            except Exception as e:
+                logger.error(f"[blob] Failed to delete {blob_id}: {e}")
+    return removed
+
+# --- Schema migrations ---
+# Ordered, append-only. Each step runs once in its own transaction and is recorded in schema_version.
+# Steps stay idempotent so databases created by the old ad-hoc init_db upgrade cleanly.
+def _columns(conn, table: str) -> List[str]:
+    return [r[1] for r in conn.exec_driver_sql(f"pragma table_info({table})").fetchall()]
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    if column not in _columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def _m001_base_tables(conn):
+    conn.exec_driver_sql("""
+    create table if not exists messages(
+        id text primary key,
+        drop_id text not null,
+        seq integer not null,
+        ts integer not null,
+        created_at integer not null,
+        updated_at integer not null,
+        user text,
+        client_id text,
+        message_type text default 'text',
+        text text,
+        blob_id text,
+        mime text,
+        reactions text default '{}',
+        gif_url text,
+        gif_preview text,
+        gif_width integer default 0,
+        gif_height integer default 0,
+        image_url text,
+        image_thumb text
+    );
+    """)
+    conn.exec_driver_sql("""
+    create table if not exists sessions(
+        id text primary key,
+        exp integer not null
+    );
+    """)
+    conn.exec_driver_sql("""
+    create table if not exists streaks(
+        drop_id text primary key,
+        current_streak integer not null default 0,
+        last_m_post text,
+        last_e_post text,
+        last_update_date text,
+        updated_at integer not null
+    );
+    """)
+
+def _m002_replies_and_receipts(conn):
+    _add_column(conn, "messages", "reply_to_seq", "integer")
+    _add_column(conn, "messages", "delivered_at", "integer")
+    _add_column(conn, "messages", "read_at", "integer")
+
+def _m003_change_tracking(conn):
+    # rev = drop version of the row's last change, for delta sync
+    _add_column(conn, "messages", "rev", "integer not null default 0")
+    _add_column(conn, "messages", "changed_at", "integer")
+    conn.exec_driver_sql("update messages set changed_at = updated_at where changed_at is null")
+    conn.exec_driver_sql("create index if not exists ix_messages_drop_rev on messages(drop_id, rev)")
+    conn.exec_driver_sql("create index if not exists ix_messages_drop_changed on messages(drop_id, changed_at)")
+    # Per-drop change counter (changed_at = time of last change); floor/floor_at mark how far back tombstones reach
+    conn.exec_driver_sql("""
+    create table if not exists drop_versions(
+        drop_id text primary key,
+        version integer not null default 0,
+        floor integer not null default 0,
+        floor_at integer not null default 0,
+        changed_at integer not null default 0
+    );
+    """)
+    conn.exec_driver_sql("""
+    create table if not exists tombstones(
+        drop_id text not null,
+        seq integer not null,
+        rev integer not null,
+        deleted_at integer not null,
+        primary key(drop_id, seq)
+    );
+    """)
+    conn.exec_driver_sql("create index if not exists ix_tombstones_drop_rev on tombstones(drop_id, rev)")
+    conn.exec_driver_sql("create index if not exists ix_tombstones_drop_deleted on tombstones(drop_id, deleted_at)")
+
+def _m004_unique_seq(conn):
+    # The old max(seq)+1 allocator could race, so renumber duplicates before adding the unique index
+    dups = conn.exec_driver_sql(
+        "select drop_id, seq from messages group by drop_id, seq having count(*) > 1").fetchall()
+    for drop_id, seq in dups:
+        ids = conn.execute(text("select id from messages where drop_id=:d and seq=:s order by ts, id"),
+                           {"d": drop_id, "s": seq}).scalars().all()
+        for msg_id in ids[1:]:
+            conn.execute(text("""
+                update messages set seq = (select max(seq) + 1 from messages where drop_id = :d)
+                where id = :id
+            """), {"d": drop_id, "id": msg_id})
+        logger.warning(f"[migrate] Renumbered {len(ids) - 1} duplicate seq={seq} in drop={drop_id}")
+    # Also serves every "where drop_id = ? order by seq" query
+    conn.exec_driver_sql("create unique index if not exists ux_messages_drop_seq on messages(drop_id, seq)")
+
+def _m005_hot_query_indexes(conn):
+    # delete_image / blob lookups by (drop_id, blob_id)
+    conn.exec_driver_sql("""
+        create index if not exists ix_messages_drop_blob on messages(drop_id, blob_id)
+        where blob_id is not null
+    """)
+    # Read receipts only ever touch unread rows
+    conn.exec_driver_sql("""
+        create index if not exists ix_messages_unread on messages(drop_id, seq)
+        where read_at is null
+    """)
+    conn.exec_driver_sql("analyze")
+
+def _m006_blob_size(conn):
+    # Bytes on disk per image message, for the per-drop blob budget in retention
+    _add_column(conn, "messages", "blob_size", "integer")
+    rows = conn.exec_driver_sql("select id, blob_id from messages where blob_id is not null and blob_size is null").all()
+    for msg_id, blob_id in rows:
+        try:
+            size = (BLOB_DIR / blob_id).stat().st_size
+        except OSError:
+            size = 0
+        conn.execute(text("update messages set blob_size=:s where id=:i"), {"s": size, "i": msg_id})
+
+# Migrations keep the on-disk layout of their own schema version inline (no _blob_path & co.),
+# so later changes to the live helpers cannot change what an old step does.
+
+def _m007_content_addressed_blobs(conn):
+    # Blobs are stored once under their sha256 and shared by refcount
+    conn.exec_driver_sql("""
+    create table if not exists blobs(
+        blob_id text primary key,
+        size integer not null,
+        mime text,
+        refcount integer not null default 0,
+        created_at integer not null
+    );
+    """)
+    # Rehash legacy token-named files. They are hard-linked (not moved) under the digest so a
+    # failed migration leaves the old names intact; the unreferenced old names are left behind.
+    now_ms = int(time.time() * 1000)
+    legacy = conn.exec_driver_sql("select distinct blob_id from messages where blob_id is not null").scalars().all()
+    for old_id in legacy:
+        if re.fullmatch(r"[0-9a-f]{64}", old_id):
+            continue
+        src = BLOB_DIR / old_id
+        if not src.is_file():
+            continue
+        digest = _hash_file(src)
+        # Flat BLOB_DIR/<sha256> at this version; m009 moves these into shards
+        dest = BLOB_DIR / digest
+        if not dest.exists():
+            try:
+                os.link(src, dest)
+            except OSError:
+                shutil.copyfile(src, dest)
+        drops = conn.execute(text("select distinct drop_id from messages where blob_id=:b"), {"b": old_id}).scalars().all()
+        for drop_id in drops:
+            # Clients holding /blob/<old id> URLs learn the new ones through delta sync
+            version = conn.execute(text("""
+                insert into drop_versions(drop_id, version, changed_at) values(:d, 1, :now)
+                on conflict(drop_id) do update set version = version + 1, changed_at = :now
+                returning version
+            """), {"d": drop_id, "now": now_ms}).scalar()
+            conn.execute(text("""
+                update messages set blob_id = :new, rev = :v, changed_at = :now,
+                    image_url = case when image_url = :old_url then :new_url else image_url end,
+                    image_thumb = case when image_thumb = :old_url then :new_url else image_thumb end
+                where drop_id = :d and blob_id = :old
+            """), {"new": digest, "v": version, "now": now_ms, "d": drop_id, "old": old_id,
+                   "old_url": f"/blob/{old_id}", "new_url": f"/blob/{digest}"})
+    conn.exec_driver_sql("""
+        insert into blobs(blob_id, size, mime, refcount, created_at)
+        select blob_id, coalesce(max(blob_size), 0), max(mime), count(*), min(created_at)
+        from messages where blob_id is not null group by blob_id
+        on conflict(blob_id) do update set refcount = excluded.refcount
+    """)
+
+def _m008_image_variants(conn):
+    # blobs.variants: comma list of rendered IMAGE_VARIANTS (null = not processed yet)
+    _add_column(conn, "blobs", "variants", "text")
+    _add_column(conn, "messages", "image_medium", "text")
+
+def _m009_sharded_blobs(conn):
+    # Owner drop per blob (the first drop that stored it), for per-drop listings and cleanup
+    _add_column(conn, "blobs", "drop_id", "text")
+    conn.exec_driver_sql("""
+        update blobs set drop_id = (
+            select m.drop_id from messages m where m.blob_id = blobs.blob_id order by m.created_at limit 1
+        ) where drop_id is null
+    """)
+    conn.exec_driver_sql("create index if not exists ix_blobs_drop on blobs(drop_id)")
+    # Move flat BLOB_DIR/<id>[.<variant>.jpg] files into their shard. Safe to repeat after a
+    # crash: moved files are no longer at the top level, and lookups only use the sharded paths.
+    moved = 0
+    for entry in os.scandir(BLOB_DIR):
+        m = re.fullmatch(r"([0-9a-f]{64})(\.[a-z]+\.jpg)?", entry.name)
+        if not m or not entry.is_file():
+            continue
+        # Sharded layout of this version: BLOB_DIR/ab/cd/<id>[.<variant>.jpg]
+        digest = m.group(1)
+        dest = BLOB_DIR / digest[:2] / digest[2:4] / entry.name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(entry.path, dest)
+        moved += 1
+    if moved:
+        logger.info(f"[migrate] Moved {moved} blob files into the sharded layout")
+
+def _m010_upload_sessions(conn):
+    # Resumable uploads: bytes so far live in BLOB_DIR/.upload-<upload_id>; blob_id is set on commit.
+    # lease/lease_until: the one request (in any worker) currently appending, and until when.
+    # claimed_at: attached to a message; the row (and so the temp file, for the GC) stays until placed
+    conn.exec_driver_sql("""
+    create table if not exists uploads(
+        upload_id text primary key,
+        drop_id text not null,
+        size integer not null,
+        received integer not null default 0,
+        mime text,
+        filename text,
+        blob_id text,
+        lease text,
+        lease_until integer,
+        claimed_at integer,
+        created_at integer not null,
+        updated_at integer not null
+    );
+    """)
+    conn.exec_driver_sql("create index if not exists ix_uploads_updated on uploads(updated_at)")
+
+def _m011_gc_state(conn):
+    # Resume points for background scans (e.g. the blob GC's shard cursor)
+    conn.exec_driver_sql("""
+    create table if not exists gc_state(
+        name text primary key,
+        cursor text not null default '',
+        updated_at integer not null
+    );
+    """)
+
+def _m012_blob_packs(conn):
+    # Location of blobs stored in pack files (null = a file of its own)
+    _add_column(conn, "blobs", "pack_id", "integer")
+    _add_column(conn, "blobs", "pack_offset", "integer")
+    conn.exec_driver_sql("create index if not exists ix_blobs_pack on blobs(pack_id) where pack_id is not null")
+
+def _m013_rate_limits(conn):
+    # Token-bucket state for RATE_LIMIT_BACKEND=sqlite (tokens left as of updated_at)
+    conn.exec_driver_sql("""
+    create table if not exists rate_limits(
+        scope text not null,
+        key text not null,
+        tokens real not null,
+        updated_at real not null,
+        expires_at integer not null,
+        primary key (scope, key)
+    );
+    """)
+    conn.exec_driver_sql("create index if not exists ix_rate_limits_expires on rate_limits(scope, expires_at)")
+
+def _m014_hub_events(conn):
+    # Cross-process WebSocket fan-out for HUB_BACKEND=sqlite
+    conn.exec_driver_sql("""
+    create table if not exists hub_events(
+        id integer primary key autoincrement,
+        message text not null,
+        created_at integer not null
+    );
+    """)
+    conn.exec_driver_sql("create index if not exists ix_hub_events_created on hub_events(created_at)")
+
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "reply and receipt columns", _m002_replies_and_receipts),
+    (3, "change tracking for delta sync", _m003_change_tracking),
+    (4, "unique (drop_id, seq)", _m004_unique_seq),
+    (5, "hot query indexes", _m005_hot_query_indexes),
+    (6, "blob sizes", _m006_blob_size),
+    (7, "content-addressed blobs", _m007_content_addressed_blobs),
+    (8, "image variants", _m008_image_variants),
+    (9, "sharded blob layout", _m009_sharded_blobs),
+    (10, "upload sessions", _m010_upload_sessions),
+    (11, "gc state", _m011_gc_state),
+    (12, "blob pack files", _m012_blob_packs),
+    (13, "rate limit state", _m013_rate_limits),
+    (14, "hub events", _m014_hub_events),
+]
+
 def init_db():
     # Create parent dir
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with engine.begin() as conn:
-        conn.exec_driver_sql("""
-        create table if not exists messages(
-            id text primary key,
-            drop_id text not null,
-            seq integer not null,
-            ts integer not null,
-            created_at integer not null,
-            updated_at integer not null,
-            user text,
-            client_id text,
-            message_type text default 'text',
-            text text,
-            blob_id text,
-            mime text,
-            reactions text default '{}',
-            gif_url text,
-            gif_preview text,
-            gif_width integer default 0,
-            gif_height integer default 0,
-            image_url text,
-            image_thumb text,
-            reply_to_seq integer,
-            delivered_at integer,
-            read_at integer
-        );
-        """)
-        
-        # Migration: Add new columns if they don't exist (for existing databases)
+    # One process migrates at a time (several steps move files and are not idempotent); the
+    # others wait here and then find schema_version already current
+    with _data_dir_lock("migrate"):
+        with write_engine.begin() as conn:
+            conn.exec_driver_sql("""
+            create table if not exists schema_version(
+                version integer primary key,
+                name text not null,
+                applied_at integer not null
+            );
+            """)
+            current = conn.exec_driver_sql("select coalesce(max(version), 0) from schema_version").scalar()
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            with write_engine.begin() as conn:
+                step(conn)
+                conn.execute(text("insert into schema_version(version, name, applied_at) values(:v, :n, :t)"),
+                             {"v": version, "n": name, "t": int(time.time())})
+            logger.info(f"[migrate] Applied schema version {version}: {name}")
+
+init_db()
+
+# --- Database writer (group commit) ---
+DB_WRITE_MAX_BATCH = int(os.environ.get("DB_WRITE_MAX_BATCH", "64"))
+DB_WRITE_MAX_LATENCY_MS = float(os.environ.get("DB_WRITE_MAX_LATENCY_MS", "2"))
+
+class DBWriter:
+    """Single writer thread that commits queued write ops in batches.
+
+    Each op is a function taking a connection; it runs inside its own SAVEPOINT so a
+    failing op (e.g. a 404 or a seq conflict) rolls back alone while the rest of its
+    batch shares one commit. Callers get a future with the op's return value.
+
+    An op may append prepare(conn) callables to conn.info["on_commit"]. They run as the op
+    finishes, still inside its transaction, and return a function that is called once the
+    batch has committed - in commit order, before any caller's future resolves.
+    """
+    def __init__(self, max_batch: int = DB_WRITE_MAX_BATCH, max_latency_ms: float = DB_WRITE_MAX_LATENCY_MS):
+        self.max_batch = max(1, max_batch)
+        self.max_latency = max(0.0, max_latency_ms) / 1000.0
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"ops": 0, "failed": 0, "cancelled": 0, "commits": 0, "maxBatch": 0, "lingered": 0}
+
+    def _ensure_started(self):
+        if self.thread and self.thread.is_alive():
+            return
+        with self._start_lock:
+            if not (self.thread and self.thread.is_alive()):
+                self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self.thread.start()
+
+    def submit(self, op) -> concurrent.futures.Future:
+        self._ensure_started()
+        fut: concurrent.futures.Future = concurrent.futures.Future()
+        self.queue.put((op, fut))
+        return fut
+
+    async def run(self, op):
+        """Queue a write op and await its result from async code."""
+        return await asyncio.wrap_future(self.submit(op))
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Take whatever queued up during the last commit. Only then, when writes are actually
+            # contended, linger briefly so the rest of a burst shares the commit too; a lone write
+            # commits straight away instead of paying the latency for nothing.
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if len(batch) > 1:
+                self.stats["lingered"] += 1
+                deadline = time.monotonic() + self.max_latency
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        committed = []
         try:
-            conn.exec_driver_sql("ALTER TABLE messages ADD COLUMN reply_to_seq integer")
-        except Exception:
-            pass
+            with write_engine.begin() as conn:
+                for op, fut in batch:
+                    # Skip ops whose caller has already gone away (e.g. a cancelled request)
+                    if not fut.set_running_or_notify_cancel():
+                        self.stats["cancelled"] += 1
+                        continue
+                    savepoint = conn.begin_nested()
+                    conn.info["on_commit"] = []
+                    try:
+                        value = op(conn)
+                        after = [prepare(conn) for prepare in conn.info["on_commit"]]
+                        savepoint.commit()
+                        committed.extend(after)
+                        results.append((fut, value, None))
+                    except BaseException as e:
+                        savepoint.rollback()
+                        results.append((fut, None, e))
+        except Exception as e:
+            logger.error(f"[db-writer] Commit of {len(batch)} op(s) failed: {e}")
+            for _, fut in batch:
+                if fut.running():
+                    self.stats["failed"] += 1
+                    fut.set_exception(e)
+            return
+        self.stats["commits"] += 1
+        self.stats["ops"] += len(results)
+        self.stats["maxBatch"] = max(self.stats["maxBatch"], len(results))
+        for fn in committed:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"[db-writer] Post-commit hook failed: {e}")
+        for fut, value, err in results:
+            if err is not None:
+                self.stats["failed"] += 1
+                fut.set_exception(err)
+            else:
+                fut.set_result(value)
+
+db_writer = DBWriter()
+
+# --- Database readers ---
+class DBReader:
+    """Runs read-only ops on a bounded thread pool so queries never block the event loop.
+
+    Each op gets its own connection and a single read transaction, so with WAL it sees
+    one consistent snapshot (e.g. the drop version and its rows) while the writer commits.
+    """
+    def __init__(self, threads: int = DB_READ_THREADS):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="db-read")
+
+    def _call(self, op):
+        with engine.connect() as conn:
+            return op(conn)
+
+    async def run(self, op):
+        """Run op(conn) off the event loop and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self._call, op)
+
+db_reader = DBReader()
+
+# --- Rate limiting ---
+# Per-key token buckets for unlock attempts and notification debouncing. "sqlite" keeps them in
+# the database so limits survive restarts and are shared between worker processes.
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "10000"))
+RATE_LIMIT_SWEEP_SECONDS = float(os.environ.get("RATE_LIMIT_SWEEP_SECONDS", "60"))
+
+class RateLimiter:
+    """A token bucket per key: `limit` hits at once, refilled at limit/window per second, so a key
+    hitting steadily gets `limit` hits per `window` (limit=1 is a plain one-per-window debounce).
+
+    A key's state is (tokens left, last update), so every check is O(1). An idle key is full again
+    after one window, the same as having no entry, and a background sweep every
+    RATE_LIMIT_SWEEP_SECONDS drops such keys. In memory, keys are ordered by last use, so the sweep
+    pops from the front and beyond `max_keys` the least recently used key is dropped. The sqlite
+    backend keeps the same state in rate_limits: a hit is one writer op, and a check that records
+    nothing is a db_reader query.
+    """
+    def __init__(self, scope: str, limit: int, window: float,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS, backend: str = RATE_LIMIT_BACKEND):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.persistent = backend == "sqlite"
+        self.keys: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"allowed": 0, "limited": 0, "evictions": 0, "expired": 0}
+
+    def _tokens(self, state: Optional[Tuple[float, float]], now: float) -> float:
+        if state is None:
+            return float(self.limit)
+        tokens, updated = state
+        return min(float(self.limit), tokens + (now - updated) * self.limit / self.window)
+
+    def _take(self, state: Optional[Tuple[float, float]], now: float, enforce: bool) -> Optional[Tuple[float, float]]:
+        """The state after one hit, or None if enforcing and the bucket is empty."""
+        tokens = self._tokens(state, now)
+        if tokens < 1 and enforce:
+            return None
+        return max(0.0, tokens - 1), now
+
+    def _hit(self, key: str, now: float, enforce: bool) -> bool:
+        state = self._take(self.keys.get(key), now, enforce)
+        if state is None:
+            return False
+        self.keys[key] = state
+        self.keys.move_to_end(key)
+        while len(self.keys) > self.max_keys:
+            self.keys.popitem(last=False)
+            self.stats["evictions"] += 1
+        return True
+
+    def _hit_db(self, conn, key: str, now: float, enforce: bool) -> bool:
+        row = conn.execute(text("select tokens, updated_at from rate_limits where scope=:s and key=:k"),
+                           {"s": self.scope, "k": key}).first()
+        state = self._take(tuple(row) if row else None, now, enforce)
+        if state is None:
+            return False
+        tokens, updated = state
+        conn.execute(text("""
+            insert into rate_limits(scope, key, tokens, updated_at, expires_at) values(:s, :k, :t, :u, :e)
+            on conflict(scope, key) do update set tokens = :t, updated_at = :u, expires_at = :e
+        """), {"s": self.scope, "k": key, "t": tokens, "u": updated,
+               "e": int(updated + (self.limit - tokens) * self.window / self.limit) + 1})
+        return True
+
+    async def _record(self, key: str, enforce: bool) -> bool:
+        now = time.time()
+        if self.persistent:
+            return await db_writer.run(lambda conn: self._hit_db(conn, key, now, enforce))
+        return self._hit(key, now, enforce)
+
+    async def allow(self, key: str) -> bool:
+        """Record a hit for key unless it is already at the limit; True if it was recorded."""
+        allowed = await self._record(key, True)
+        self.stats["allowed" if allowed else "limited"] += 1
+        return allowed
+
+    async def exceeded(self, key: str) -> bool:
+        """True if key is at the limit; records nothing."""
+        now = time.time()
+        if self.persistent:
+            row = await db_reader.run(lambda conn: conn.execute(
+                text("select tokens, updated_at from rate_limits where scope=:s and key=:k"),
+                {"s": self.scope, "k": key}).first())
+            state = tuple(row) if row else None
+        else:
+            state = self.keys.get(key)
+        limited = self._tokens(state, now) < 1
+        if limited:
+            self.stats["limited"] += 1
+        return limited
+
+    async def add(self, key: str):
+        """Record a hit unconditionally (e.g. a failed attempt)."""
+        await self._record(key, False)
+
+    async def reset(self, key: str):
+        if self.persistent:
+            await db_writer.run(lambda conn: conn.execute(
+                text("delete from rate_limits where scope=:s and key=:k"), {"s": self.scope, "k": key}))
+        else:
+            self.keys.pop(key, None)
+
+    def _sweep_db(self, conn, now: float) -> Tuple[int, int]:
+        gone = conn.execute(text("delete from rate_limits where scope=:s and expires_at < :now"),
+                            {"s": self.scope, "now": int(now)}).rowcount
+        over = conn.execute(text("""
+            delete from rate_limits where scope=:s and key in (
+                select key from rate_limits where scope=:s order by expires_at desc limit -1 offset :n)
+        """), {"s": self.scope, "n": self.max_keys}).rowcount
+        return max(0, gone), max(0, over)
+
+    async def sweep(self):
+        """Drop keys whose bucket has refilled (idle for a whole window)."""
+        now = time.time()
+        if self.persistent:
+            gone, over = await db_writer.run(lambda conn: self._sweep_db(conn, now))
+            self.stats["expired"] += gone
+            self.stats["evictions"] += over
+            return
+        while self.keys:
+            key, (_, updated) = next(iter(self.keys.items()))
+            if now - updated < self.window:
+                break
+            del self.keys[key]
+            self.stats["expired"] += 1
+
+    def start(self):
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RATE_LIMIT_SWEEP_SECONDS)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"[ratelimit] Sweep of {self.scope} failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "keys": len(self.keys), "backend": "sqlite" if self.persistent else "memory"}
+
+# --- Outbound HTTP ---
+# One pooled client for every upstream call (camera relay, external fetches)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "16"))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_MAX_PER_HOST = max(1, int(os.environ.get("HTTP_MAX_PER_HOST", "8")))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+HTTP_CLIENT_HTTP2 = os.environ.get("HTTP_CLIENT_HTTP2", "false").lower() == "true"
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that gives its host slot back once the body is closed."""
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
         try:
-            conn.exec_driver_sql("ALTER TABLE messages ADD COLUMN delivered_at integer")
-        except Exception:
-            pass
+            await self.stream.aclose()
+        finally:
+            if self.release is not None:
+                self.release()
+                self.release = None
+
+class _PerHostTransport(httpx.AsyncBaseTransport):
+    """Pooled transport that also caps in-flight requests per host (httpx only limits the pool as a whole)."""
+    def __init__(self, per_host: int, **kwargs):
+        self.inner = httpx.AsyncHTTPTransport(**kwargs)
+        self.per_host = per_host
+        self.slots: Dict[Tuple[bytes, bytes, Optional[int]], asyncio.Semaphore] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = (request.url.raw_scheme, request.url.raw_host, request.url.port)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = asyncio.Semaphore(self.per_host)
+        await slot.acquire()
         try:
-            conn.exec_driver_sql("ALTER TABLE messages ADD COLUMN read_at integer")
-        except Exception:
-            pass
-        
-        conn.exec_driver_sql("""
-        create table if not exists sessions(
-            id text primary key,
-            exp integer not null
-        );
-        """)
-        conn.exec_driver_sql("""
-        create table if not exists streaks(
-            drop_id text primary key,
-            current_streak integer not null default 0,
-            last_m_post text,
-            last_e_post text,
-            last_update_date text,
-            updated_at integer not null
-        );
-        """)
+            response = await self.inner.handle_async_request(request)
+        except BaseException:
+            slot.release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, slot.release),
+            extensions=response.extensions,
+        )
 
-init_db()
+    async def aclose(self):
+        await self.inner.aclose()
+
+class OutboundHTTP:
+    """Application-scoped httpx client with keep-alive pooling and connection-reuse counters.
+
+    Opened at startup and closed at shutdown; client() also (re)builds it lazily, e.g. when
+    used from a different event loop. `reused` counts requests that did not open a new
+    connection.
+    """
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"requests": 0, "connects": 0, "tlsHandshakes": 0, "errors": 0, "http2": False}
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client, self._loop = self._build(), loop
+        return self._client
+
+    def _build(self) -> httpx.AsyncClient:
+        http2 = HTTP_CLIENT_HTTP2 and h2 is not None
+        if HTTP_CLIENT_HTTP2 and h2 is None:
+            logger.warning("[http] HTTP_CLIENT_HTTP2 set but the h2 package is not installed; using HTTP/1.1")
+        self.stats["http2"] = http2
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                              max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                              keepalive_expiry=HTTP_KEEPALIVE_SECONDS)
+        return httpx.AsyncClient(
+            transport=_PerHostTransport(HTTP_MAX_PER_HOST, limits=limits, http2=http2),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [self._on_request]},
+        )
+
+    async def _on_request(self, request: httpx.Request):
+        self.stats["requests"] += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.stats["connects"] += 1
+        elif event_name == "connection.start_tls.complete":
+            self.stats["tlsHandshakes"] += 1
+        elif event_name.endswith(".failed"):
+            self.stats["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "reused": max(0, self.stats["requests"] - self.stats["connects"])}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+http_out = OutboundHTTP()
+
+@app.on_event("startup")
+async def _open_http_client():
+    http_out.client()
+
+@app.on_event("shutdown")
+async def _close_http_client():
+    await http_out.aclose()
 
 # --- Twilio notifications ---
-_last_notify: Dict[str, int] = {}
+# SMS goes out from a background worker so a slow Twilio round-trip never blocks the event loop
+TWILIO_API_BASE = os.environ.get("TWILIO_API_BASE", "https://api.twilio.com").rstrip("/")
+NOTIFY_COALESCE_SECONDS = float(os.environ.get("NOTIFY_COALESCE_SECONDS", "3"))
+NOTIFY_MAX_ATTEMPTS = max(1, int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "4")))
+NOTIFY_RETRY_SECONDS = float(os.environ.get("NOTIFY_RETRY_SECONDS", "2"))
+NOTIFY_QUEUE_MAX = int(os.environ.get("NOTIFY_QUEUE_MAX", "100"))
 
-def _should_notify(kind: str, drop_id: str, window_sec: int = 60) -> bool:
-    key = f"{kind}:{drop_id}"
-    now = int(time.time())
-    last = _last_notify.get(key, 0)
-    if now - last < window_sec:
-        return False
-    _last_notify[key] = now
-    return True
+# One notification per kind and drop per minute
+notify_limiter = RateLimiter("notify", limit=1, window=60)
 
-def notify(text: str):
-    """Send SMS notification via Twilio"""
-    logger.info(f"[notify] {text}")
-    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_FROM_NUMBER:
-        logger.warning("[notify] Twilio not configured, skipping SMS")
-        return
-    if not NOTIFY_NUMBERS:
-        logger.warning("[notify] No notify numbers configured")
-        return
-    try:
-        from twilio.rest import Client
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        for to_number in NOTIFY_NUMBERS:
+async def _should_notify(kind: str, drop_id: str) -> bool:
+    return await notify_limiter.allow(f"{kind}:{drop_id}")
+
+class SMSDispatcher:
+    """Queues SMS notifications per drop and sends them from one worker task via the Twilio REST API.
+
+    A drop's notification waits NOTIFY_COALESCE_SECONDS before it is sent; anything else for
+    that drop arriving meanwhile is folded into the same SMS. _should_notify already holds each
+    kind to one SMS per drop and minute, so this delay only needs to span one burst (a message
+    and a GIF sent together) and stays short. Each recipient is retried with exponential backoff
+    on transport errors, 429 and 5xx. Requests go through the shared outbound client (http_out).
+    """
+    def __init__(self):
+        self.pending: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.due: Dict[str, float] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.stats = {"queued": 0, "coalesced": 0, "dropped": 0, "sent": 0, "retries": 0, "failed": 0}
+
+    def enqueue(self, text: str, key: str = ""):
+        """Queue text for key (a drop id); must be called from the event loop."""
+        if key in self.pending:
+            if text not in self.pending[key]:
+                self.pending[key].append(text)
+            self.stats["coalesced"] += 1
+            return
+        if len(self.pending) >= NOTIFY_QUEUE_MAX:
+            self.stats["dropped"] += 1
+            logger.warning(f"[notify] Queue full, dropping: {text}")
+            return
+        loop = asyncio.get_running_loop()
+        self.pending[key] = [text]
+        self.due[key] = loop.time() + NOTIFY_COALESCE_SECONDS
+        self.stats["queued"] += 1
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+        self.wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            # Keys share one delay, so insertion order is due order
+            key = next(iter(self.pending))
+            delay = self.due[key] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            texts = self.pending.pop(key)
+            self.due.pop(key, None)
             try:
-                message = client.messages.create(
-                    body=text,
-                    from_=TWILIO_FROM_NUMBER,
-                    to=to_number
-                )
-                logger.info(f"[notify] SMS sent to {to_number}: {message.sid}")
+                await self._send("\n".join(texts))
             except Exception as e:
-                logger.error(f"[notify] Failed to send SMS to {to_number}: {e}")
-    except Exception as e:
-        logger.error(f"[notify] Twilio error: {e}")
+                logger.error(f"[notify] Dispatch failed: {e}")
+
+    async def _send(self, text: str):
+        if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_FROM_NUMBER:
+            logger.warning("[notify] Twilio not configured, skipping SMS")
+            return
+        if not NOTIFY_NUMBERS:
+            logger.warning("[notify] No notify numbers configured")
+            return
+        await asyncio.gather(*(self._send_one(to_number, text) for to_number in NOTIFY_NUMBERS))
+
+    async def _send_one(self, to_number: str, text: str):
+        url = f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+        form = {"To": to_number, "From": TWILIO_FROM_NUMBER, "Body": text}
+        for attempt in range(NOTIFY_MAX_ATTEMPTS):
+            if attempt:
+                self.stats["retries"] += 1
+                await asyncio.sleep(NOTIFY_RETRY_SECONDS * 2 ** (attempt - 1))
+            try:
+                response = await http_out.client().post(url, data=form, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
+            except httpx.HTTPError as e:
+                logger.warning(f"[notify] SMS to {to_number} failed (attempt {attempt + 1}): {e}")
+                continue
+            if response.status_code < 300:
+                self.stats["sent"] += 1
+                logger.info(f"[notify] SMS sent to {to_number} ({response.status_code})")
+                return
+            logger.warning(f"[notify] SMS to {to_number} rejected (attempt {attempt + 1}): {response.status_code} {response.text[:200]}")
+            if response.status_code != 429 and response.status_code < 500:
+                break
+        self.stats["failed"] += 1
+        logger.error(f"[notify] Failed to send SMS to {to_number}")
+
+sms_dispatcher = SMSDispatcher()
+
+def notify(text: str, drop_id: str = ""):
+    """Queue an SMS notification; returns immediately (call from the event loop)."""
+    logger.info(f"[notify] {text}")
+    sms_dispatcher.enqueue(text, drop_id)
 
 # --- Cookies / session ---
 def b64url(data: bytes) -> str:
@@ -203,27 +1384,75 @@ def issue_cookies() -> List[str]:
     ui_cookie = "; ".join(ui_parts)
     return [sess_cookie, ui_cookie]
 
-def _verify_token(token: str) -> bool:
+# Tokens whose signature already checked out, so hot paths skip the decode/HMAC/JSON work
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "1024"))
+
+class TokenCache:
+    """LRU of verified session tokens -> their embedded exp. Only valid signatures are stored,
+    and the exp check still runs on every hit, so expiry behaves exactly as uncached."""
+    def __init__(self, size: int = SESSION_CACHE_SIZE):
+        self.size = size
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, token: str) -> Optional[int]:
+        with self.lock:
+            exp = self.entries.get(token)
+            if exp is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(token)
+            self.stats["hits"] += 1
+            return exp
+
+    def put(self, token: str, exp: int):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[token] = exp
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def discard(self, token: str):
+        with self.lock:
+            self.entries.pop(token, None)
+
+token_cache = TokenCache()
+
+def _token_exp(token: str) -> Optional[int]:
+    """The exp embedded in a correctly signed token, or None."""
     import base64
     try:
         raw = token + "==="
         blob = base64.urlsafe_b64decode(raw)
         dot = blob.find(b".")
         if dot <= 0:
-            return False
+            return None
         payload, mac = blob[:dot], blob[dot+1:]
         if not hmac.compare_digest(sign(payload), mac):
-            return False
+            return None
         data = json.loads(payload.decode("utf-8"))
-        exp_time = int(data.get("exp", 0))
-        current_time = int(time.time())
-        logger.debug(f"Token check: exp={exp_time}, now={current_time}, diff={exp_time - current_time}")
-        if current_time > exp_time:
-            return False
-        return True
+        return int(data.get("exp", 0))
     except Exception as e:
         logger.debug(f"Token verification error: {e}")
+        return None
+
+def _verify_token(token: str) -> bool:
+    exp_time = token_cache.get(token)
+    if exp_time is None:
+        exp_time = _token_exp(token)
+        if exp_time is None:
+            return False
+        token_cache.put(token, exp_time)
+    current_time = int(time.time())
+    if current_time > exp_time:
+        logger.debug(f"Token expired: exp={exp_time}, now={current_time}")
+        token_cache.discard(token)
         return False
+    return True
 
 def require_session(req: Request):
     c = req.cookies.get(SESSION_COOKIE)
@@ -236,6 +1465,19 @@ def require_session(req: Request):
 def health():
     return {"ok": True, "service": "msgdrop-rest"}
 
+@app.get("/api/stats")
+def stats(req: Request = None):
+    """Internal counters for tuning (write batching, caches, ...)"""
+    require_session(req)
+    return {"dbWriter": dict(db_writer.stats), "hotCache": dict(hot_cache.stats), "retention": dict(compactor.stats),
+            "thumbnails": dict(thumbnailer.stats), "blobCache": blob_cache.snapshot(), "blobGc": dict(blob_gc.stats),
+            "packs": {**pack_store.stats, "packs": len(pack_store.pack_ids())},
+            "camera": {**camera_relay.stats, "viewers": len(camera_relay.viewers)},
+            "http": http_out.snapshot(), "notify": dict(sms_dispatcher.stats),
+            "sessions": {**token_cache.stats, "cached": len(token_cache.entries)},
+            "rateLimits": {"unlock": unlock_limiter.snapshot(), "notify": notify_limiter.snapshot()},
+            "hub": hub.snapshot()}
+
 # --- Unlock ---
 class UnlockBody(BaseModel):
     code: str
@@ -248,7 +1490,13 @@ def verify_code(code: str) -> bool:
         return hmac.compare_digest(code, UNLOCK_CODE)
     return False
 
-unlock_attempts: Dict[str, List[int]] = {}
+# 5 failed PINs per client IP, then one more per minute (5 per 5 minutes)
+unlock_limiter = RateLimiter("unlock", limit=5, window=300)
+
+@app.on_event("startup")
+async def _start_rate_limiters():
+    unlock_limiter.start()
+    notify_limiter.start()
 
 def _set_session_cookies(response: Response, token: str):
     # Set HttpOnly session cookie
@@ -275,131 +1523,1114 @@ def _set_session_cookies(response: Response, token: str):
     )
 
 @app.post("/api/unlock")
-def unlock(body: UnlockBody, req: Request, response: Response):
+async def unlock(body: UnlockBody, req: Request, response: Response):
     client_ip = req.client.host if getattr(req, "client", None) else "unknown"
-    now = int(time.time())
 
-    attempts = unlock_attempts.get(client_ip, [])
-    attempts = [t for t in attempts if now - t < 300]
-    if len(attempts) >= 5:
-        raise HTTPException(429, "Too many attempts. Try again in 5 minutes.")
+    if await unlock_limiter.exceeded(client_ip):
+        raise HTTPException(429, "Too many attempts. Try again in a minute.")
 
     code = (body.code or "").strip()
     if not (len(code) == 4 and code.isdigit()):
-        attempts.append(now)
-        unlock_attempts[client_ip] = attempts
+        await unlock_limiter.add(client_ip)
         raise HTTPException(400, "PIN must be 4 digits")
     if not verify_code(code):
-        attempts.append(now)
-        unlock_attempts[client_ip] = attempts
+        await unlock_limiter.add(client_ip)
         raise HTTPException(401, "invalid code")
 
     # Success - clear attempts and issue dual cookies
-    unlock_attempts.pop(client_ip, None)
+    await unlock_limiter.reset(client_ip)
     token = _generate_token()
     _set_session_cookies(response, token)
     return {"success": True}
 
 # --- Chat APIs ---
-@app.get("/api/chat/{drop_id}")
-def list_messages(drop_id: str, limit: int = 200, before: Optional[int] = None, req: Request = None):
-    require_session(req)
-    sql = "select * from messages where drop_id=:d"
-    params = {"d": drop_id}
-    if before:
-        sql += " and ts < :b"; params["b"] = before
-    sql += " order by seq desc limit :n"; params["n"] = max(1, min(500, limit))
-    with engine.begin() as conn:
-        rows = conn.execute(text(sql), params).mappings().all()
-        max_seq = conn.execute(text("select coalesce(max(seq),0) as v from messages where drop_id=:d"), {"d": drop_id}).scalar()
-    rows = list(reversed(rows))
+# Tombstones older than this are pruned; clients syncing from before that fall back to a full snapshot
+TOMBSTONE_TTL_MS = int(os.environ.get("TOMBSTONE_TTL_SECONDS", "86400")) * 1000
+
+def _message_out(o: Dict[str, Any]) -> Dict[str, Any]:
+    """Transform DB fields (snake_case) to frontend format (camelCase)"""
+    msg = {
+        "message": o.get("text"),
+        "seq": o.get("seq"),
+        "createdAt": o.get("created_at"),
+        "updatedAt": o.get("updated_at"),
+        "user": o.get("user"),
+        "clientId": o.get("client_id"),
+        "messageType": o.get("message_type"),
+        "reactions": json.loads(o.get("reactions") or "{}"),
+        "gifUrl": o.get("gif_url"),
+        "gifPreview": o.get("gif_preview"),
+        "gifWidth": o.get("gif_width"),
+        "gifHeight": o.get("gif_height"),
+        "imageUrl": o.get("image_url"),
+        "imageThumb": o.get("image_thumb"),
+        "imageMedium": o.get("image_medium"),
+        # Reply and receipt fields
+        "replyToSeq": o.get("reply_to_seq"),
+        "deliveredAt": o.get("delivered_at"),
+        "readAt": o.get("read_at"),
+    }
+    if o.get("blob_id"):
+        msg["img"] = f"/blob/{o['blob_id']}"
+    return msg
+
+def _image_out(o: Dict[str, Any]) -> Dict[str, Any]:
+    url = f"/blob/{o['blob_id']}"
+    return {
+        "imageId": o["blob_id"],
+        "seq": o.get("seq"),
+        "mime": o.get("mime"),
+        "originalUrl": url,
+        "thumbUrl": o.get("image_thumb") or url,
+        "mediumUrl": o.get("image_medium") or url,
+        "uploadedAt": o.get("ts"),
+    }
+
+def _drop_payload(drop_id: str, rows, version: int) -> Dict[str, Any]:
+    """Build the {dropId, version, messages, images} payload from message rows (ascending seq)"""
     out = []
     images = []
     for r in rows:
         o = dict(r)
-        # Transform DB fields (snake_case) to frontend format (camelCase)
-        msg = {
-            "message": o.get("text"),
-            "seq": o.get("seq"),
-            "createdAt": o.get("created_at"),
-            "updatedAt": o.get("updated_at"),
-            "user": o.get("user"),
-            "clientId": o.get("client_id"),
-            "messageType": o.get("message_type"),
-            "reactions": json.loads(o.get("reactions") or "{}"),
-            "gifUrl": o.get("gif_url"),
-            "gifPreview": o.get("gif_preview"),
-            "gifWidth": o.get("gif_width"),
-            "gifHeight": o.get("gif_height"),
-            "imageUrl": o.get("image_url"),
-            "imageThumb": o.get("image_thumb"),
-            # Reply and receipt fields
-            "replyToSeq": o.get("reply_to_seq"),
-            "deliveredAt": o.get("delivered_at"),
-            "readAt": o.get("read_at"),
-        }
+        out.append(_message_out(o))
         if o.get("blob_id"):
-            msg["img"] = f"/blob/{o['blob_id']}"
-            images.append({
-                "imageId": o["blob_id"],
-                "mime": o.get("mime"),
-                "originalUrl": msg["img"],
-                "thumbUrl": msg["img"],
-                "uploadedAt": o.get("ts"),
-            })
-        out.append(msg)
-    return {"dropId": drop_id, "version": int(max_seq or 0), "messages": out, "images": images}
+            images.append(_image_out(o))
+    return {"dropId": drop_id, "version": int(version or 0), "messages": out, "images": images}
+
+def _delta_payload(drop_id: str, since: Optional[int], version: int, rows=(), deleted=()) -> Dict[str, Any]:
+    """Like _drop_payload but only the rows changed and the seqs deleted after `since`"""
+    payload = _drop_payload(drop_id, rows, version)
+    payload.update({"delta": True, "since": since, "deleted": list(deleted)})
+    return payload
+
+def _get_version(conn, drop_id: str) -> Dict[str, int]:
+    row = conn.execute(text("select version, floor, floor_at, changed_at from drop_versions where drop_id=:d"),
+                       {"d": drop_id}).mappings().first()
+    if not row:
+        return {"version": 0, "floor": 0, "floor_at": 0, "changed_at": 0}
+    return {k: int(row[k] or 0) for k in ("version", "floor", "floor_at", "changed_at")}
+
+def _bump_version(conn, drop_id: str, now_ms: Optional[int] = None) -> int:
+    """Advance the drop's change version (any insert/edit/reaction/read/delete) and return it."""
+    now_ms = now_ms or int(time.time() * 1000)
+    version = int(conn.execute(text("""
+        insert into drop_versions(drop_id, version, changed_at) values(:d, 1, :now)
+        on conflict(drop_id) do update set version = version + 1, changed_at = :now
+        returning version
+    """), {"d": drop_id, "now": now_ms}).scalar())
+    # Mirror the change into the hot cache once it commits (see DBWriter)
+    conn.info.setdefault("on_commit", []).append(lambda c: hot_cache.capture(c, drop_id, version))
+    return version
+
+def _record_deletes(conn, drop_id: str, seqs: List[int], rev: int, now_ms: int):
+    """Leave tombstones so delta clients learn about removed seqs."""
+    for s in seqs:
+        conn.execute(text("insert or replace into tombstones(drop_id, seq, rev, deleted_at) values(:d, :s, :r, :now)"),
+                     {"d": drop_id, "s": s, "r": rev, "now": now_ms})
+
+class SeqAllocator:
+    """Per-drop seq counters held in memory; the DB max is read once per drop.
+
+    Backed by the unique (drop_id, seq) index: if another writer got there first
+    the insert fails, the counter is reloaded and the insert retried.
+    """
+    def __init__(self):
+        self._next: Dict[str, int] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, drop_id: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(drop_id, threading.Lock())
+
+    def allocate(self, conn, drop_id: str) -> int:
+        with self._lock(drop_id):
+            next_seq = self._next.get(drop_id)
+            if next_seq is None:
+                next_seq = int(conn.execute(text("select coalesce(max(seq),0)+1 from messages where drop_id=:d"),
+                                            {"d": drop_id}).scalar() or 1)
+            self._next[drop_id] = next_seq + 1
+            return next_seq
+
+    def reset(self, drop_id: str):
+        with self._lock(drop_id):
+            self._next.pop(drop_id, None)
+
+seq_allocator = SeqAllocator()
+
+async def _insert_message(drop_id: str, values: Dict[str, Any], attempts: int = 3,
+                          claim=None) -> Tuple[Dict[str, Any], int]:
+    """Insert a message under the next seq for the drop. Returns (row, version).
+
+    `claim(conn)`, if given, runs first in the same transaction (e.g. consuming an upload session).
+    """
+    def write(conn):
+        if claim:
+            claim(conn)
+        next_seq = seq_allocator.allocate(conn, drop_id)
+        version = _bump_version(conn, drop_id, values.get("updated_at"))
+        row = dict(values, drop_id=drop_id, seq=next_seq, rev=version, changed_at=values.get("updated_at"))
+        if row.get("blob_id"):
+            _blob_ref(conn, row["blob_id"], drop_id, row.get("blob_size"), row.get("mime"), row["created_at"])
+            # A re-uploaded image can use variants rendered the first time
+            if row.get("message_type") == "image":
+                row.update(_variant_urls(conn, row["blob_id"]))
+        cols = ",".join(row.keys())
+        binds = ",".join(f":{k}" for k in row.keys())
+        conn.execute(text(f"insert into messages({cols}) values({binds})"), row)
+        # A reused seq (e.g. after a restart) supersedes its tombstone
+        conn.execute(text("delete from tombstones where drop_id=:d and seq=:s"), {"d": drop_id, "s": next_seq})
+        return row, version
+    for attempt in range(attempts):
+        try:
+            return await db_writer.run(write)
+        except IntegrityError:
+            logger.warning(f"[seq] Conflict on drop={drop_id}, reloading counter (attempt {attempt + 1})")
+            seq_allocator.reset(drop_id)
+    raise HTTPException(503, "could not allocate message seq")
+
+def _mark_read(conn, drop_id: str, up_to_seq: int, reader: str, now_ms: int) -> Tuple[int, Optional[int]]:
+    """Mark messages from the OTHER user as read up to seq; returns (rows updated, new drop version or None)."""
+    seqs = conn.execute(text("""
+        SELECT seq FROM messages
+        WHERE drop_id = :d
+          AND seq <= :seq
+          AND user != :reader
+          AND read_at IS NULL
+    """), {"d": drop_id, "seq": up_to_seq, "reader": reader}).scalars().all()
+    if not seqs:
+        return 0, None
+    version = _bump_version(conn, drop_id, now_ms)
+    result = conn.execute(text("""
+        UPDATE messages
+        SET read_at = :now, rev = :v, changed_at = :now
+        WHERE drop_id = :d
+          AND seq <= :seq
+          AND user != :reader
+          AND read_at IS NULL
+    """), {"now": now_ms, "v": version, "d": drop_id, "seq": up_to_seq, "reader": reader})
+    return result.rowcount, version
+
+def _read_receipt(up_to_seq: int, reader: str, now_ms: int, version: Optional[int]) -> Dict[str, Any]:
+    """read_receipt frame; with the version it produced so clients stay in step with the delta stream."""
+    data = {"upToSeq": up_to_seq, "reader": reader, "readAt": now_ms}
+    if version is not None:
+        data.update(version=version, since=version - 1)
+    return {"type": "read_receipt", "data": data}
+
+def _load_delta(conn, drop_id: str, state: Dict[str, int], limit: int,
+                since: Optional[int], since_at: Optional[int]) -> Optional[Dict[str, Any]]:
+    """Changes after a version (or updatedAt ms); None means the client needs a full snapshot."""
+    if since is not None:
+        if since < state["floor"] or since > state["version"]:
+            return None
+        col, tcol, mark = "rev", "rev", since
+    else:
+        if since_at < state["floor_at"]:
+            return None
+        col, tcol, mark = "changed_at", "deleted_at", since_at
+    rows = conn.execute(text(f"select * from messages where drop_id=:d and {col} > :m order by seq limit :n"),
+                        {"d": drop_id, "m": mark, "n": limit + 1}).mappings().all()
+    if len(rows) > limit:
+        return None
+    deleted = conn.execute(text(f"select seq from tombstones where drop_id=:d and {tcol} > :m order by seq"),
+                           {"d": drop_id, "m": mark}).scalars().all()
+    payload = _delta_payload(drop_id, since, state["version"], rows, deleted)
+    payload.update({"sinceUpdatedAt": since_at, "updatedAt": state["changed_at"]})
+    return payload
+
+def _load_snapshot(conn, drop_id: str, state: Dict[str, int], limit: int = 200, before: Optional[int] = None) -> Dict[str, Any]:
+    sql = "select * from messages where drop_id=:d"
+    params = {"d": drop_id}
+    if before:
+        sql += " and ts < :b"; params["b"] = before
+    sql += " order by seq desc limit :n"; params["n"] = limit
+    rows = conn.execute(text(sql), params).mappings().all()
+    payload = _drop_payload(drop_id, list(reversed(rows)), state["version"])
+    payload["updatedAt"] = state["changed_at"]
+    return payload
+
+# --- Hot message cache ---
+# Newest messages per drop, already JSON-encoded, so list_messages can answer without SQLite.
+HOT_CACHE_DROPS = int(os.environ.get("HOT_CACHE_DROPS", "64"))
+HOT_CACHE_MESSAGES = 500  # list_messages' max limit, so any snapshot can come from the cache
+
+def _json_compact(obj: Any) -> str:
+    # Same encoding JSONResponse uses
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+def _list_etag(version: int, changed_at: int, limit: int, since: Optional[int]) -> str:
+    """Strong ETag for a list_messages response: drop version (and change time) plus the query variant."""
+    variant = f"n{limit}" if since is None else f"n{limit}.s{since}"
+    return f'"v{version}.{changed_at}.{variant}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _splice_payload(fields: Dict[str, Any], messages: List[str], images: List[str]) -> bytes:
+    """Encode fields plus pre-encoded messages/images as one drop payload body."""
+    head = _json_compact(fields)
+    return f'{head[:-1]},"messages":[{",".join(messages)}],"images":[{",".join(images)}]}}'.encode("utf-8")
+
+class HotDrop:
+    """One cached drop: its state at `version` and its newest messages, keyed by seq in seq order."""
+    def __init__(self, state: Dict[str, int]):
+        self.version = state["version"]
+        self.floor = state["floor"]
+        self.changed_at = state["changed_at"]
+        self.rows: Dict[int, Tuple[int, str, Optional[str]]] = {}  # seq -> (rev, message json, image json)
+        self.tombstones: Dict[int, int] = {}                      # seq -> rev
+        self.complete = True   # False once older rows exist outside the ring
+        self.evicted_rev = 0   # newest rev among rows that fell out of the ring
+        self.bodies: Dict[Tuple[int, Optional[int]], Optional[bytes]] = {}  # (limit, since) -> body at this version
+
+    def put(self, row):
+        o = dict(row)
+        self.rows[o["seq"]] = (int(o.get("rev") or 0), _json_compact(_message_out(o)),
+                               _json_compact(_image_out(o)) if o.get("blob_id") else None)
+
+    def trim(self, max_rows: int):
+        while len(self.rows) > max_rows:
+            seq = next(iter(self.rows))
+            self.evicted_rev = max(self.evicted_rev, self.rows.pop(seq)[0])
+            self.complete = False
+
+    def covers(self, seq: int) -> bool:
+        return self.complete or (bool(self.rows) and seq >= next(iter(self.rows)))
+
+class HotCache:
+    """Write-through LRU of HotDrop entries.
+
+    DBWriter applies every committed change in version order; a change that does not follow
+    the cached version (or touches rows outside the ring) drops the entry and the next read
+    reloads it. Loads are discarded if a write for the drop landed while they were reading.
+    """
+    def __init__(self, max_drops: int = HOT_CACHE_DROPS, max_rows: int = HOT_CACHE_MESSAGES):
+        self.max_drops = max_drops
+        self.max_rows = max_rows
+        self.entries: "OrderedDict[str, HotDrop]" = OrderedDict()
+        self.writes: Dict[str, int] = {}  # drop_id -> count of applied writes, to reject stale loads
+        self.lock = threading.Lock()
+        self.shared = False  # set when other processes write to the same database (see Hub)
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "staleLoads": 0, "invalidations": 0, "evictions": 0,
+                      "fallbacks": 0, "remoteStale": 0}
+
+    # Write side (DBWriter thread)
+    def capture(self, conn, drop_id: str, version: int):
+        """Read what the write at `version` changed, inside its transaction; returns the apply step."""
+        rows = conn.execute(text("select * from messages where drop_id=:d and rev=:v order by seq"),
+                            {"d": drop_id, "v": version}).mappings().all()
+        deleted = conn.execute(text("select seq from tombstones where drop_id=:d and rev=:v"),
+                               {"d": drop_id, "v": version}).scalars().all()
+        state = _get_version(conn, drop_id)
+        return lambda: self.apply(drop_id, version, rows, deleted, state)
+
+    def apply(self, drop_id: str, version: int, rows, deleted, state: Dict[str, int]):
+        with self.lock:
+            self.writes[drop_id] = self.writes.get(drop_id, 0) + 1
+            entry = self.entries.get(drop_id)
+            if entry is None or version <= entry.version:
+                return
+            if version != entry.version + 1 or not all(entry.covers(r["seq"]) for r in rows):
+                self._invalidate(drop_id)
+                return
+            for r in rows:
+                entry.tombstones.pop(r["seq"], None)
+                if entry.rows and r["seq"] < next(reversed(entry.rows)) and r["seq"] not in entry.rows:
+                    # Out-of-order seq (reused after a restart): rebuild in seq order
+                    entry.put(r)
+                    entry.rows = dict(sorted(entry.rows.items()))
+                else:
+                    entry.put(r)
+            for seq in deleted:
+                entry.rows.pop(seq, None)
+                entry.tombstones[seq] = version
+            entry.version, entry.floor, entry.changed_at = version, state["floor"], state["changed_at"]
+            entry.bodies.clear()
+            entry.tombstones = {seq: rev for seq, rev in entry.tombstones.items() if rev > entry.floor}
+            entry.trim(self.max_rows)
+
+    def _invalidate(self, drop_id: str):
+        if self.entries.pop(drop_id, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def invalidate(self, drop_id: str):
+        """Forget drop_id after a write this process did not make (e.g. on another hub node)."""
+        with self.lock:
+            self.writes[drop_id] = self.writes.get(drop_id, 0) + 1
+            self._invalidate(drop_id)
+
+    # Read side (event loop)
+    def _load(self, conn, drop_id: str) -> HotDrop:
+        state = _get_version(conn, drop_id)
+        entry = HotDrop(state)
+        rows = conn.execute(text("select * from messages where drop_id=:d order by seq desc limit :n"),
+                            {"d": drop_id, "n": self.max_rows + 1}).mappings().all()
+        for r in reversed(rows):
+            entry.put(r)
+        entry.trim(self.max_rows)
+        if not entry.complete:
+            entry.evicted_rev = int(conn.execute(text("select coalesce(max(rev), 0) from messages where drop_id=:d and seq < :s"),
+                                                 {"d": drop_id, "s": next(iter(entry.rows))}).scalar() or 0)
+        tombs = conn.execute(text("select seq, rev from tombstones where drop_id=:d and rev > :f"),
+                             {"d": drop_id, "f": entry.floor}).all()
+        entry.tombstones = {int(seq): int(rev) for seq, rev in tombs}
+        return entry
+
+    def _is_current(self, conn, drop_id: str, entry: HotDrop) -> bool:
+        state = _get_version(conn, drop_id)
+        return state["version"] == entry.version and state["floor"] == entry.floor
+
+    async def get(self, drop_id: str) -> HotDrop:
+        with self.lock:
+            entry = self.entries.get(drop_id)
+            if entry is not None:
+                self.entries.move_to_end(drop_id)
+                self.stats["hits"] += 1
+        if entry is not None:
+            # With other writer processes the version row is the only reliable signal (bus
+            # events can be lost), so every hit is checked against it: one indexed point read
+            if not self.shared or await db_reader.run(lambda conn: self._is_current(conn, drop_id, entry)):
+                return entry
+            self.stats["remoteStale"] += 1
+            self.invalidate(drop_id)
+        with self.lock:
+            self.stats["misses"] += 1
+            writes = self.writes.get(drop_id, 0)
+        entry = await db_reader.run(lambda conn: self._load(conn, drop_id))
+        with self.lock:
+            if self.writes.get(drop_id, 0) != writes:
+                # A write committed while we were reading; serve this snapshot but don't keep it
+                self.stats["staleLoads"] += 1
+            elif self.max_drops > 0:
+                self.stats["loads"] += 1
+                self.entries[drop_id] = entry
+                while len(self.entries) > self.max_drops:
+                    self.entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return entry
+
+    def render(self, drop_id: str, entry: HotDrop, limit: int,
+               since: Optional[int] = None) -> Tuple[str, Optional[bytes]]:
+        """(ETag, body) of the snapshot (or delta after `since`); body is None if the entry can't answer."""
+        with self.lock:
+            etag = _list_etag(entry.version, entry.changed_at, limit, since)
+            key = (limit, since)
+            if key not in entry.bodies:
+                if len(entry.bodies) >= 32:
+                    entry.bodies.clear()
+                entry.bodies[key] = self._render(drop_id, entry, limit, since)
+            return etag, entry.bodies[key]
+
+    def _render(self, drop_id: str, entry: HotDrop, limit: int, since: Optional[int]) -> Optional[bytes]:
+        if since is not None and entry.floor <= since <= entry.version and since >= entry.evicted_rev:
+            changed = [r for r in entry.rows.values() if r[0] > since]
+            if len(changed) <= limit:
+                deleted = sorted(seq for seq, rev in entry.tombstones.items() if rev > since)
+                return _splice_payload(
+                    {"dropId": drop_id, "version": entry.version, "delta": True, "since": since,
+                     "deleted": deleted, "sinceUpdatedAt": None, "updatedAt": entry.changed_at},
+                    [r[1] for r in changed], [r[2] for r in changed if r[2]])
+        if not entry.complete and len(entry.rows) < limit:
+            self.stats["fallbacks"] += 1
+            return None
+        newest = list(entry.rows.values())[-limit:]
+        return _splice_payload({"dropId": drop_id, "version": entry.version, "updatedAt": entry.changed_at},
+                               [r[1] for r in newest], [r[2] for r in newest if r[2]])
+
+hot_cache = HotCache()
+
+@app.get("/api/chat/{drop_id}")
+async def list_messages(drop_id: str, limit: int = 200, before: Optional[int] = None,
+                        since: Optional[int] = None, sinceUpdatedAt: Optional[int] = None, req: Request = None):
+    require_session(req)
+    limit = max(1, min(500, limit))
+    if before is None and sinceUpdatedAt is None:
+        etag, body = hot_cache.render(drop_id, await hot_cache.get(drop_id), limit, since)
+        # no-cache: browsers keep the body but revalidate every poll, so "nothing new" costs a 304
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if req.method in ("GET", "HEAD") and _etag_matches(req.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if body is not None:
+            return Response(content=body, media_type="application/json", headers=headers)
+    def load(conn):
+        state = _get_version(conn, drop_id)
+        if since is not None or sinceUpdatedAt is not None:
+            delta = _load_delta(conn, drop_id, state, limit, since, sinceUpdatedAt)
+            if delta is not None:
+                return delta
+        return _load_snapshot(conn, drop_id, state, limit, before)
+    def respond(conn):
+        payload = load(conn)
+        headers = None
+        if before is None and sinceUpdatedAt is None:
+            headers = {"ETag": _list_etag(payload["version"], payload["updatedAt"], limit, since), "Cache-Control": "no-cache"}
+        return JSONResponse(payload, headers=headers)
+    # Encode on the reader thread as well: jsonable_encoder over a full drop costs more loop time than the query
+    return await db_reader.run(respond)
 
 @app.head("/api/chat/{drop_id}")
 def head_messages(drop_id: str, req: Request = None):
-    """Lightweight endpoint for session validation"""
+    """Lightweight endpoint for session validation; carries the current ETag when the drop is cached"""
     require_session(req)
-    return Response(status_code=200)
-
-def cleanup_old_messages(drop_id: str, keep_count: int = 30):
-    """Keep only the most recent N messages for a drop."""
-    with engine.begin() as conn:
-        # Get the seq threshold
-        threshold_row = conn.execute(text("""
-            select seq from (
-                select seq from messages 
-                where drop_id = :d 
-                order by seq desc 
-                limit :n
-            ) 
-            order by seq asc 
-            limit 1
-        """), {"d": drop_id, "n": keep_count}).mappings().first()
-        
-        if not threshold_row:
-            return 0
-        
-        threshold_seq = threshold_row["seq"]
-        
-        # Get blob_ids to delete files
-        old_blobs = conn.execute(text("""
-            select blob_id from messages 
-            where drop_id = :d and seq < :threshold and blob_id is not null
-        """), {"d": drop_id, "threshold": threshold_seq}).fetchall()
-        
-        # Delete old messages
-        result = conn.execute(text("""
-            delete from messages 
-            where drop_id = :d and seq < :threshold
-        """), {"d": drop_id, "threshold": threshold_seq})
-        
-        # Delete blob files
-        for row in old_blobs:
-            blob_id = row[0]
-            if blob_id:
-                blob_path = BLOB_DIR / blob_id
+    entry = hot_cache.entries.get(drop_id)
+    if entry is None:
+        return Response(status_code=200)
+    etag = _list_etag(entry.version, entry.changed_at, 200, None)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(req.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(status_code=200, headers=headers)
+
+# --- Retention ---
+# Runs in the background (see Compactor) instead of after every post. 0 disables a policy.
+RETENTION_MAX_MESSAGES = int(os.environ.get("RETENTION_MAX_MESSAGES", "30"))
+RETENTION_MAX_AGE_SECONDS = int(os.environ.get("RETENTION_MAX_AGE_SECONDS", "0"))
+RETENTION_MAX_BLOB_BYTES = int(os.environ.get("RETENTION_MAX_BLOB_BYTES", "0"))  # per drop
+RETENTION_EVERY_INSERTS = max(1, int(os.environ.get("RETENTION_EVERY_INSERTS", "10")))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("RETENTION_INTERVAL_SECONDS", "300"))
+RETENTION_BATCH = max(1, int(os.environ.get("RETENTION_BATCH", "200")))
+
+def _compact_op(conn, drop_id: str, now_ms: int, batch: int = RETENTION_BATCH) -> Tuple[List[int], List[str], int]:
+    """Delete up to `batch` of the drop's oldest messages that fall outside the retention policies.
+
+    Returns (deleted seqs, blob_ids left unreferenced, version); version is 0 when nothing was deleted.
+    """
+    # Newest RETENTION_MAX_MESSAGES are kept: anything at or below the next seq down goes
+    count_seq = 0
+    if RETENTION_MAX_MESSAGES > 0:
+        count_seq = conn.execute(text("select seq from messages where drop_id=:d order by seq desc limit 1 offset :n"),
+                                 {"d": drop_id, "n": RETENTION_MAX_MESSAGES}).scalar() or 0
+    age_cutoff = now_ms - RETENTION_MAX_AGE_SECONDS * 1000 if RETENTION_MAX_AGE_SECONDS > 0 else 0
+    # Newest images are kept until their bytes exceed the budget; older image messages go
+    blob_seq = 0
+    if RETENTION_MAX_BLOB_BYTES > 0:
+        total = 0
+        for seq, size in conn.execute(text("""
+            select seq, coalesce(blob_size, 0) from messages
+            where drop_id = :d and blob_id is not null order by seq desc
+        """), {"d": drop_id}):
+            total += size
+            if total > RETENTION_MAX_BLOB_BYTES:
+                blob_seq = seq
+                break
+    
+    old_rows = conn.execute(text("""
+        select seq, blob_id from messages
+        where drop_id = :d and (seq <= :cs or ts < :cutoff or (blob_id is not null and seq <= :bs))
+        order by seq limit :n
+    """), {"d": drop_id, "cs": count_seq, "cutoff": age_cutoff, "bs": blob_seq, "n": batch}).all()
+    deleted_seqs = [row[0] for row in old_rows]
+    version = 0
+    
+    if deleted_seqs:
+        conn.execute(text("delete from messages where drop_id = :d and seq in :seqs")
+                     .bindparams(bindparam("seqs", expanding=True)), {"d": drop_id, "seqs": deleted_seqs})
+        version = _bump_version(conn, drop_id, now_ms)
+        _record_deletes(conn, drop_id, deleted_seqs, version, now_ms)
+    
+    # Prune expired tombstones and raise the floor past them
+    cutoff = now_ms - TOMBSTONE_TTL_MS
+    pruned = conn.execute(text("""
+        select max(rev) as r, max(deleted_at) as a from tombstones
+        where drop_id = :d and deleted_at < :cutoff
+    """), {"d": drop_id, "cutoff": cutoff}).mappings().first()
+    if pruned and pruned["r"] is not None:
+        conn.execute(text("delete from tombstones where drop_id = :d and deleted_at < :cutoff"),
+                     {"d": drop_id, "cutoff": cutoff})
+        conn.execute(text("""
+            update drop_versions set floor = max(floor, :r), floor_at = max(floor_at, :a)
+            where drop_id = :d
+        """), {"d": drop_id, "r": pruned["r"], "a": pruned["a"]})
+    
+    return deleted_seqs, _blob_unref(conn, [row[1] for row in old_rows if row[1]]), version
+
+class Compactor:
+    """Background retention: a drop is compacted after RETENTION_EVERY_INSERTS inserts, and every
+    drop on each RETENTION_INTERVAL_SECONDS sweep. Deletes go through the DB writer in batches,
+    are announced as delta events, and their blob files are unlinked off the event loop."""
+    def __init__(self, every_inserts: int = RETENTION_EVERY_INSERTS, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.every_inserts = every_inserts
+        self.interval = interval
+        self.inserts: Dict[str, int] = {}
+        self.dirty: set = set()
+        self.wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"passes": 0, "deleted": 0, "blobsUnlinked": 0}
+
+    def start(self):
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.wake = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    def note_insert(self, drop_id: str):
+        """Count an insert; schedule the drop once it has had enough since its last pass."""
+        self.inserts[drop_id] = self.inserts.get(drop_id, 0) + 1
+        if self.inserts[drop_id] >= self.every_inserts:
+            self.start()
+            self.dirty.add(drop_id)
+            self.wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.interval)
+                drops = list(self.dirty)
+            except asyncio.TimeoutError:
+                drops = await db_reader.run(lambda conn: conn.execute(text("select drop_id from drop_versions")).scalars().all())
+            self.wake.clear()
+            self.dirty.difference_update(drops)
+            for drop_id in drops:
                 try:
-                    if blob_path.exists():
-                        blob_path.unlink()
-                except Exception:
-                    pass
-        
-        return result.rowcount
+                    await self.compact(drop_id)
+                except Exception as e:
+                    logger.error(f"[retention] Compacting drop={drop_id} failed: {e}")
+
+    async def compact(self, drop_id: str) -> int:
+        """Apply the retention policies to one drop now; returns how many messages were deleted."""
+        self.inserts[drop_id] = 0
+        self.stats["passes"] += 1
+        total = 0
+        while True:
+            now_ms = int(time.time() * 1000)
+            seqs, blob_ids, version = await db_writer.run(lambda conn: _compact_op(conn, drop_id, now_ms))
+            if seqs:
+                total += len(seqs)
+                await hub.broadcast(drop_id, {"type": "delta", "data": _delta_payload(drop_id, version - 1, version, deleted=seqs)})
+            if blob_ids:
+                self.stats["blobsUnlinked"] += await asyncio.to_thread(_release_blobs, blob_ids)
+            if len(seqs) < RETENTION_BATCH:
+                break
+        if total:
+            self.stats["deleted"] += total
+            logger.info(f"[retention] drop={drop_id} deleted {total} message(s)")
+        return total
+
+compactor = Compactor()
+
+@app.on_event("startup")
+async def _start_compactor():
+    compactor.start()
+
+# --- Image variants ---
+THUMB_WORKERS = max(1, int(os.environ.get("THUMB_WORKERS", "2")))
+
+def _render_variants(src, blob_id: str) -> List[str]:
+    """Runs in a worker process: write each variant smaller than the original; returns the names made.
+
+    `src` is the original's path, or its bytes when it lives in a pack.
+    """
+    made = []
+    with Image.open(io.BytesIO(src) if isinstance(src, bytes) else src) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "L"):
+            # Flatten transparency onto white, as the client-side thumbnailer does
+            rgba = im.convert("RGBA")
+            im = Image.new("RGB", rgba.size, "white")
+            im.paste(rgba, mask=rgba.getchannel("A"))
+        for name, edge in IMAGE_VARIANTS.items():
+            if max(im.size) <= edge:
+                continue
+            variant = im.copy()
+            variant.thumbnail((edge, edge), Image.LANCZOS)
+            dest = _variant_path(blob_id, name)
+            dest.parent.mkdir(parents=True, exist_ok=True)  # a packed original has no shard directory
+            tmp = dest.with_name(dest.name + ".tmp")
+            variant.save(tmp, "JPEG", quality=82, optimize=True, progressive=True)
+            os.replace(tmp, dest)
+            made.append(name)
+    return made
+
+def _variant_urls(conn, blob_id: str) -> Dict[str, str]:
+    """image_thumb/image_medium for a blob whose variants are done ({} while pending); the original stands in for any not needed."""
+    made = conn.execute(text("select variants from blobs where blob_id=:b"), {"b": blob_id}).scalar()
+    if made is None:
+        return {}
+    return {f"image_{name}": f"/blob/{blob_id}/{name}" if name in made.split(",") else f"/blob/{blob_id}"
+            for name in IMAGE_VARIANTS}
+
+def _apply_variants(conn, blob_id: str, made: List[str]) -> Optional[List[Tuple[str, int, list]]]:
+    """Record a blob's variants and repoint its messages. Returns (drop, version, rows) per drop, None if the blob is gone."""
+    result = conn.execute(text("update blobs set variants=:v where blob_id=:b"), {"v": ",".join(made), "b": blob_id})
+    if not result.rowcount:
+        return None
+    if not made:
+        return []
+    urls = _variant_urls(conn, blob_id)
+    now_ms = int(time.time() * 1000)
+    changes = []
+    drops = conn.execute(text("select distinct drop_id from messages where blob_id=:b and message_type='image'"),
+                         {"b": blob_id}).scalars().all()
+    for drop_id in drops:
+        version = _bump_version(conn, drop_id, now_ms)
+        rows = conn.execute(text("""
+            update messages set image_thumb=:t, image_medium=:m, rev=:v, changed_at=:now
+            where drop_id=:d and blob_id=:b and message_type='image'
+            returning *
+        """), {"t": urls["image_thumb"], "m": urls["image_medium"], "v": version, "now": now_ms,
+               "d": drop_id, "b": blob_id}).mappings().all()
+        changes.append((drop_id, version, rows))
+    return changes
+
+class Thumbnailer:
+    """Renders IMAGE_VARIANTS for new uploads on a process pool (Pillow required), then repoints
+    the messages showing the blob and announces them as delta events. Until then, and for
+    formats it skips, clients keep using the original."""
+    SKIP_MIME = ("image/gif", "image/svg+xml")  # keep animation / vectors as uploaded
+
+    def __init__(self, workers: int = THUMB_WORKERS):
+        self.workers = workers
+        self.pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.pending: set = set()
+        self.stats = {"rendered": 0, "failed": 0}
+
+    def start(self):
+        if Image is None or self.pool is not None:
+            return
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        # Fork the workers now, before the DB writer/reader threads exist
+        self.pool.submit(int)
+
+    def schedule(self, blob_id: str, mime: Optional[str]):
+        if Image is None or not (mime or "").startswith("image/") or mime in self.SKIP_MIME:
+            return
+        if blob_id in self.pending:
+            return
+        self.pending.add(blob_id)
+        asyncio.create_task(self._run(blob_id))
+
+    async def _run(self, blob_id: str):
+        try:
+            done = await db_reader.run(lambda conn: conn.execute(text("select variants from blobs where blob_id=:b"),
+                                                                 {"b": blob_id}).scalar())
+            if done is not None:
+                return
+            self.start()
+            try:
+                src = await asyncio.to_thread(_blob_source, blob_id)
+                made = await asyncio.get_running_loop().run_in_executor(self.pool, _render_variants, src, blob_id)
+                self.stats["rendered"] += 1
+            except Exception as e:
+                # Not an image Pillow can read: remember that, keep serving the original
+                logger.warning(f"[thumbs] Could not render {blob_id}: {e}")
+                self.stats["failed"] += 1
+                made = []
+            changes = await db_writer.run(lambda conn: _apply_variants(conn, blob_id, made))
+            if changes is None:
+                # Deleted while we rendered: drop the files we just wrote
+                await asyncio.to_thread(_release_blobs, [blob_id])
+                return
+            for drop_id, version, rows in changes:
+                await hub.broadcast(drop_id, {"type": "delta", "data": _delta_payload(drop_id, version - 1, version, rows)})
+        except Exception as e:
+            logger.error(f"[thumbs] Variant pipeline failed for {blob_id}: {e}")
+        finally:
+            self.pending.discard(blob_id)
+
+thumbnailer = Thumbnailer()
+
+@app.on_event("startup")
+async def _start_thumbnailer():
+    thumbnailer.start()
+
+# --- Resumable uploads ---
+# init -> PUT chunks at the acknowledged offset -> commit -> post a message with {"uploadId"}.
+# A dropped connection keeps whatever reached the disk; the client asks for the offset and carries on.
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+UPLOAD_LEASE_SECONDS = float(os.environ.get("UPLOAD_LEASE_SECONDS", "20"))
+_UPLOAD_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+def _upload_tmp(upload_id: str) -> Path:
+    return BLOB_DIR / f".upload-{upload_id}"
+
+def _upload_out(row) -> Dict[str, Any]:
+    return {"uploadId": row["upload_id"], "offset": row["received"], "size": row["size"],
+            "complete": row["received"] >= row["size"], "blobId": row["blob_id"]}
+
+async def _get_upload(drop_id: str, upload_id: str) -> Dict[str, Any]:
+    if not _UPLOAD_ID_RE.fullmatch(upload_id):
+        raise HTTPException(404, "no such upload")
+    row = await db_reader.run(lambda conn: conn.execute(
+        text("select * from uploads where upload_id=:u and drop_id=:d and claimed_at is null"),
+        {"u": upload_id, "d": drop_id}).mappings().first())
+    if row is None:
+        raise HTTPException(404, "no such upload")
+    return dict(row)
+
+def _reset_upload_files(expired: List[str], upload_id: str):
+    """Remove expired sessions' temp files and create the new one's. Runs in a thread."""
+    for old_id in expired:
+        _upload_tmp(old_id).unlink(missing_ok=True)
+    _upload_tmp(upload_id).touch()
+
+async def _lease_upload(upload_id: str, offset: int, token: str) -> bool:
+    """Become the one writer appending at `offset` (taken over only once a lease has lapsed)."""
+    now_ms = int(time.time() * 1000)
+    return bool(await db_writer.run(lambda conn: conn.execute(text("""
+        update uploads set lease=:t, lease_until=:until
+        where upload_id=:u and received=:o and blob_id is null and claimed_at is null
+          and (lease_until is null or lease_until < :now)
+    """), {"t": token, "until": now_ms + int(UPLOAD_LEASE_SECONDS * 1000), "u": upload_id, "o": offset,
+           "now": now_ms}).rowcount))
+
+async def _renew_lease(upload_id: str, token: str, received: int) -> Optional[float]:
+    """Extend a held lease and record the bytes flushed so far (a request that stalls later can be
+    resumed from here); returns when the lease now runs out, or None if it was lost."""
+    now = time.time()
+    until = now + UPLOAD_LEASE_SECONDS
+    renewed = await db_writer.run(lambda conn: conn.execute(
+        text("update uploads set lease_until=:until, received=:r, updated_at=:now where upload_id=:u and lease=:t"),
+        {"until": int(until * 1000), "r": received, "now": int(now * 1000), "u": upload_id, "t": token}).rowcount)
+    return until if renewed else None
+
+def _lease_conflict(row: Dict[str, Any], offset: int) -> HTTPException:
+    """409 for an append that couldn't get the lease. While another request holds it at this offset
+    (e.g. one stalled on a dead link), Retry-After says when it lapses and can be taken over."""
+    wait = (row["lease_until"] or 0) / 1000 - time.time()
+    if row["received"] != offset or wait <= 0:
+        return HTTPException(409, {"offset": row["received"]})
+    return HTTPException(409, {"offset": row["received"], "retryAfter": round(wait, 3)},
+                         headers={"Retry-After": str(math.ceil(wait))})
+
+def _expire_uploads(conn, now_ms: int) -> List[str]:
+    cutoff = now_ms - UPLOAD_SESSION_TTL_SECONDS * 1000
+    return conn.execute(text("delete from uploads where updated_at < :c returning upload_id"), {"c": cutoff}).scalars().all()
+
+@app.post("/api/chat/{drop_id}/uploads")
+async def init_upload(drop_id: str, body: Dict[str, Any] = Body(...), req: Request = None):
+    require_session(req)
+    size = body.get("size")
+    if not isinstance(size, int) or size <= 0:
+        raise HTTPException(400, "size required")
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPException(413, f"file larger than {UPLOAD_MAX_BYTES} bytes")
+    now_ms = int(time.time() * 1000)
+    upload_id = secrets.token_hex(16)
+    row = {"upload_id": upload_id, "drop_id": drop_id, "size": size, "received": 0,
+           "mime": body.get("mime") or mimetypes.guess_type(body.get("filename") or "")[0] or "application/octet-stream",
+           "filename": body.get("filename"), "blob_id": None, "created_at": now_ms, "updated_at": now_ms}
+    def write(conn):
+        # Sessions abandoned for longer than the TTL are swept whenever a new one starts
+        expired = _expire_uploads(conn, now_ms)
+        conn.execute(text("""
+            insert into uploads(upload_id, drop_id, size, received, mime, filename, blob_id, created_at, updated_at)
+            values(:upload_id, :drop_id, :size, :received, :mime, :filename, :blob_id, :created_at, :updated_at)
+        """), row)
+        return expired
+    expired = await db_writer.run(write)
+    await asyncio.to_thread(_reset_upload_files, expired, upload_id)
+    return {**_upload_out(row), "chunkSize": UPLOAD_CHUNK_BYTES, "maxBytes": UPLOAD_MAX_BYTES}
+
+@app.get("/api/chat/{drop_id}/uploads/{upload_id}")
+async def upload_status(drop_id: str, upload_id: str, req: Request = None):
+    """Where to resume: offset is the number of bytes stored so far."""
+    require_session(req)
+    return _upload_out(await _get_upload(drop_id, upload_id))
+
+@app.put("/api/chat/{drop_id}/uploads/{upload_id}")
+async def append_upload(drop_id: str, upload_id: str, offset: int, req: Request = None):
+    """Append the raw request body at `offset`, which must be the acknowledged offset."""
+    require_session(req)
+    row = await _get_upload(drop_id, upload_id)
+    if row["blob_id"] is not None:
+        raise HTTPException(409, "upload already committed")
+    if offset != row["received"]:
+        raise HTTPException(409, {"offset": row["received"]})
+    room = row["size"] - offset
+    declared = req.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > room:
+        raise HTTPException(413, f"chunk runs past the declared size of {row['size']} bytes")
+    # One writer per upload across all workers: the lease is only granted at the acknowledged offset
+    token = secrets.token_hex(8)
+    if not await _lease_upload(upload_id, offset, token):
+        raise _lease_conflict(await _get_upload(drop_id, upload_id), offset)
+    lease_until = time.time() + UPLOAD_LEASE_SECONDS
+    written = 0
+    try:
+        async with aiofiles.open(_upload_tmp(upload_id), "r+b") as f:
+            # Drop anything past the acknowledged offset left by an interrupted append
+            await f.truncate(offset)
+            await f.seek(offset)
+            async for chunk in req.stream():
+                if written + len(chunk) > room:
+                    await f.truncate(offset + written)
+                    raise HTTPException(413, f"chunk runs past the declared size of {row['size']} bytes")
+                # Renew in the second half of the lease, and stop before writing if it was lost
+                if time.time() > lease_until - UPLOAD_LEASE_SECONDS / 2:
+                    await f.flush()
+                    lease_until = await _renew_lease(upload_id, token, offset + written)
+                    if lease_until is None:
+                        raise HTTPException(409, "upload taken over by another request")
+                await f.write(chunk)
+                written += len(chunk)
+    except FileNotFoundError:
+        raise HTTPException(404, "no such upload")
+    except ClientDisconnect:
+        logger.info(f"[upload] {upload_id} interrupted at {offset + written}/{row['size']}")
+    finally:
+        # Record what reached the file, even from an interrupted request, so the client can resume
+        # there; a request that lost its lease records nothing
+        now_ms = int(time.time() * 1000)
+        await db_writer.run(lambda conn: conn.execute(text("""
+            update uploads set received=:r, updated_at=:now, lease=null, lease_until=null
+            where upload_id=:u and lease=:t
+        """), {"r": offset + written, "now": now_ms, "u": upload_id, "t": token}))
+    row["received"] = offset + written
+    return _upload_out(row)
+
+@app.post("/api/chat/{drop_id}/uploads/{upload_id}/commit")
+async def commit_upload(drop_id: str, upload_id: str, body: Optional[Dict[str, Any]] = Body(default=None),
+                        req: Request = None):
+    """Seal a fully received upload under its sha256 (optionally checked against body.sha256)."""
+    require_session(req)
+    row = await _get_upload(drop_id, upload_id)
+    if row["blob_id"] is not None:
+        return _upload_out(row)
+    if row["received"] != row["size"] or (row["lease_until"] or 0) > int(time.time() * 1000):
+        raise HTTPException(409, {"offset": row["received"]})
+    blob_id = await asyncio.to_thread(_hash_file, _upload_tmp(upload_id))
+    expected = (body or {}).get("sha256")
+    if expected and expected.lower() != blob_id:
+        raise HTTPException(422, "sha256 mismatch")
+    now_ms = int(time.time() * 1000)
+    sealed = await db_writer.run(lambda conn: conn.execute(
+        text("update uploads set blob_id=:b, updated_at=:now where upload_id=:u and received=size and lease is null"),
+        {"b": blob_id, "now": now_ms, "u": upload_id}).rowcount)
+    if not sealed:
+        raise HTTPException(409, "upload changed while committing")
+    row["blob_id"] = blob_id
+    return _upload_out(row)
+
+def _claim_upload(drop_id: str, upload_id: str):
+    """Claim op for _insert_message: consumes a committed upload, so it is attached at most once.
+
+    The row stays (claimed) until _finish_upload, so the blob GC keeps treating the temp file as
+    live while it waits for _place_blob.
+    """
+    def claim(conn):
+        now_ms = int(time.time() * 1000)
+        claimed = conn.execute(text("""
+            update uploads set claimed_at=:now, updated_at=:now
+            where upload_id=:u and drop_id=:d and blob_id is not null and claimed_at is null
+        """), {"u": upload_id, "d": drop_id, "now": now_ms}).rowcount
+        if not claimed:
+            raise HTTPException(409, "upload not committed or already used")
+    return claim
+
+async def _finish_upload(upload_id: str):
+    """Forget a claimed upload once its file has been placed."""
+    await db_writer.run(lambda conn: conn.execute(
+        text("delete from uploads where upload_id=:u and claimed_at is not null"), {"u": upload_id}))
+
+# --- Blob garbage collection ---
+# Catches files the normal paths miss (failed unlinks, crashes between commit and unlink, legacy
+# token-named files, abandoned temp files). Unreferenced files are first moved to .quarantine and
+# only deleted after BLOB_GC_QUARANTINE_SECONDS, restoring any that became referenced again.
+BLOB_GC_INTERVAL_SECONDS = float(os.environ.get("BLOB_GC_INTERVAL_SECONDS", str(6 * 3600)))  # 0 disables
+BLOB_GC_BATCH = max(1, int(os.environ.get("BLOB_GC_BATCH", "500")))
+BLOB_GC_PAUSE_MS = float(os.environ.get("BLOB_GC_PAUSE_MS", "50"))
+BLOB_GC_GRACE_SECONDS = int(os.environ.get("BLOB_GC_GRACE_SECONDS", "3600"))
+BLOB_GC_QUARANTINE_SECONDS = int(os.environ.get("BLOB_GC_QUARANTINE_SECONDS", str(24 * 3600)))
+QUARANTINE_DIR = BLOB_DIR / ".quarantine"
+_GC_TOP = "."  # cursor key of BLOB_DIR itself; sorts before every "ab/cd" shard
+_SHARD_RE = re.compile(r"[0-9a-f]{2}")
+
+def _gc_dirs() -> List[str]:
+    """Every directory the GC walks, as cursor keys in scan order."""
+    keys = [_GC_TOP]
+    for top in sorted(os.listdir(BLOB_DIR)):
+        if _SHARD_RE.fullmatch(top) and (BLOB_DIR / top).is_dir():
+            keys.extend(f"{top}/{sub}" for sub in sorted(os.listdir(BLOB_DIR / top)) if _SHARD_RE.fullmatch(sub))
+    return keys
+
+def _gc_owner(name: str, top: bool) -> Tuple[str, Optional[str]]:
+    """What would keep a file alive: ("blob"|"variant", id), ("upload", id), ("legacy", name), or ("none", None)."""
+    if top:
+        if name.startswith(".upload-"):
+            upload_id = name[len(".upload-"):]
+            return ("upload", upload_id) if _UPLOAD_ID_RE.fullmatch(upload_id) else ("none", None)
+        if _is_blob_id(name):
+            return "blob", name
+        return "legacy", name
+    if _is_blob_id(name[:64]):
+        if len(name) == 64:
+            return "blob", name
+        if name[64] == "." and not name.endswith(".tmp"):
+            return "variant", name[:64]
+    return "none", None
+
+_GC_LIVE_SQL = {
+    # A packed blob's file (e.g. left by a crash mid-placement) is a stray copy
+    "blob": "select blob_id from blobs where blob_id in :ids and pack_id is null",
+    "variant": "select blob_id from blobs where blob_id in :ids",
+    "upload": "select upload_id from uploads where upload_id in :ids",
+    "legacy": "select distinct blob_id from messages where blob_id in :ids",
+}
+
+def _gc_live(conn, owners: List[Tuple[str, Optional[str]]]) -> set:
+    live = set()
+    for kind, sql in _GC_LIVE_SQL.items():
+        keys = list({key for k, key in owners if k == kind})
+        if keys:
+            live.update((kind, key) for key in conn.execute(
+                text(sql).bindparams(bindparam("ids", expanding=True)), {"ids": keys}).scalars())
+    return live
+
+def _gc_dir(key: str) -> Dict[str, int]:
+    """Quarantine unreferenced files of one directory, BLOB_GC_BATCH at a time. Runs in a thread."""
+    top = key == _GC_TOP
+    directory = BLOB_DIR if top else BLOB_DIR / key
+    counts = {"scanned": 0, "quarantined": 0, "quarantinedBytes": 0}
+    try:
+        names = sorted(e.name for e in os.scandir(directory) if e.is_file(follow_symlinks=False))
+    except FileNotFoundError:
+        return counts
+    QUARANTINE_DIR.mkdir(exist_ok=True)
+    for i in range(0, len(names), BLOB_GC_BATCH):
+        batch = names[i:i + BLOB_GC_BATCH]
+        owners = [_gc_owner(name, top) for name in batch]
+        counts["scanned"] += len(batch)
+        cutoff = time.time() - BLOB_GC_GRACE_SECONDS
+        # Same lock as _place_blob/_release_blobs: a file can't gain a reference mid-check
+        with _blob_files_lock:
+            with engine.connect() as conn:
+                live = _gc_live(conn, owners)
+            for name, owner in zip(batch, owners):
+                if owner in live:
+                    continue
+                path = directory / name
+                try:
+                    st = path.stat()
+                    if st.st_mtime > cutoff:
+                        continue  # may still be in flight
+                    dest = QUARANTINE_DIR / name
+                    os.replace(path, dest)
+                    os.utime(dest)  # quarantine clock starts now
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.error(f"[gc] Could not quarantine {path}: {e}")
+                    continue
+                blob_cache.invalidate([name])
+                counts["quarantined"] += 1
+                counts["quarantinedBytes"] += st.st_size
+        time.sleep(BLOB_GC_PAUSE_MS / 1000)
+    return counts
+
+def _gc_purge() -> Dict[str, int]:
+    """Delete quarantined files past BLOB_GC_QUARANTINE_SECONDS; put back blobs referenced again."""
+    counts = {"purged": 0, "bytesReclaimed": 0, "restored": 0}
+    try:
+        names = [e.name for e in os.scandir(QUARANTINE_DIR) if e.is_file(follow_symlinks=False)]
+    except FileNotFoundError:
+        return counts
+    cutoff = time.time() - BLOB_GC_QUARANTINE_SECONDS
+    for i in range(0, len(names), BLOB_GC_BATCH):
+        batch = names[i:i + BLOB_GC_BATCH]
+        owners = [_gc_owner(name, False) for name in batch]
+        with _blob_files_lock:
+            with engine.connect() as conn:
+                live = _gc_live(conn, owners)
+            for name, owner in zip(batch, owners):
+                path = QUARANTINE_DIR / name
+                try:
+                    if owner in live:
+                        dest = _blob_path(owner[1]).with_name(name)
+                        if not dest.exists():
+                            dest.parent.mkdir(parents=True, exist_ok=True)
+                            os.replace(path, dest)
+                            counts["restored"] += 1
+                            logger.warning(f"[gc] Restored referenced blob file {name} from quarantine")
+                            continue
+                    st = path.stat()
+                    if st.st_mtime > cutoff:
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.error(f"[gc] Could not purge {path}: {e}")
+                    continue
+                counts["purged"] += 1
+                counts["bytesReclaimed"] += st.st_size
+        time.sleep(BLOB_GC_PAUSE_MS / 1000)
+    return counts
+
+class BlobGC:
+    """Background sweep of BLOB_DIR, one directory at a time with a cursor persisted in gc_state,
+    so a restart resumes mid-pass instead of starting over. Runs every BLOB_GC_INTERVAL_SECONDS."""
+    def __init__(self, interval: float = BLOB_GC_INTERVAL_SECONDS):
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"passes": 0, "scanned": 0, "quarantined": 0, "quarantinedBytes": 0,
+                      "purged": 0, "bytesReclaimed": 0, "restored": 0, "cursor": ""}
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.create_task(self._run())
+
+    async def _cursor(self) -> str:
+        return await db_reader.run(lambda conn: conn.execute(
+            text("select cursor from gc_state where name='blobs'")).scalar()) or ""
+
+    async def _save_cursor(self, cursor: str):
+        now_ms = int(time.time() * 1000)
+        self.stats["cursor"] = cursor
+        await db_writer.run(lambda conn: conn.execute(text("""
+            insert into gc_state(name, cursor, updated_at) values('blobs', :c, :now)
+            on conflict(name) do update set cursor = :c, updated_at = :now
+        """), {"c": cursor, "now": now_ms}))
+
+    async def _run(self):
+        # An interrupted pass picks up straight away; otherwise wait for the first interval
+        if not await self._cursor():
+            await asyncio.sleep(self.interval)
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"[gc] Blob sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> Dict[str, int]:
+        """Run (or finish) one pass over BLOB_DIR, then purge expired quarantine."""
+        cursor = await self._cursor()
+        totals = {"scanned": 0, "quarantined": 0, "quarantinedBytes": 0}
+        for key in await asyncio.to_thread(_gc_dirs):
+            if key <= cursor:
+                continue
+            counts = await asyncio.to_thread(_gc_dir, key)
+            for name, n in counts.items():
+                totals[name] += n
+                self.stats[name] += n
+            await self._save_cursor(key)
+        purged = await asyncio.to_thread(_gc_purge)
+        for name, n in purged.items():
+            self.stats[name] += n
+        await self._save_cursor("")
+        self.stats["passes"] += 1
+        if totals["quarantined"] or purged["purged"]:
+            logger.info(f"[gc] Scanned {totals['scanned']} file(s), quarantined {totals['quarantined']} "
+                        f"({totals['quarantinedBytes']} bytes), purged {purged['purged']} ({purged['bytesReclaimed']} bytes)")
+        return {**totals, **purged}
+
+blob_gc = BlobGC()
+
+@app.on_event("startup")
+async def _start_blob_gc():
+    blob_gc.start()
+    pack_store.start()
+
+async def _announce_insert(drop_id: str, row: Dict[str, Any], version: int):
+    """Broadcast a freshly inserted message as a delta event and let retention know about it."""
+    await hub.broadcast(drop_id, {"type": "delta", "data": _delta_payload(drop_id, version - 1, version, [row])})
+    compactor.note_insert(drop_id)
 
 @app.post("/api/chat/{drop_id}")
 async def post_message(drop_id: str,
@@ -411,7 +2642,7 @@ async def post_message(drop_id: str,
     logger.info(f"[POST] drop={drop_id} user={user}")
     ts = int(time.time() * 1000)
     msg_id = secrets.token_hex(8)
-    blob_id, mime = None, None
+    blob_id, mime, blob_size = None, None, None
     gif_url = None
     gif_preview = None
     gif_width = 0
@@ -420,6 +2651,7 @@ async def post_message(drop_id: str,
     image_thumb = None
     message_type = "text"
     reply_to_seq = None
+    upload_id = None
 
     # If JSON body provided (GIF/image URL style)
     ctype = (req.headers.get("content-type") or "").split(";")[0].strip().lower()
@@ -429,6 +2661,7 @@ async def post_message(drop_id: str,
         user = body.get("user") or user
         gif_url = body.get("gifUrl")
         image_url = body.get("imageUrl")
+        upload_id = body.get("uploadId")
         reply_to_seq = body.get("replyToSeq")
         if gif_url:
             message_type = "gif"
@@ -441,16 +2674,22 @@ async def post_message(drop_id: str,
         elif image_url:
             message_type = "image"
 
-    if file:
-        suffix = Path(file.filename or "").suffix.lower()
-        blob_id = secrets.token_hex(12) + suffix
-        dest = BLOB_DIR / blob_id
-        async with aiofiles.open(dest, "wb") as f:
-            while True:
-                chunk = await file.read(1024 * 1024)
-                if not chunk: break
-                await f.write(chunk)
-        mime = file.content_type or mimetypes.guess_type(dest.name)[0] or "application/octet-stream"
+    upload_tmp, upload_data, claim = None, None, None
+    if upload_id:
+        # A committed resumable upload (see init_upload); claimed in the insert transaction
+        upload = await _get_upload(drop_id, str(upload_id))
+        if upload["blob_id"] is None:
+            raise HTTPException(409, "upload not committed")
+        blob_id, blob_size, mime = upload["blob_id"], upload["size"], upload["mime"]
+        upload_tmp = _upload_tmp(upload["upload_id"])
+        claim = _claim_upload(drop_id, upload["upload_id"])
+        message_type = "image"
+        image_url = image_thumb = f"/blob/{blob_id}"
+        if not text_:
+            text_ = "[Image]"
+    elif file:
+        blob_id, blob_size, upload_tmp, upload_data = await _receive_blob(file)
+        mime = file.content_type or mimetypes.guess_type(file.filename or "")[0] or "application/octet-stream"
         message_type = "image"
         # Set image URLs for display in chat
         image_url = f"/blob/{blob_id}"
@@ -458,48 +2697,45 @@ async def post_message(drop_id: str,
         if not text_:
             text_ = "[Image]"
 
-    with engine.begin() as conn:
-        # allocate next seq per drop
-        row = conn.execute(text("select coalesce(max(seq),0)+1 as next from messages where drop_id=:d"), {"d": drop_id}).mappings().first()
-        next_seq = int(row["next"]) if row else 1
-        now_ms = ts
-        conn.execute(text("""
-          insert into messages(id,drop_id,seq,ts,created_at,updated_at,user,client_id,message_type,text,blob_id,mime,reactions,gif_url,gif_preview,gif_width,gif_height,image_url,image_thumb,reply_to_seq,delivered_at)
-          values(:id,:d,:seq,:ts,:ca,:ua,:u,:cid,:mt,:tx,:b,:m,:rx,:gurl,:gprev,:gw,:gh,:iurl,:ithumb,:rts,:del)
-        """), {"id": msg_id, "d": drop_id, "seq": next_seq, "ts": ts, "ca": now_ms, "ua": now_ms,
-                "u": user, "cid": None, "mt": message_type, "tx": text_, "b": blob_id, "m": mime, "rx": "{}",
-                "gurl": gif_url, "gprev": gif_preview, "gw": gif_width, "gh": gif_height, "iurl": image_url, "ithumb": image_thumb,
-                "rts": reply_to_seq, "del": now_ms})
-
-    # Cleanup old messages (keep only 30 most recent)
-    cleanup_old_messages(drop_id, keep_count=30)
+    try:
+        row, version = await _insert_message(drop_id, {
+            "id": msg_id, "ts": ts, "created_at": ts, "updated_at": ts,
+            "user": user, "client_id": None, "message_type": message_type, "text": text_,
+            "blob_id": blob_id, "mime": mime, "blob_size": blob_size, "reactions": "{}",
+            "gif_url": gif_url, "gif_preview": gif_preview, "gif_width": gif_width, "gif_height": gif_height,
+            "image_url": image_url, "image_thumb": image_thumb,
+            "reply_to_seq": reply_to_seq, "delivered_at": ts,
+        }, claim=claim)
+    except BaseException:
+        # A resumable upload stays claimable; a one-shot multipart temp file is dropped
+        if upload_tmp and not claim:
+            upload_tmp.unlink(missing_ok=True)
+        raise
+    if upload_tmp:
+        await asyncio.to_thread(_place_blob, upload_tmp, blob_id, upload_data, mime, ts)
+        if claim:
+            await _finish_upload(upload["upload_id"])
+        thumbnailer.schedule(blob_id, mime)
 
     # Update streak and broadcast if changed
     user_normalized = (user or "").strip() or "E"
-    streak_result = update_streak_on_message(drop_id, user_normalized)
+    streak_result = await update_streak_on_message(drop_id, user_normalized)
     
     if streak_result["changed"]:
-        streak_data = get_streak(drop_id)
+        streak_data = await get_streak(drop_id)
         await hub.broadcast(drop_id, {
             "type": "streak",
             "data": streak_data
         })
     
-    await hub.broadcast(drop_id, {
-        "type": "update",
-        "message": {
-            "id": msg_id, "drop_id": drop_id, "seq": next_seq, "ts": ts, "user": user, "text": text_,
-            "blob_id": blob_id, "mime": mime, "img": (f"/blob/{blob_id}" if blob_id else None)
-        }
-    })
+    await _announce_insert(drop_id, row, version)
     # Notify only when E posts a new message, debounce 60s to avoid spam
-    if (user or "").upper() == "E" and _should_notify("msg", drop_id, 60):
-        notify("E posted a new message")
+    if (user or "").upper() == "E" and await _should_notify("msg", drop_id):
+        notify("E posted a new message", drop_id)
     # Return fresh list to match frontend expectations
-    return list_messages(drop_id, req=req)
+    return await list_messages(drop_id, req=req)
 
 # --- Message edit/delete/react and image delete ---
-from fastapi import Body
 
 @app.patch("/api/chat/{drop_id}")
 async def edit_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Request = None):
@@ -509,11 +2745,13 @@ async def edit_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Requ
     if seq is None or text_val is None:
         raise HTTPException(400, "seq and text required")
     now_ms = int(time.time() * 1000)
-    with engine.begin() as conn:
-        conn.execute(text("update messages set text=:t, updated_at=:u where drop_id=:d and seq=:s"),
-                     {"t": text_val, "u": now_ms, "d": drop_id, "s": seq})
+    def write(conn):
+        version = _bump_version(conn, drop_id, now_ms)
+        conn.execute(text("update messages set text=:t, updated_at=:u, rev=:v, changed_at=:u where drop_id=:d and seq=:s"),
+                     {"t": text_val, "u": now_ms, "v": version, "d": drop_id, "s": seq})
+    await db_writer.run(write)
     await hub.broadcast(drop_id, {"type": "update"})
-    return list_messages(drop_id, req=req)
+    return await list_messages(drop_id, req=req)
 
 @app.delete("/api/chat/{drop_id}")
 async def delete_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Request = None):
@@ -521,18 +2759,20 @@ async def delete_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Re
     seq = body.get("seq")
     if seq is None:
         raise HTTPException(400, "seq required")
-    # Try to remove blob if tied to this message
-    with engine.begin() as conn:
+    def write(conn):
         row = conn.execute(text("select blob_id from messages where drop_id=:d and seq=:s"),
                            {"d": drop_id, "s": seq}).mappings().first()
-        if row and row.get("blob_id"):
-            try:
-                (BLOB_DIR / row["blob_id"]).unlink(missing_ok=True)
-            except Exception:
-                pass
+        if not row:
+            return []
+        now_ms = int(time.time() * 1000)
         conn.execute(text("delete from messages where drop_id=:d and seq=:s"), {"d": drop_id, "s": seq})
+        _record_deletes(conn, drop_id, [seq], _bump_version(conn, drop_id, now_ms), now_ms)
+        return _blob_unref(conn, [row["blob_id"]]) if row["blob_id"] else []
+    gone = await db_writer.run(write)
+    # Remove the blob file if no other message shares it
+    await asyncio.to_thread(_release_blobs, gone)
     await hub.broadcast(drop_id, {"type": "update"})
-    return list_messages(drop_id, req=req)
+    return await list_messages(drop_id, req=req)
 
 @app.post("/api/chat/{drop_id}/react")
 async def react_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Request = None):
@@ -542,7 +2782,9 @@ async def react_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Req
     op = (body.get("op") or "add").lower()
     if seq is None or not emoji:
         raise HTTPException(400, "seq and emoji required")
-    with engine.begin() as conn:
+    if op not in ("add", "remove"):
+        raise HTTPException(400, "op must be add/remove")
+    def write(conn):
         row = conn.execute(text("select reactions from messages where drop_id=:d and seq=:s"),
                            {"d": drop_id, "s": seq}).mappings().first()
         if not row:
@@ -554,14 +2796,15 @@ async def react_message(drop_id: str, body: Dict[str, Any] = Body(...), req: Req
         cur = int(rx.get(emoji, 0))
         if op == "add":
             rx[emoji] = cur + 1
-        elif op == "remove":
-            rx[emoji] = max(0, cur - 1)
         else:
-            raise HTTPException(400, "op must be add/remove")
-        conn.execute(text("update messages set reactions=:r where drop_id=:d and seq=:s"),
-                     {"r": json.dumps(rx, separators=(",", ":")), "d": drop_id, "s": seq})
+            rx[emoji] = max(0, cur - 1)
+        now_ms = int(time.time() * 1000)
+        version = _bump_version(conn, drop_id, now_ms)
+        conn.execute(text("update messages set reactions=:r, rev=:v, changed_at=:now where drop_id=:d and seq=:s"),
+                     {"r": json.dumps(rx, separators=(",", ":")), "v": version, "now": now_ms, "d": drop_id, "s": seq})
+    await db_writer.run(write)
     await hub.broadcast(drop_id, {"type": "update"})
-    return list_messages(drop_id, req=req)
+    return await list_messages(drop_id, req=req)
 
 @app.post("/api/chat/{drop_id}/read")
 async def mark_messages_read(drop_id: str, body: Dict[str, Any] = Body(...), req: Request = None):
@@ -576,29 +2819,12 @@ async def mark_messages_read(drop_id: str, body: Dict[str, Any] = Body(...), req
     now_ms = int(time.time() * 1000)
     
     # Only mark messages from the OTHER user as read
-    with engine.begin() as conn:
-        # Mark as read: messages not from the reader, up to the specified seq
-        result = conn.execute(text("""
-            UPDATE messages 
-            SET read_at = :now 
-            WHERE drop_id = :d 
-              AND seq <= :seq 
-              AND user != :reader 
-              AND read_at IS NULL
-        """), {"now": now_ms, "d": drop_id, "seq": up_to_seq, "reader": reader})
-        
-        updated_count = result.rowcount
+    # Mark as read: messages not from the reader, up to the specified seq
+    updated_count, version = await db_writer.run(lambda conn: _mark_read(conn, drop_id, up_to_seq, reader, now_ms))
     
     # Broadcast read receipt to all connections
     if updated_count > 0:
-        await hub.broadcast(drop_id, {
-            "type": "read_receipt",
-            "data": {
-                "upToSeq": up_to_seq,
-                "reader": reader,
-                "readAt": now_ms
-            }
-        })
+        await hub.broadcast(drop_id, _read_receipt(up_to_seq, reader, now_ms, version))
     
     return {"success": True, "updated": updated_count}
 
@@ -608,26 +2834,27 @@ async def delete_image(drop_id: str, image_id: str, req: Request = None):
     logger.info(f"[delete_image] drop_id={drop_id}, image_id={image_id}")
     
     # Delete any messages that reference this blob in this drop
-    with engine.begin() as conn:
+    def write(conn):
+        seqs = conn.execute(text("select seq from messages where drop_id=:d and blob_id=:b"),
+                            {"d": drop_id, "b": image_id}).scalars().all()
         result = conn.execute(text("delete from messages where drop_id=:d and blob_id=:b"), 
                              {"d": drop_id, "b": image_id})
-        deleted_count = result.rowcount
-        logger.info(f"[delete_image] Deleted {deleted_count} message(s) referencing blob {image_id}")
+        if seqs:
+            now_ms = int(time.time() * 1000)
+            _record_deletes(conn, drop_id, list(seqs), _bump_version(conn, drop_id, now_ms), now_ms)
+        return result.rowcount, _blob_unref(conn, [image_id] * result.rowcount)
+    deleted_count, gone = await db_writer.run(write)
+    logger.info(f"[delete_image] Deleted {deleted_count} message(s) referencing blob {image_id}")
     
-    # Delete the actual file
-    file_path = BLOB_DIR / image_id
-    try:
-        if file_path.exists():
-            file_path.unlink()
-            logger.info(f"[delete_image] Successfully deleted file {image_id}")
-        else:
-            logger.warning(f"[delete_image] File {image_id} not found (may have been already deleted)")
-    except Exception as e:
-        logger.error(f"[delete_image] Failed to delete file {image_id}: {e}")
-        # Continue anyway - DB records are already deleted
+    # Delete the actual file unless messages in other drops still use it
+    if gone:
+        await asyncio.to_thread(_release_blobs, gone)
+        logger.info(f"[delete_image] Deleted file {image_id}")
+    elif deleted_count:
+        logger.info(f"[delete_image] File {image_id} kept, still referenced elsewhere")
     
     await hub.broadcast(drop_id, {"type": "update"})
-    return list_messages(drop_id, req=req)
+    return await list_messages(drop_id, req=req)
 
 # --- Streaks (Simplified Design) ---
 from zoneinfo import ZoneInfo
@@ -643,7 +2870,7 @@ def get_est_yesterday() -> str:
     """Get yesterday's date in EST as YYYY-MM-DD string"""
     return (_dt.datetime.now(NY_TZ) - _dt.timedelta(days=1)).strftime("%Y-%m-%d")
 
-def update_streak_on_message(drop_id: str, user: str) -> Dict[str, Any]:
+def _update_streak(conn, drop_id: str, user: str) -> Dict[str, Any]:
     """
     Simplified streak logic:
     - Both users must post each day to maintain streak
@@ -656,209 +2883,838 @@ def update_streak_on_message(drop_id: str, user: str) -> Dict[str, Any]:
     
     logger.info(f"[STREAK] Message from {user} on {today}")
     
-    with engine.begin() as conn:
-        # Get or create streak record
-        row = conn.execute(text(
-            "SELECT * FROM streaks WHERE drop_id = :d"
-        ), {"d": drop_id}).mappings().first()
-        
-        if row:
-            current_streak = row["current_streak"] or 0
-            last_completed = row.get("last_update_date")  # Reusing this field as "last_completed_date"
-            m_last = row.get("last_m_post")
-            e_last = row.get("last_e_post")
+    # Get or create streak record
+    row = conn.execute(text(
+        "SELECT * FROM streaks WHERE drop_id = :d"
+    ), {"d": drop_id}).mappings().first()
+    
+    if row:
+        current_streak = row["current_streak"] or 0
+        last_completed = row.get("last_update_date")  # Reusing this field as "last_completed_date"
+        m_last = row.get("last_m_post")
+        e_last = row.get("last_e_post")
+    else:
+        current_streak = 0
+        last_completed = None
+        m_last = None
+        e_last = None
+    
+    # Track previous streak for "broke" detection
+    previous_streak = current_streak
+    broke_streak = False
+    changed = False
+    
+    # Update the posting user's date
+    if user == "M":
+        m_last = today
+    elif user == "E":
+        e_last = today
+    
+    # Check if both have posted today
+    both_posted_today = (m_last == today and e_last == today)
+    
+    logger.info(f"[STREAK] State: streak={current_streak}, last_completed={last_completed}, m_last={m_last}, e_last={e_last}, both_today={both_posted_today}")
+    
+    if both_posted_today:
+        if last_completed == today:
+            # Already counted today - no change
+            logger.info(f"[STREAK] Already completed today, no change")
+        elif last_completed == yesterday:
+            # Consecutive days - INCREMENT!
+            current_streak += 1
+            last_completed = today
+            changed = True
+            logger.info(f"[STREAK] ✅ Consecutive day! Streak now {current_streak}")
         else:
+            # Gap in posting (or first time) - start fresh at 1
+            current_streak = 1
+            last_completed = today
+            changed = True
+            logger.info(f"[STREAK] ✅ Fresh start! Streak now 1")
+    else:
+        # Only one user has posted today
+        # Check if we need to break the streak (missed yesterday entirely)
+        if last_completed and last_completed < yesterday and current_streak > 0:
+            logger.info(f"[STREAK] ❌ Missed day detected, breaking streak from {current_streak} to 0")
+            previous_streak = current_streak
             current_streak = 0
-            last_completed = None
-            m_last = None
-            e_last = None
-        
-        # Track previous streak for "broke" detection
-        previous_streak = current_streak
-        broke_streak = False
-        changed = False
-        
-        # Update the posting user's date
-        if user == "M":
-            m_last = today
-        elif user == "E":
-            e_last = today
-        
-        # Check if both have posted today
-        both_posted_today = (m_last == today and e_last == today)
-        
-        logger.info(f"[STREAK] State: streak={current_streak}, last_completed={last_completed}, m_last={m_last}, e_last={e_last}, both_today={both_posted_today}")
-        
-        if both_posted_today:
-            if last_completed == today:
-                # Already counted today - no change
-                logger.info(f"[STREAK] Already completed today, no change")
-            elif last_completed == yesterday:
-                # Consecutive days - INCREMENT!
-                current_streak += 1
-                last_completed = today
-                changed = True
-                logger.info(f"[STREAK] ✅ Consecutive day! Streak now {current_streak}")
-            else:
-                # Gap in posting (or first time) - start fresh at 1
-                current_streak = 1
-                last_completed = today
-                changed = True
-                logger.info(f"[STREAK] ✅ Fresh start! Streak now 1")
-        else:
-            # Only one user has posted today
-            # Check if we need to break the streak (missed yesterday entirely)
-            if last_completed and last_completed < yesterday and current_streak > 0:
-                logger.info(f"[STREAK] ❌ Missed day detected, breaking streak from {current_streak} to 0")
-                previous_streak = current_streak
-                current_streak = 0
-                changed = True
-                broke_streak = True
-        
-        # Upsert the record
-        if row:
-            conn.execute(text("""
-                UPDATE streaks 
-                SET current_streak = :streak,
-                    last_m_post = :m_last,
-                    last_e_post = :e_last,
-                    last_update_date = :last_completed,
-                    updated_at = :ts
-                WHERE drop_id = :drop_id
-            """), {
-                "streak": current_streak,
-                "m_last": m_last,
-                "e_last": e_last,
-                "last_completed": last_completed,
-                "ts": now_ts,
-                "drop_id": drop_id
-            })
-        else:
-            conn.execute(text("""
-                INSERT INTO streaks (drop_id, current_streak, last_m_post, last_e_post, last_update_date, updated_at)
-                VALUES (:drop_id, :streak, :m_last, :e_last, :last_completed, :ts)
-            """), {
-                "drop_id": drop_id,
-                "streak": current_streak,
-                "m_last": m_last,
-                "e_last": e_last,
-                "last_completed": last_completed,
-                "ts": now_ts
-            })
-        
-        logger.info(f"[STREAK] Final: streak={current_streak}, changed={changed}, broke={broke_streak}")
-        
-        return {
+            changed = True
+            broke_streak = True
+    
+    # Upsert the record
+    if row:
+        conn.execute(text("""
+            UPDATE streaks 
+            SET current_streak = :streak,
+                last_m_post = :m_last,
+                last_e_post = :e_last,
+                last_update_date = :last_completed,
+                updated_at = :ts
+            WHERE drop_id = :drop_id
+        """), {
             "streak": current_streak,
-            "changed": changed,
-            "brokeStreak": broke_streak,
-            "previousStreak": previous_streak,
-            "bothPostedToday": both_posted_today,
-            "mPostedToday": m_last == today,
-            "ePostedToday": e_last == today
-        }
+            "m_last": m_last,
+            "e_last": e_last,
+            "last_completed": last_completed,
+            "ts": now_ts,
+            "drop_id": drop_id
+        })
+    else:
+        conn.execute(text("""
+            INSERT INTO streaks (drop_id, current_streak, last_m_post, last_e_post, last_update_date, updated_at)
+            VALUES (:drop_id, :streak, :m_last, :e_last, :last_completed, :ts)
+        """), {
+            "drop_id": drop_id,
+            "streak": current_streak,
+            "m_last": m_last,
+            "e_last": e_last,
+            "last_completed": last_completed,
+            "ts": now_ts
+        })
+    
+    logger.info(f"[STREAK] Final: streak={current_streak}, changed={changed}, broke={broke_streak}")
+    
+    return {
+        "streak": current_streak,
+        "changed": changed,
+        "brokeStreak": broke_streak,
+        "previousStreak": previous_streak,
+        "bothPostedToday": both_posted_today,
+        "mPostedToday": m_last == today,
+        "ePostedToday": e_last == today
+    }
+
+async def update_streak_on_message(drop_id: str, user: str) -> Dict[str, Any]:
+    return await db_writer.run(lambda conn: _update_streak(conn, drop_id, user))
 
-def get_streak(drop_id: str) -> Dict[str, Any]:
+def _read_streak(conn, drop_id: str) -> Dict[str, Any]:
     """Get current streak data"""
     today = get_est_today()
     yesterday = get_est_yesterday()
     
-    with engine.begin() as conn:
-        row = conn.execute(text(
-            "SELECT * FROM streaks WHERE drop_id = :d"
-        ), {"d": drop_id}).mappings().first()
-        
-        if not row:
-            return {
-                "streak": 0,
-                "bothPostedToday": False,
-                "mPostedToday": False,
-                "ePostedToday": False,
-                "brokeStreak": False,
-                "previousStreak": 0
-            }
-        
-        current_streak = row["current_streak"] or 0
-        last_completed = row.get("last_update_date")
-        m_last = row.get("last_m_post")
-        e_last = row.get("last_e_post")
-        
-        # Check if streak should be broken (missed day)
-        broke_streak = False
-        previous_streak = current_streak
-        
-        if last_completed and last_completed < yesterday and current_streak > 0:
-            # Streak is stale - should be broken
-            # We'll return broke info but NOT update DB here (let message trigger that)
-            broke_streak = True
-            previous_streak = current_streak
-            logger.info(f"[STREAK] GET detected stale streak: {current_streak} days, last_completed={last_completed}, returning broke=True")
-            # Note: We return the broken state but don't persist until next message
-        
+    row = conn.execute(text(
+        "SELECT * FROM streaks WHERE drop_id = :d"
+    ), {"d": drop_id}).mappings().first()
+    
+    if not row:
         return {
-            "streak": 0 if broke_streak else current_streak,
-            "bothPostedToday": (m_last == today and e_last == today),
-            "mPostedToday": m_last == today,
-            "ePostedToday": e_last == today,
-            "brokeStreak": broke_streak,
-            "previousStreak": previous_streak
+            "streak": 0,
+            "bothPostedToday": False,
+            "mPostedToday": False,
+            "ePostedToday": False,
+            "brokeStreak": False,
+            "previousStreak": 0
         }
+    
+    current_streak = row["current_streak"] or 0
+    last_completed = row.get("last_update_date")
+    m_last = row.get("last_m_post")
+    e_last = row.get("last_e_post")
+    
+    # Check if streak should be broken (missed day)
+    broke_streak = False
+    previous_streak = current_streak
+    
+    if last_completed and last_completed < yesterday and current_streak > 0:
+        # Streak is stale - should be broken
+        # We'll return broke info but NOT update DB here (let message trigger that)
+        broke_streak = True
+        previous_streak = current_streak
+        logger.info(f"[STREAK] GET detected stale streak: {current_streak} days, last_completed={last_completed}, returning broke=True")
+        # Note: We return the broken state but don't persist until next message
+    
+    return {
+        "streak": 0 if broke_streak else current_streak,
+        "bothPostedToday": (m_last == today and e_last == today),
+        "mPostedToday": m_last == today,
+        "ePostedToday": e_last == today,
+        "brokeStreak": broke_streak,
+        "previousStreak": previous_streak
+    }
+
+async def get_streak(drop_id: str) -> Dict[str, Any]:
+    return await db_reader.run(lambda conn: _read_streak(conn, drop_id))
 
 @app.get("/api/chat/{drop_id}/streak")
-def api_get_streak(drop_id: str, req: Request = None):
+async def api_get_streak(drop_id: str, req: Request = None):
     require_session(req)
-    return get_streak(drop_id)
+    return await get_streak(drop_id)
 
 @app.post("/api/chat/{drop_id}/streak")
-def api_post_streak(drop_id: str, req: Request = None):
+async def api_post_streak(drop_id: str, req: Request = None):
     # This endpoint is now deprecated but kept for compatibility
     # Streaks update automatically on message post
     require_session(req)
-    return get_streak(drop_id)
+    return await get_streak(drop_id)
 
 # --- Blob serving ---
+# Blob ids are content hashes, so a URL's bytes never change: browsers may cache them for good
+# and the id itself is a strong validator.
+BLOB_CACHE_MAX_AGE = int(os.environ.get("BLOB_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Resolve a single `bytes=` range to (start, end) inclusive; (-1, -1) if unsatisfiable, None to serve it all."""
+    m = _RANGE_RE.match(header.strip()) if header else None
+    if not m or m.group(1) == m.group(2) == "":
+        return None  # malformed or multi-range: a full 200 is always a valid answer
+    if m.group(1) == "":
+        n = int(m.group(2))
+        return (max(0, size - n), size - 1) if n and size else (-1, -1)
+    start = int(m.group(1))
+    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return (-1, -1)
+    return start, end
+
+async def _iter_file(f, start: int, length: int, chunk: int = 64 * 1024):
+    """Stream `length` bytes of an open aiofiles handle from `start`, closing it afterwards."""
+    try:
+        await f.seek(start)
+        while length > 0:
+            data = await f.read(min(chunk, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        await f.close()
+
+async def _serve_blob_file(req: Request, path: Path, etag: str, describe) -> Response:
+    """Serve an immutable blob file with long-lived caching, conditional GET and single-range support.
+
+    `describe()` gives (size, mtime, media type, load) and raises 404 for unknown blobs; it is only
+    awaited when the answer is neither a 304 nor a blob_cache hit. `load` reads the whole body for
+    blobs that are not files of their own (packed), else None. Small bodies are added to blob_cache.
+    """
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={BLOB_CACHE_MAX_AGE}, immutable",
+               "Accept-Ranges": "bytes"}
+    inm = req.headers.get("if-none-match")
+    if _etag_matches(inm, etag):
+        return Response(status_code=304, headers=headers)  # answered without touching the disk
+    cached = blob_cache.get(path.name)
+    hit = cached is not None
+    if hit:
+        data, mtime, media_type = cached
+        size = len(data)
+    else:
+        generation = blob_cache.generation
+        size, mtime, media_type, load = await describe()
+    headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    ims = req.headers.get("if-modified-since")
+    if inm is None and ims:
+        try:
+            if int(mtime) <= parsedate_to_datetime(ims).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    rng = req.headers.get("range")
+    if_range = req.headers.get("if-range")
+    if rng and if_range and if_range.strip() != etag and if_range.strip() != headers["Last-Modified"]:
+        rng = None  # validator changed: send the whole thing
+    span = _parse_range(rng, size)
+    if span == (-1, -1):
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    start, end = span or (0, size - 1)
+    status = 200 if span is None else 206
+    if span is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if hit:
+        blob_cache.stats["bytesSaved"] += end - start + 1
+    elif load is not None:
+        try:
+            data = await asyncio.to_thread(load)
+        except FileNotFoundError:
+            raise HTTPException(404)
+        blob_cache.put(path.name, data, mtime, media_type, generation)
+    else:
+        try:
+            f = await aiofiles.open(path, "rb")
+        except FileNotFoundError:
+            raise HTTPException(404)
+        if not blob_cache.fits(size):
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_iter_file(f, start, end - start + 1), status_code=status,
+                                     media_type=media_type, headers=headers)
+        try:
+            data = await f.read()
+        finally:
+            await f.close()
+        blob_cache.put(path.name, data, mtime, media_type, generation)
+    return Response(content=data if span is None else data[start:end + 1], status_code=status,
+                    media_type=media_type, headers=headers)
+
 @app.get("/blob/{blob_id}")
-def get_blob(blob_id: str, req: Request):
+async def get_blob(blob_id: str, req: Request):
+    require_session(req)
+    if not _is_blob_id(blob_id):
+        raise HTTPException(404)
+    async def describe():
+        # Straight from the index: no stat, and blobs nobody references any more are gone already
+        row = await db_reader.run(lambda conn: conn.execute(
+            text("select size, mime, created_at, pack_id, pack_offset from blobs where blob_id=:b"), {"b": blob_id}).first())
+        if row is None:
+            raise HTTPException(404)
+        load = None
+        if row.pack_id is not None:
+            load = lambda: _read_packed(blob_id, row.pack_id, row.pack_offset, row.size)
+        return row.size, row.created_at / 1000, row.mime or "application/octet-stream", load
+    return await _serve_blob_file(req, _blob_path(blob_id), f'"{blob_id}"', describe)
+
+@app.get("/blob/{blob_id}/{variant}")
+async def get_blob_variant(blob_id: str, variant: str, req: Request):
     require_session(req)
-    path = BLOB_DIR / blob_id
-    if not path.exists(): raise HTTPException(404)
-    return FileResponse(path)
+    if not _is_blob_id(blob_id) or variant not in IMAGE_VARIANTS:
+        raise HTTPException(404)
+    path = _variant_path(blob_id, variant)
+    async def describe():
+        try:
+            st = await asyncio.to_thread(os.stat, path)
+        except FileNotFoundError:
+            raise HTTPException(404)
+        return st.st_size, st.st_mtime, "image/jpeg", None
+    return await _serve_blob_file(req, path, f'"{blob_id}.{variant}"', describe)
 
 # --- Camera Stream Proxy ---
 def verify_session(token: str) -> bool:
     """Verify session token - wrapper for _verify_token"""
     return _verify_token(token)
 
+# Every viewer is served from one upstream connection held by CameraRelay
+CAMERA_IDLE_SECONDS = float(os.environ.get("CAMERA_IDLE_SECONDS", "15"))
+CAMERA_VIEWER_QUEUE = max(1, int(os.environ.get("CAMERA_VIEWER_QUEUE", "2")))
+CAMERA_SNAPSHOT_MAX_AGE = float(os.environ.get("CAMERA_SNAPSHOT_MAX_AGE", "5"))
+CAMERA_MAX_FPS = 30.0
+CAMERA_MAX_FRAME_BYTES = 8 * 1024 * 1024
+_CAMERA_BOUNDARY = b"frame"
+
+class MJPEGParser:
+    """Splits a multipart/x-mixed-replace byte stream into JPEG frames at its boundary lines."""
+    def __init__(self, boundary: bytes):
+        self.delim = b"--" + boundary
+        self.buf = bytearray()
+
+    @staticmethod
+    def boundary_of(content_type: str) -> bytes:
+        m = re.search(r"boundary=\"?([^\";]+)", content_type or "")
+        boundary = m.group(1).strip() if m else _CAMERA_BOUNDARY.decode()
+        # Some cameras put the leading dashes into the parameter itself
+        return (boundary[2:] if boundary.startswith("--") else boundary).encode("latin-1")
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self.buf += chunk
+        frames = []
+        while True:
+            start = self.buf.find(self.delim)
+            if start < 0:
+                del self.buf[:max(0, len(self.buf) - len(self.delim))]
+                break
+            head_end = self.buf.find(b"\r\n\r\n", start)
+            if head_end < 0:
+                break
+            headers = bytes(self.buf[start + len(self.delim):head_end])
+            body = head_end + 4
+            m = re.search(rb"(?i)content-length:\s*(\d+)", headers)
+            if m:
+                end = body + int(m.group(1))
+                if len(self.buf) < end:
+                    break
+                frame, rest = bytes(self.buf[body:end]), end
+            else:
+                end = self.buf.find(self.delim, body)
+                if end < 0:
+                    break
+                frame, rest = bytes(self.buf[body:end]).rstrip(b"\r\n"), end
+            del self.buf[:rest]
+            if frame:
+                frames.append(frame)
+        if len(self.buf) > CAMERA_MAX_FRAME_BYTES:
+            logger.warning("[camera] Frame too large or stream garbled, resyncing")
+            self.buf.clear()
+        return frames
+
+def _mjpeg_part(frame: bytes) -> bytes:
+    return (b"--" + _CAMERA_BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: "
+            + str(len(frame)).encode() + b"\r\n\r\n" + frame + b"\r\n")
+
+class CameraViewer(asyncio.Queue):
+    """A viewer's bounded queue of encoded parts, optionally capped at `fps` frames per second."""
+    def __init__(self, fps: Optional[float] = None):
+        super().__init__(maxsize=CAMERA_VIEWER_QUEUE)
+        self.interval = 1.0 / fps if fps else 0.0
+        self.next_at = 0.0
+
+class CameraRelay:
+    """Holds one upstream MJPEG connection while anyone is watching and fans its frames out.
+
+    Each viewer gets a bounded queue of encoded parts; when it is full the oldest frame is
+    dropped, so a slow client sees a lower frame rate instead of growing delay. Viewers that
+    asked for a lower rate simply skip frames. The upstream is closed once nobody has watched
+    for CAMERA_IDLE_SECONDS, and reconnected with backoff if it fails while viewers remain.
+    The most recent frame is kept for snapshots.
+    """
+    def __init__(self, url: str = CAMERA_STREAM_URL, idle: float = CAMERA_IDLE_SECONDS):
+        self.url = url
+        self.idle = idle
+        self.viewers: set = set()
+        self.task: Optional[asyncio.Task] = None
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+        self.epoch = secrets.token_hex(4)  # keeps snapshot ETags unique across restarts
+        self.latest: Optional[bytes] = None
+        self.latest_seq = 0
+        self.latest_at = 0.0
+        self.stats = {"upstreamConnects": 0, "upstreamErrors": 0, "frames": 0, "dropped": 0, "skipped": 0}
+
+    def subscribe(self, fps: Optional[float] = None) -> CameraViewer:
+        viewer = CameraViewer(fps)
+        self.viewers.add(viewer)
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.create_task(self._run())
+        return viewer
+
+    def unsubscribe(self, viewer: CameraViewer):
+        self.viewers.discard(viewer)
+        if not self.viewers and self.task is not None and not self.task.done() and self.idle_timer is None:
+            self.idle_timer = asyncio.get_running_loop().call_later(self.idle, self._stop_if_idle)
+
+    def _stop_if_idle(self):
+        self.idle_timer = None
+        if not self.viewers and self.task is not None:
+            logger.info("[camera] No viewers, closing upstream")
+            self.task.cancel()
+
+    def _publish(self, frame: bytes):
+        self.stats["frames"] += 1
+        self.latest, self.latest_seq, self.latest_at = frame, self.stats["frames"], time.time()
+        part = _mjpeg_part(frame)
+        now = asyncio.get_running_loop().time()
+        for viewer in self.viewers:
+            if viewer.interval:
+                if now < viewer.next_at:
+                    self.stats["skipped"] += 1
+                    continue
+                viewer.next_at = now + viewer.interval
+            if viewer.full():
+                viewer.get_nowait()
+                self.stats["dropped"] += 1
+            viewer.put_nowait(part)
+
+    async def _run(self):
+        backoff = 1.0
+        while self.viewers or self.idle_timer is not None:
+            try:
+                async with http_out.client().stream("GET", self.url) as response:
+                    response.raise_for_status()
+                    self.stats["upstreamConnects"] += 1
+                    parser = MJPEGParser(MJPEGParser.boundary_of(response.headers.get("content-type")))
+                    async for chunk in response.aiter_bytes():
+                        for frame in parser.feed(chunk):
+                            self._publish(frame)
+                            backoff = 1.0
+                logger.info("[camera] Upstream ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["upstreamErrors"] += 1
+                logger.warning(f"[camera] Upstream error: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def snapshot_etag(self) -> str:
+        return f'"cam-{self.epoch}-{self.latest_seq}"'
+
+    async def snapshot(self, timeout: float = 10.0) -> Optional[bytes]:
+        """The latest frame, fetching a fresh one first if it is older than CAMERA_SNAPSHOT_MAX_AGE."""
+        if self.latest is not None and time.time() - self.latest_at <= CAMERA_SNAPSHOT_MAX_AGE:
+            return self.latest
+        # Watch briefly; the idle timer then keeps the upstream around for follow-up snapshots
+        viewer = self.subscribe()
+        try:
+            await asyncio.wait_for(viewer.get(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("[camera] No frame for snapshot")
+        finally:
+            self.unsubscribe(viewer)
+        return self.latest
+
+camera_relay = CameraRelay()
+
+@app.get("/api/camera/snapshot")
+async def camera_snapshot(request: Request):
+    """Most recent camera frame as a JPEG; revalidate with If-None-Match to skip unchanged frames."""
+    require_session(request)
+    frame = await camera_relay.snapshot()
+    if frame is None:
+        raise HTTPException(503, "camera unavailable")
+    headers = {"ETag": camera_relay.snapshot_etag(), "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=frame, media_type="image/jpeg", headers=headers)
+
 @app.get("/api/camera/stream")
-async def camera_stream(request: Request):
+async def camera_stream(request: Request, fps: Optional[float] = None):
+    """Live MJPEG; `fps` caps the frame rate sent to this client (frames are skipped server-side)."""
     # Require authentication
     session_token = request.cookies.get(SESSION_COOKIE)
     if not session_token or not verify_session(session_token):
         return Response(status_code=401)
-    
+    if fps is not None:
+        fps = min(fps, CAMERA_MAX_FPS) if fps > 0 else None
+
     async def generate():
-        async with httpx.AsyncClient() as client:
-            try:
-                async with client.stream("GET", CAMERA_STREAM_URL, timeout=30.0) as response:
-                    async for chunk in response.aiter_bytes(chunk_size=4096):
-                        yield chunk
-            except Exception as e:
-                print(f"Camera stream error: {e}")
-                return
-    
+        viewer = camera_relay.subscribe(fps)
+        try:
+            while True:
+                yield await viewer.get()
+        finally:
+            camera_relay.unsubscribe(viewer)
+
     return StreamingResponse(
         generate(),
-        media_type="multipart/x-mixed-replace; boundary=frame"
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        headers={"Cache-Control": "no-store"}
     )
 
 # --- WebSocket Hub with presence ---
-class Hub:
+# Frames queued per socket before a slow client is downgraded (queue dropped, told to refetch) or evicted
+WS_SEND_QUEUE = int(os.environ.get("WS_SEND_QUEUE", "64"))
+# Sent in place of dropped frames: clients refetch the drop (since their version) on a bare update
+_RESYNC_FRAME = json.dumps({"type": "update"}, separators=(",", ":"))
+
+def _encode_frame(payload: Dict[str, Any]) -> str:
+    # Same encoding as WebSocket.send_json
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+class Outbox:
+    """Bounded outbound queue for one socket, drained by its own writer task."""
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+        self.degraded = False
+        self.closed = False
+        self.task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.ws.send_text(frame)
+                if self.degraded and self.queue.empty():
+                    self.degraded = False
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info(f"[Hub] Writer stopped: {e}")
+        finally:
+            self.closed = True
+
+    def offer(self, frame: str) -> bool:
+        """Queue a pre-encoded frame; False means the consumer is hopelessly behind and should be evicted."""
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.degraded:
+            return False
+        # First overflow: drop the backlog and tell the client to refetch instead
+        logger.warning(f"[Hub] Send queue full, downgrading consumer to resync")
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_RESYNC_FRAME)
+        self.degraded = True
+        return True
+
+    async def close(self, code: int = 1000):
+        self.task.cancel()
+        self.closed = True
+        if code != 1000:
+            try:
+                await asyncio.wait_for(self.ws.close(code=code), timeout=2.0)
+            except Exception:
+                pass
+
+# Fan-out between hub nodes (worker processes / replicas): "memory" keeps everything in this
+# process, "sqlite" relays through the database for processes sharing DATA_DIR, "redis" uses
+# PUBLISH/SUBSCRIBE on any Redis-protocol server
+HUB_BACKEND = os.environ.get("HUB_BACKEND", "memory").lower()
+HUB_REDIS_URL = os.environ.get("HUB_REDIS_URL", "redis://127.0.0.1:6379/0")
+HUB_CHANNEL = os.environ.get("HUB_CHANNEL", "msgdrop:hub")
+HUB_POLL_MS = float(os.environ.get("HUB_POLL_MS", "50"))
+HUB_EVENT_RETENTION_SECONDS = int(os.environ.get("HUB_EVENT_RETENTION_SECONDS", "60"))
+HUB_PUBLISH_QUEUE = int(os.environ.get("HUB_PUBLISH_QUEUE", "1000"))
+# Other nodes' presence is forgotten if not re-announced within this time (they announce every third of it)
+HUB_PRESENCE_TTL = float(os.environ.get("HUB_PRESENCE_TTL", "30"))
+
+class PubSub:
+    """Carries hub events to other nodes. This base class is the single-process default: nobody to tell."""
+    name = "memory"
+    shared = False
+
     def __init__(self):
+        self.deliver = None
+        self.on_connect = None
+        self.stats = {"published": 0, "received": 0, "dropped": 0, "errors": 0}
+
+    async def start(self, deliver, on_connect):
+        """deliver(message) handles every event from the bus; on_connect() runs once subscribed."""
+        self.deliver, self.on_connect = deliver, on_connect
+
+    def publish(self, message: str):
+        """Queue message for every node (possibly including this one); never blocks."""
+
+    async def close(self):
+        pass
+
+class SQLitePubSub(PubSub):
+    """Events go into hub_events through the DB writer and every node polls for newer ids.
+
+    SQLite has one writer at a time, so ids become visible in order; AUTOINCREMENT keeps them
+    from being reused once old events are pruned.
+    """
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, poll_ms: float = HUB_POLL_MS):
+        super().__init__()
+        self.interval = max(0.001, poll_ms / 1000.0)
+        self.last_id = 0
+        self.pruned = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver, on_connect):
+        await super().start(deliver, on_connect)
+        self.last_id = await db_reader.run(lambda conn: conn.execute(
+            text("select coalesce(max(id), 0) from hub_events")).scalar())
+        self.task = asyncio.create_task(self._poll())
+        await on_connect()
+
+    def publish(self, message: str):
+        now = int(time.time())
+        db_writer.submit(lambda conn: conn.execute(
+            text("insert into hub_events(message, created_at) values(:m, :t)"), {"m": message, "t": now})
+        ).add_done_callback(self._published)
+
+    def _published(self, fut: concurrent.futures.Future):
+        if fut.cancelled() or fut.exception() is not None:
+            self.stats["errors"] += 1
+            logger.warning(f"[Hub] Could not publish event: {None if fut.cancelled() else fut.exception()}")
+        else:
+            self.stats["published"] += 1
+
+    def _read(self, conn, last_id: int):
+        return conn.execute(text("select id, message from hub_events where id > :last order by id limit 500"),
+                            {"last": last_id}).all()
+
+    async def _poll(self):
+        while True:
+            rows = []
+            try:
+                rows = await db_reader.run(lambda conn: self._read(conn, self.last_id))
+                for event_id, message in rows:
+                    self.last_id = event_id
+                    self.stats["received"] += 1
+                    await self.deliver(message)
+                now = time.time()
+                if now - self.pruned >= HUB_EVENT_RETENTION_SECONDS:
+                    self.pruned = now
+                    cutoff = int(now) - HUB_EVENT_RETENTION_SECONDS
+                    db_writer.submit(lambda conn: conn.execute(
+                        text("delete from hub_events where created_at < :c"), {"c": cutoff}))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"[Hub] Event poll failed: {e}")
+            if len(rows) < 500:
+                await asyncio.sleep(self.interval)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+class RedisPubSub(PubSub):
+    """PUBLISH/SUBSCRIBE on HUB_CHANNEL, speaking RESP over plain asyncio streams.
+
+    One connection stays subscribed (and is re-established with backoff); another pipelines
+    queued PUBLISH commands. If the publish queue overflows, events are dropped: clients catch
+    up through the usual version-based resync.
+    """
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str = HUB_REDIS_URL, channel: str = HUB_CHANNEL):
+        super().__init__()
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname or "127.0.0.1", parts.port or 6379
+        self.password = parts.password
+        self.channel = channel
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    @classmethod
+    async def _reply(cls, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            return None if size < 0 else (await reader.readexactly(size + 2))[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [await cls._reply(reader) for _ in range(size)]
+        raise ConnectionError(f"unexpected reply {line[:32]!r}")
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), HTTP_CONNECT_TIMEOUT)
+        if self.password:
+            writer.write(self._encode("AUTH", self.password))
+            await writer.drain()
+            await self._reply(reader)
+        return reader, writer
+
+    async def start(self, deliver, on_connect):
+        await super().start(deliver, on_connect)
+        self.queue = asyncio.Queue(maxsize=HUB_PUBLISH_QUEUE)
+        self.tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._publisher())]
+
+    def publish(self, message: str):
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def _listen(self):
+        backoff = 0.5
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                writer.write(self._encode("SUBSCRIBE", self.channel))
+                await writer.drain()
+                await self._reply(reader)
+                logger.info(f"[Hub] Subscribed to {self.channel} on {self.host}:{self.port}")
+                backoff = 0.5
+                await self.on_connect()
+                while True:
+                    msg = await self._reply(reader)
+                    if isinstance(msg, list) and len(msg) == 3 and msg[0] == b"message":
+                        self.stats["received"] += 1
+                        await self.deliver(msg[2].decode("utf-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"[Hub] Subscription to {self.host}:{self.port} lost: {e}")
+            finally:
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10.0)
+
+    async def _publisher(self):
+        conn = None
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < 256:
+                batch.append(self.queue.get_nowait())
+            try:
+                if conn is None:
+                    conn = await self._connect()
+                reader, writer = conn
+                writer.write(b"".join(self._encode("PUBLISH", self.channel, m) for m in batch))
+                await writer.drain()
+                for _ in batch:
+                    await self._reply(reader)
+                self.stats["published"] += len(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["dropped"] += len(batch)
+                logger.warning(f"[Hub] Publish to {self.host}:{self.port} failed: {e}")
+                if conn is not None:
+                    conn[1].close()
+                    conn = None
+                await asyncio.sleep(0.5)
+
+    async def close(self):
+        # Give queued events (e.g. the shutdown announcement) a moment to go out
+        for _ in range(20):
+            if self.queue is None or self.queue.empty():
+                break
+            await asyncio.sleep(0.05)
+        for task in self.tasks:
+            task.cancel()
+
+def _make_bus(backend: str = HUB_BACKEND) -> PubSub:
+    if backend == "sqlite":
+        return SQLitePubSub()
+    if backend == "redis":
+        return RedisPubSub()
+    if backend != "memory":
+        logger.warning(f"[Hub] Unknown HUB_BACKEND '{backend}', using memory")
+    return PubSub()
+
+class Hub:
+    """Local WebSocket rooms plus a PubSub bus to the other nodes.
+
+    Every broadcast is delivered to this node's sockets and published once; other nodes deliver
+    it to theirs (dropping their hot-cache entry for events that change the drop, since the
+    write happened elsewhere). Presence is aggregated from per-node user counts that each node
+    announces on join/leave and re-announces every HUB_PRESENCE_TTL/3; a node that stops
+    announcing is forgotten, and its users are reported offline.
+    """
+    def __init__(self, bus: Optional[PubSub] = None):
         self.rooms: Dict[str, Dict[WebSocket, str]] = {}
+        self.outboxes: Dict[WebSocket, Outbox] = {}
+        self.bus = bus or PubSub()
+        self.node = secrets.token_hex(6)
+        self.remote: Dict[str, Dict[str, Tuple[Dict[str, int], float]]] = {}  # drop -> node -> (user counts, seen)
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"remoteFrames": 0, "expiredNodes": 0}
+
+    async def start(self):
+        await self.bus.start(self._on_bus, self._on_bus_connect)
+        if self.bus.shared:
+            self.task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.bus.shared:
+            self._publish({"bye": True})
+        await self.bus.close()
 
     async def join(self, drop_id: str, ws: WebSocket, user: str = "anon"):
         await ws.accept()
+        self.outboxes[ws] = Outbox(ws)
         self.rooms.setdefault(drop_id, {})[ws] = user
+        self._announce(drop_id)
         
         # Send current presence state to the NEW connection only
         # Tell them who's already online (excluding themselves)
@@ -866,23 +3722,28 @@ class Hub:
         for conn, u in self.rooms.get(drop_id, {}).items():
             if conn != ws and u != user:  # Don't send their own presence
                 existing_users[u] = True
+        for u in self._remote_users(drop_id):
+            if u != user:
+                existing_users[u] = True
         
         # Send initial presence of existing users to the new connection
         for existing_user in existing_users.keys():
-            await ws.send_json({
+            await self.send(ws, {
                 "type": "presence",
                 "data": {"user": existing_user, "state": "active", "ts": int(time.time() * 1000)},
-                "online": len(self.rooms.get(drop_id, {}))
+                "online": self._online(drop_id)
             })
         
         # Then broadcast this user's join to OTHERS (not self)
         await self.broadcast_to_others(drop_id, ws, {
             "type": "presence",
             "data": {"user": user, "state": "active", "ts": int(time.time() * 1000)},
-            "online": len(self.rooms.get(drop_id, {}))
+            "online": self._online(drop_id)
         })
 
-    async def leave(self, drop_id: str, ws: WebSocket):
+    async def leave(self, drop_id: str, ws: WebSocket, code: int = 1000):
+        if ws not in self.rooms.get(drop_id, {}):
+            return
         # Get user before removal
         user_label = self.rooms.get(drop_id, {}).get(ws, "anon")
         logger.info(f"[Hub.leave] User '{user_label}' disconnecting from drop '{drop_id}'")
@@ -893,6 +3754,10 @@ class Hub:
                 self.rooms.pop(drop_id, None)
         except KeyError:
             pass
+        self._announce(drop_id)
+        outbox = self.outboxes.pop(ws, None)
+        if outbox:
+            await outbox.close(code)
         
         # Broadcast user's offline state
         logger.info(f"[Hub.leave] Broadcasting offline state for user '{user_label}'")
@@ -903,34 +3768,150 @@ class Hub:
         })
 
     def _online(self, drop_id: str) -> int:
-        return len(self.rooms.get(drop_id, {}))
+        """Connections to drop_id across all nodes."""
+        return len(self.rooms.get(drop_id, {})) + sum(self._remote_users(drop_id).values())
+
+    def _remote_users(self, drop_id: str) -> Dict[str, int]:
+        users: Dict[str, int] = {}
+        for counts, _ in self.remote.get(drop_id, {}).values():
+            for u, n in counts.items():
+                users[u] = users.get(u, 0) + n
+        return users
+
+    async def send(self, ws: WebSocket, payload: Dict[str, Any]):
+        """Queue a payload for one connection (keeps ordering with broadcasts)"""
+        outbox = self.outboxes.get(ws)
+        if outbox is None:
+            await ws.send_json(payload)
+            return
+        outbox.offer(_encode_frame(payload))
+
+    async def _fanout(self, drop_id: str, payload: Dict[str, Any], skip: Optional[WebSocket] = None):
+        # Encode once, enqueue everywhere; the per-socket writers do the actual sends
+        frame = _encode_frame(payload)
+        if self.bus.shared:
+            self._publish({"d": drop_id, "t": payload.get("type"), "f": frame})
+        await self._deliver(drop_id, frame, skip)
+
+    async def _deliver(self, drop_id: str, frame: str, skip: Optional[WebSocket] = None):
+        evict = []
+        for ws in list(self.rooms.get(drop_id, {}).keys()):
+            if ws == skip:
+                continue
+            outbox = self.outboxes.get(ws)
+            if outbox is not None and not outbox.offer(frame):
+                evict.append(ws)
+        for ws in evict:
+            logger.warning(f"[Hub] Evicting slow consumer from drop '{drop_id}'")
+            await self.leave(drop_id, ws, code=1013)
 
     async def broadcast(self, drop_id: str, payload: Dict[str, Any]):
-        conns = list(self.rooms.get(drop_id, {}).keys())
-        dead = []
-        for ws in conns:
-            try:
-                await ws.send_json(payload)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            await self.leave(drop_id, ws)
+        await self._fanout(drop_id, payload)
 
     async def broadcast_to_others(self, drop_id: str, sender_ws: WebSocket, payload: Dict[str, Any]):
         """Broadcast to all connections in room EXCEPT sender"""
-        conns = list(self.rooms.get(drop_id, {}).keys())
-        dead = []
-        for ws in conns:
-            if ws == sender_ws:
-                continue
+        await self._fanout(drop_id, payload, skip=sender_ws)
+
+    # Cross-node plumbing
+    def _publish(self, message: Dict[str, Any]):
+        message["n"] = self.node
+        self.bus.publish(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    def _announce(self, drop_id: str):
+        """Tell other nodes how many sockets each user has open to drop_id here."""
+        if not self.bus.shared:
+            return
+        counts: Dict[str, int] = {}
+        for u in self.rooms.get(drop_id, {}).values():
+            counts[u] = counts.get(u, 0) + 1
+        self._publish({"d": drop_id, "u": counts})
+
+    async def _on_bus_connect(self):
+        # (Re)joined the bus: ask the others for their presence and share ours
+        self._publish({"hello": True})
+        for drop_id in list(self.rooms):
+            self._announce(drop_id)
+
+    async def _on_bus(self, raw: str):
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        node = msg.get("n")
+        if node == self.node:
+            return
+        if "f" in msg:
+            self.stats["remoteFrames"] += 1
+            if msg.get("t") in ("delta", "update", "read_receipt"):
+                # Drop it early; the version check on the next hit catches anything lost on the bus
+                hot_cache.invalidate(msg["d"])
+            await self._deliver(msg["d"], msg["f"])
+        elif "u" in msg:
+            nodes = self.remote.setdefault(msg["d"], {})
+            if msg["u"]:
+                nodes[node] = (msg["u"], time.monotonic())
+            else:
+                nodes.pop(node, None)
+            if not nodes:
+                self.remote.pop(msg["d"], None)
+        elif msg.get("hello"):
+            for drop_id in list(self.rooms):
+                self._announce(drop_id)
+        elif msg.get("bye"):
+            for drop_id in list(self.remote):
+                self.remote[drop_id].pop(node, None)
+                if not self.remote[drop_id]:
+                    del self.remote[drop_id]
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HUB_PRESENCE_TTL / 3)
             try:
-                await ws.send_json(payload)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            await self.leave(drop_id, ws)
+                for drop_id in list(self.rooms):
+                    self._announce(drop_id)
+                await self._expire(time.monotonic() - HUB_PRESENCE_TTL)
+            except Exception as e:
+                logger.error(f"[Hub] Presence heartbeat failed: {e}")
+
+    async def _expire(self, cutoff: float):
+        """Forget nodes that stopped announcing; their users go offline unless still seen elsewhere."""
+        for drop_id in list(self.remote):
+            nodes = self.remote[drop_id]
+            gone = [n for n, (_, seen) in nodes.items() if seen < cutoff]
+            if not gone:
+                continue
+            lost = set()
+            for n in gone:
+                lost.update(nodes.pop(n)[0])
+                self.stats["expiredNodes"] += 1
+                logger.warning(f"[Hub] Node {n} stopped announcing presence for drop '{drop_id}'")
+            if not nodes:
+                del self.remote[drop_id]
+            still = set(self.rooms.get(drop_id, {}).values()) | set(self._remote_users(drop_id))
+            for user in lost - still:
+                # Local delivery only: every node runs its own expiry
+                await self._deliver(drop_id, _encode_frame({
+                    "type": "presence",
+                    "data": {"user": user, "state": "offline", "ts": int(time.time() * 1000)},
+                    "online": self._online(drop_id)
+                }))
+
+    def snapshot(self) -> Dict[str, Any]:
+        nodes = {n for by_node in self.remote.values() for n in by_node}
+        return {**self.stats, **self.bus.stats, "backend": self.bus.name, "node": self.node,
+                "remoteNodes": len(nodes), "sockets": len(self.outboxes)}
+
+hub = Hub(_make_bus())
+# Other nodes write to this database too: cached drops must be checked against drop_versions
+hot_cache.shared = hub.bus.shared
 
-hub = Hub()
+@app.on_event("startup")
+async def _start_hub():
+    await hub.start()
+
+@app.on_event("shutdown")
+async def _stop_hub():
+    await hub.stop()
 
 # --- Game State Management ---
 class GameManager:
@@ -1017,9 +3998,9 @@ async def ws_endpoint(ws: WebSocket):
                 typing_payload["user"] = user
                 await hub.broadcast(drop, {"type": "typing", "payload": typing_payload})
             elif t == "ping":
-                await ws.send_json({"type": "pong", "ts": int(time.time()*1000)})
+                await hub.send(ws, {"type": "pong", "ts": int(time.time()*1000)})
             elif t == "notify":
-                notify(f"{msg}")
+                notify(f"{msg}", drop)
             elif t == "presence":
                 # Ephemeral presence - broadcast only, no DB persistence
                 try:
@@ -1032,6 +4013,10 @@ async def ws_endpoint(ws: WebSocket):
                     presence_payload = {"user": user, "state": "active", "ts": int(time.time()*1000)}
                 # Broadcast to all OTHER connections (not sender) - presence is ephemeral
                 await hub.broadcast_to_others(drop, ws, {"type": "presence", "data": presence_payload, "online": hub._online(drop)})
+            elif t == "resync":
+                # Explicit full snapshot for a client that detected a version gap
+                full_drop = await db_reader.run(lambda conn: _load_snapshot(conn, drop, _get_version(conn, drop)))
+                await hub.send(ws, {"type": "update", "data": full_drop})
             elif t == "presence_request":
                 await hub.broadcast(drop, {"type": "presence_request", "data": {"ts": int(time.time() * 1000)}})
             elif t == "read":
@@ -1044,30 +4029,13 @@ async def ws_endpoint(ws: WebSocket):
                 if up_to_seq is not None:
                     now_ms = int(time.time() * 1000)
                     
-                    with engine.begin() as conn:
-                        # Mark messages from OTHER user as read
-                        result = conn.execute(text("""
-                            UPDATE messages 
-                            SET read_at = :now 
-                            WHERE drop_id = :d 
-                              AND seq <= :seq 
-                              AND user != :reader 
-                              AND read_at IS NULL
-                        """), {"now": now_ms, "d": drop, "seq": up_to_seq, "reader": reader})
-                        
-                        rows_updated = result.rowcount
-                        logger.info(f"[READ] Updated {rows_updated} messages in DB")
+                    # Mark messages from OTHER user as read
+                    rows_updated, version = await db_writer.run(lambda conn: _mark_read(conn, drop, up_to_seq, reader, now_ms))
+                    logger.info(f"[READ] Updated {rows_updated} messages in DB")
                     
                     # ALWAYS broadcast read receipt (even if 0 rows updated)
                     # This ensures the sender gets notified
-                    broadcast_data = {
-                        "type": "read_receipt",
-                        "data": {
-                            "upToSeq": up_to_seq,
-                            "reader": reader,
-                            "readAt": now_ms
-                        }
-                    }
+                    broadcast_data = _read_receipt(up_to_seq, reader, now_ms, version)
                     
                     num_clients = hub._online(drop)
                     logger.info(f"[READ] Broadcasting to {num_clients} clients: {broadcast_data}")
@@ -1085,88 +4053,37 @@ async def ws_endpoint(ws: WebSocket):
                 reply_to_seq = (payload or {}).get("replyToSeq")
                 
                 if not text_val:
-                    await ws.send_json({"type": "error", "error": "text required"})
+                    await hub.send(ws, {"type": "error", "error": "text required"})
                     continue
                 
                 # Insert into DB
                 ts = int(time.time() * 1000)
                 msg_id = secrets.token_hex(8)
                 
-                with engine.begin() as conn:
-                    row = conn.execute(text("select coalesce(max(seq),0)+1 as next from messages where drop_id=:d"), {"d": drop}).mappings().first()
-                    next_seq = int(row["next"]) if row else 1
-                    
-                    conn.execute(text("""
-                        insert into messages(id,drop_id,seq,ts,created_at,updated_at,user,client_id,message_type,text,reactions,reply_to_seq,delivered_at)
-                        values(:id,:d,:seq,:ts,:ca,:ua,:u,:cid,:mt,:tx,:rx,:rts,:del)
-                    """), {
-                        "id": msg_id, "d": drop, "seq": next_seq, "ts": ts,
-                        "ca": ts, "ua": ts, "u": msg_user, "cid": client_id,
-                        "mt": "text", "tx": text_val, "rx": "{}",
-                        "rts": reply_to_seq, "del": ts
-                    })
-                
-                # Cleanup old messages (keep only 30 most recent)
-                cleanup_old_messages(drop, keep_count=30)
+                row, version = await _insert_message(drop, {
+                    "id": msg_id, "ts": ts, "created_at": ts, "updated_at": ts,
+                    "user": msg_user, "client_id": client_id,
+                    "message_type": "text", "text": text_val, "reactions": "{}",
+                    "reply_to_seq": reply_to_seq, "delivered_at": ts,
+                })
                 
                 # Update streak and broadcast if changed
                 user_normalized = (msg_user or "").strip() or "E"
-                streak_result = update_streak_on_message(drop, user_normalized)
+                streak_result = await update_streak_on_message(drop, user_normalized)
                 
                 if streak_result["changed"]:
-                    streak_data = get_streak(drop)
+                    streak_data = await get_streak(drop)
                     await hub.broadcast(drop, {
                         "type": "streak",
                         "data": streak_data
                     })
                 
-                # Build the drop payload manually instead of calling list_messages()
-                # (list_messages requires req parameter for session validation)
-                with engine.begin() as conn:
-                    rows = conn.execute(text("select * from messages where drop_id=:d order by seq"), {"d": drop}).mappings().all()
-                
-                out = []
-                images = []
-                for r in rows:
-                    o = dict(r)
-                    msg = {
-                        "message": o.get("text"),
-                        "seq": o.get("seq"),
-                        "createdAt": o.get("created_at"),
-                        "updatedAt": o.get("updated_at"),
-                        "user": o.get("user"),
-                        "clientId": o.get("client_id"),
-                        "messageType": o.get("message_type"),
-                        "reactions": json.loads(o.get("reactions") or "{}"),
-                        "gifUrl": o.get("gif_url"),
-                        "gifPreview": o.get("gif_preview"),
-                        "gifWidth": o.get("gif_width"),
-                        "gifHeight": o.get("gif_height"),
-                        "imageUrl": o.get("image_url"),
-                        "imageThumb": o.get("image_thumb"),
-                        "replyToSeq": o.get("reply_to_seq"),
-                        "deliveredAt": o.get("delivered_at"),
-                        "readAt": o.get("read_at"),
-                    }
-                    if o.get("blob_id"):
-                        msg["img"] = f"/blob/{o['blob_id']}"
-                        images.append({
-                            "imageId": o["blob_id"],
-                            "mime": o.get("mime"),
-                            "originalUrl": msg["img"],
-                            "thumbUrl": msg["img"],
-                            "uploadedAt": o.get("ts"),
-                        })
-                    out.append(msg)
-                
-                full_drop = {"dropId": drop, "version": int(next_seq), "messages": out, "images": images}
-                
-                # Broadcast update WITH FULL DATA to all connections
-                await hub.broadcast(drop, {"type": "update", "data": full_drop})
+                # Broadcast just the new message; clients that missed a version ask for a resync
+                await _announce_insert(drop, row, version)
                 
                 # Notify if E posts, debounced
-                if (msg_user or "").upper() == "E" and _should_notify("msg", drop, 60):
-                    notify("E posted a new message")
+                if (msg_user or "").upper() == "E" and await _should_notify("msg", drop):
+                    notify("E posted a new message", drop)
             elif t == "gif":
                 # GIF message via WebSocket
                 gif_url = (payload or {}).get("gifUrl")
@@ -1178,88 +4095,37 @@ async def ws_endpoint(ws: WebSocket):
                 client_id = (payload or {}).get("clientId")
                 
                 if not gif_url:
-                    await ws.send_json({"type": "error", "error": "gifUrl required"})
+                    await hub.send(ws, {"type": "error", "error": "gifUrl required"})
                     continue
                 
                 # Insert into DB
                 ts = int(time.time() * 1000)
                 msg_id = secrets.token_hex(8)
                 
-                with engine.begin() as conn:
-                    row = conn.execute(text("select coalesce(max(seq),0)+1 as next from messages where drop_id=:d"), {"d": drop}).mappings().first()
-                    next_seq = int(row["next"]) if row else 1
-                    
-                    conn.execute(text("""
-                        insert into messages(id,drop_id,seq,ts,created_at,updated_at,user,client_id,message_type,text,reactions,gif_url,gif_preview,gif_width,gif_height)
-                        values(:id,:d,:seq,:ts,:ca,:ua,:u,:cid,:mt,:tx,:rx,:gurl,:gprev,:gw,:gh)
-                    """), {
-                        "id": msg_id, "d": drop, "seq": next_seq, "ts": ts,
-                        "ca": ts, "ua": ts, "u": msg_user, "cid": client_id,
-                        "mt": "gif", "tx": f"[GIF: {title}]", "rx": "{}",
-                        "gurl": gif_url, "gprev": gif_preview, "gw": gif_width, "gh": gif_height
-                    })
-                
-                # Cleanup old messages (keep only 30 most recent)
-                cleanup_old_messages(drop, keep_count=30)
+                row, version = await _insert_message(drop, {
+                    "id": msg_id, "ts": ts, "created_at": ts, "updated_at": ts,
+                    "user": msg_user, "client_id": client_id,
+                    "message_type": "gif", "text": f"[GIF: {title}]", "reactions": "{}",
+                    "gif_url": gif_url, "gif_preview": gif_preview, "gif_width": gif_width, "gif_height": gif_height,
+                })
                 
                 # Update streak and broadcast if changed
                 user_normalized = (msg_user or "").strip() or "E"
-                streak_result = update_streak_on_message(drop, user_normalized)
+                streak_result = await update_streak_on_message(drop, user_normalized)
                 
                 if streak_result["changed"]:
-                    streak_data = get_streak(drop)
+                    streak_data = await get_streak(drop)
                     await hub.broadcast(drop, {
                         "type": "streak",
                         "data": streak_data
                     })
                 
-                # Build the drop payload manually instead of calling list_messages()
-                # (list_messages requires req parameter for session validation)
-                with engine.begin() as conn:
-                    rows = conn.execute(text("select * from messages where drop_id=:d order by seq"), {"d": drop}).mappings().all()
-                
-                out = []
-                images = []
-                for r in rows:
-                    o = dict(r)
-                    msg = {
-                        "message": o.get("text"),
-                        "seq": o.get("seq"),
-                        "createdAt": o.get("created_at"),
-                        "updatedAt": o.get("updated_at"),
-                        "user": o.get("user"),
-                        "clientId": o.get("client_id"),
-                        "messageType": o.get("message_type"),
-                        "reactions": json.loads(o.get("reactions") or "{}"),
-                        "gifUrl": o.get("gif_url"),
-                        "gifPreview": o.get("gif_preview"),
-                        "gifWidth": o.get("gif_width"),
-                        "gifHeight": o.get("gif_height"),
-                        "imageUrl": o.get("image_url"),
-                        "imageThumb": o.get("image_thumb"),
-                        "replyToSeq": o.get("reply_to_seq"),
-                        "deliveredAt": o.get("delivered_at"),
-                        "readAt": o.get("read_at"),
-                    }
-                    if o.get("blob_id"):
-                        msg["img"] = f"/blob/{o['blob_id']}"
-                        images.append({
-                            "imageId": o["blob_id"],
-                            "mime": o.get("mime"),
-                            "originalUrl": msg["img"],
-                            "thumbUrl": msg["img"],
-                            "uploadedAt": o.get("ts"),
-                        })
-                    out.append(msg)
-                
-                full_drop = {"dropId": drop, "version": int(next_seq), "messages": out, "images": images}
-                
-                # Broadcast update WITH FULL DATA to all connections
-                await hub.broadcast(drop, {"type": "update", "data": full_drop})
+                # Broadcast just the new message; clients that missed a version ask for a resync
+                await _announce_insert(drop, row, version)
                 
                 # Notify if E posts, debounced
-                if (msg_user or "").upper() == "E" and _should_notify("gif", drop, 60):
-                    notify("E sent a GIF")
+                if (msg_user or "").upper() == "E" and await _should_notify("gif", drop):
+                    notify("E sent a GIF", drop)
             elif t == "game":
                 # Enhanced game event handling with state management
                 op = (payload or {}).get("op")
@@ -1287,8 +4153,8 @@ async def ws_endpoint(ws: WebSocket):
                     
                     # Notify when E starts a game, debounced
                     try:
-                        if (user or "").upper() == "E" and _should_notify("game", drop, 60):
-                            notify("E started a game")
+                        if (user or "").upper() == "E" and await _should_notify("game", drop):
+                            notify("E started a game", drop)
                     except Exception:
                         pass
                 
@@ -1318,7 +4184,7 @@ async def ws_endpoint(ws: WebSocket):
                         logger.info(f"[Game] Player {user} joined game {game_id}")
                     else:
                         # Game not found
-                        await ws.send_json({
+                        await hub.send(ws, {
                             "type": "error",
                             "message": f"Game {game_id} not found"
                         })
@@ -1406,7 +4272,7 @@ async def ws_endpoint(ws: WebSocket):
                     # Send active games list to requester
                     active_games = game_manager.get_active_games(drop)
                     
-                    await ws.send_json({
+                    await hub.send(ws, {
                         "type": "game_list",
                         "data": {
                             "games": active_games
@@ -1432,6 +4298,11 @@ async def ws_endpoint(ws: WebSocket):
                 # Unrecognized events are ignored
                 pass
     except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        # e.g. the hub evicted this socket and closed it under us
+        logger.info(f"[WS] Connection ended: {e}")
+    finally:
         await hub.leave(drop, ws)
 
 # --- Static UI: serve /msgdrop
@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# main reads its config at import: point it at a throwaway data dir first
+ROOT = Path(__file__).resolve().parent.parent
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="msgdrop-tests-")
+os.chdir(ROOT)  # static mounts are relative to the working directory
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    """A client with a valid session; the app's startup hooks run for the duration of the test."""
+    with TestClient(main.app) as c:
+        c.cookies.set(main.SESSION_COOKIE, main._generate_token())
+        yield c
+
+
+@pytest.fixture
+def drop_id(request):
+    """A drop of the test's own, so tests sharing the database don't see each other's messages."""
+    return "t-" + os.urandom(4).hex()
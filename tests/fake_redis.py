@@ -0,0 +1,80 @@
+"""A local Redis stand-in for the hub tests: just enough RESP for AUTH, PING, SUBSCRIBE and PUBLISH."""
+import asyncio
+from typing import Dict, List, Optional, Set
+
+
+def _bulk(data: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class FakeRedis:
+    def __init__(self, password: Optional[str] = None):
+        self.password = password.encode() if password else None
+        self.subs: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.clients: List[asyncio.StreamWriter] = []
+        self.commands: List[List[bytes]] = []
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        auth = f":{self.password.decode()}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{port}/0"
+
+    async def stop(self):
+        self.drop_clients()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def drop_clients(self):
+        """Cut every connection, as a Redis restart would."""
+        for writer in list(self.clients):
+            writer.transport.abort()
+
+    def subscribers(self, channel: bytes) -> int:
+        return len(self.subs.get(channel, ()))
+
+    @staticmethod
+    async def _command(reader: asyncio.StreamReader) -> List[bytes]:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("client went away")
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients.append(writer)
+        authed = self.password is None
+        try:
+            while True:
+                cmd = await self._command(reader)
+                self.commands.append(cmd)
+                name = cmd[0].upper()
+                if name == b"AUTH":
+                    authed = cmd[-1] == self.password
+                    writer.write(b"+OK\r\n" if authed else b"-WRONGPASS invalid password\r\n")
+                elif not authed:
+                    writer.write(b"-NOAUTH Authentication required.\r\n")
+                elif name == b"SUBSCRIBE":
+                    self.subs.setdefault(cmd[1], set()).add(writer)
+                    writer.write(b"*3\r\n" + _bulk(b"subscribe") + _bulk(cmd[1]) + b":1\r\n")
+                elif name == b"PUBLISH":
+                    targets = list(self.subs.get(cmd[1], ()))
+                    for target in targets:
+                        target.write(b"*3\r\n" + _bulk(b"message") + _bulk(cmd[1]) + _bulk(cmd[2]))
+                    writer.write(b":%d\r\n" % len(targets))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for subs in self.subs.values():
+                subs.discard(writer)
+            self.clients.remove(writer)
+            writer.close()
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+import main
+
+
+def _jpeg(label: str) -> bytes:
+    return b"\xff\xd8" + label.encode() + b"\xff\xd9"
+
+
+def _part(frame: bytes, boundary: bytes = b"cam", length: bool = True) -> bytes:
+    headers = b"Content-Type: image/jpeg\r\n"
+    if length:
+        headers += b"Content-Length: %d\r\n" % len(frame)
+    return b"--" + boundary + b"\r\n" + headers + b"\r\n" + frame + b"\r\n"
+
+
+class FakeCamera:
+    """An MJPEG upstream: numbered frames at `fps`, each part written in two pieces.
+
+    After `frames` parts a connection either closes (`hang=False`, the camera rebooting) or goes
+    quiet (the scene stops changing).
+    """
+    def __init__(self, fps: float = 50, frames: Optional[int] = None, hang: bool = False):
+        self.fps, self.frames, self.hang = fps, frames, hang
+        self.connections = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/stream"
+
+    async def stop(self):
+        self.server.close()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        conn = self.connections
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=--cam\r\n"
+                         b"Connection: close\r\n\r\n")
+            i = 0
+            while self.frames is None or i < self.frames:
+                data = _part(_jpeg(f"c{conn}f{i}"))
+                writer.write(data[:7])
+                await writer.drain()
+                writer.write(data[7:])
+                await writer.drain()
+                i += 1
+                await asyncio.sleep(1 / self.fps)
+            if self.hang:
+                await asyncio.sleep(3600)
+        except (ConnectionError, asyncio.CancelledError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _body(part: bytes) -> bytes:
+    return part.split(b"\r\n\r\n", 1)[1][:-2]
+
+
+# --- Parser ---
+
+def test_parser_boundary_split_across_reads():
+    frames = [_jpeg(f"f{i}") for i in range(3)]
+    stream = b"".join(_part(f) for f in frames) + b"--cam\r\n"
+    for size in (1, 2, 5, 13):
+        parser = main.MJPEGParser(b"cam")
+        out = []
+        for i in range(0, len(stream), size):
+            out += parser.feed(stream[i:i + size])
+        assert out == frames, size
+
+
+def test_parser_without_content_length():
+    parser = main.MJPEGParser(b"cam")
+    a, b = _jpeg("a"), _jpeg("b")
+    assert parser.feed(_part(a, length=False)) == []  # its end is only known at the next boundary
+    assert parser.feed(_part(b, length=False)) == [a]
+    assert parser.feed(b"--c") == []
+    assert parser.feed(b"am\r\n") == [b]
+
+
+def test_parser_skips_garbage_between_parts():
+    a, b, c = _jpeg("a"), _jpeg("b"), _jpeg("c")
+    stream = (b"\x00junk before the first part\r\n" + _part(a) + b"trailing noise\r\n\r\n"
+              + _part(b) + b"--ca" + _part(c) + b"--cam\r\n")
+    assert main.MJPEGParser(b"cam").feed(stream) == [a, b, c]
+
+
+def test_parser_boundary_forms():
+    assert main.MJPEGParser.boundary_of("multipart/x-mixed-replace; boundary=--cam") == b"cam"
+    assert main.MJPEGParser.boundary_of('multipart/x-mixed-replace;boundary="cam"') == b"cam"
+    assert main.MJPEGParser.boundary_of(None) == b"frame"
+
+
+# --- Relay ---
+
+def _run(scenario):
+    async def wrapped():
+        try:
+            await scenario()
+        finally:
+            await main.http_out.aclose()
+    asyncio.run(wrapped())
+
+
+def test_snapshot_serves_latest_frame(monkeypatch):
+    async def scenario():
+        camera = FakeCamera(frames=3, hang=True)
+        relay = main.CameraRelay(await camera.start(), idle=0.5)
+        monkeypatch.setattr(main, "camera_relay", relay)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            client.cookies.set(main.SESSION_COOKIE, main._generate_token())
+            r = await client.get("/api/camera/snapshot")
+            assert r.status_code == 200
+            assert r.headers["content-type"] == "image/jpeg"
+            assert r.content.startswith(b"\xff\xd8") and b"c1f" in r.content
+
+            await asyncio.sleep(0.2)  # the camera goes quiet after its third frame
+            r = await client.get("/api/camera/snapshot")
+            assert r.content == _jpeg("c1f2")
+            etag = r.headers["etag"]
+            r = await client.get("/api/camera/snapshot", headers={"If-None-Match": etag})
+            assert r.status_code == 304
+            assert camera.connections == 1  # both snapshots came off one upstream connection
+
+        await asyncio.sleep(0.7)
+        assert relay.task.done()  # closed after the idle period
+        await camera.stop()
+
+    _run(scenario)
+
+
+def test_viewer_fps_cap():
+    async def scenario():
+        camera = FakeCamera(fps=50)
+        relay = main.CameraRelay(await camera.start(), idle=0.1)
+        capped, full = relay.subscribe(fps=5), relay.subscribe()
+        counts = {capped: 0, full: 0}
+
+        async def watch(viewer):
+            while True:
+                await viewer.get()
+                counts[viewer] += 1
+
+        await asyncio.wait_for(full.get(), 5)
+        watchers = [asyncio.create_task(watch(v)) for v in (capped, full)]
+        await asyncio.sleep(1.0)
+        for w in watchers:
+            w.cancel()
+        assert 4 <= counts[capped] <= 6
+        assert counts[full] > 3 * counts[capped]
+        assert relay.stats["skipped"] > 0
+        relay.unsubscribe(capped)
+        relay.unsubscribe(full)
+        await camera.stop()
+
+    _run(scenario)
+
+
+def test_relay_reconnects_upstream():
+    async def scenario():
+        camera = FakeCamera(frames=3)
+        relay = main.CameraRelay(await camera.start(), idle=0.1)
+        viewer = relay.subscribe()
+        seen = []
+        started = time.monotonic()
+        while len(seen) < 5:
+            seen.append(_body(await asyncio.wait_for(viewer.get(), 5)))
+        assert seen[:3] == [_jpeg(f"c1f{i}") for i in range(3)]
+        assert seen[3:] == [_jpeg("c2f0"), _jpeg("c2f1")]
+        assert relay.stats["upstreamConnects"] == 2
+        assert time.monotonic() - started >= 1.0  # after the reconnect backoff
+        relay.unsubscribe(viewer)
+        await camera.stop()
+
+    _run(scenario)
+
+
+def test_stream_requires_session():
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            assert (await client.get("/api/camera/stream")).status_code == 401
+
+    _run(scenario)
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+
+import main
+from fake_redis import FakeRedis
+
+CHANNEL = main.HUB_CHANNEL.encode()
+
+
+class FakeSocket:
+    """Stands in for a WebSocket; records every frame the hub sends it."""
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames.append(json.loads(text))
+
+    async def send_json(self, payload):
+        self.frames.append(payload)
+
+    async def close(self, code=1000):
+        pass
+
+    def of_type(self, kind):
+        return [f for f in self.frames if f["type"] == kind]
+
+
+async def _until(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def _nodes(url, count=2):
+    hubs = [main.Hub(main.RedisPubSub(url)) for _ in range(count)]
+    for hub in hubs:
+        await hub.start()
+    return hubs
+
+
+def test_broadcast_reaches_other_node(drop_id):
+    async def scenario():
+        redis = FakeRedis(password="s3cret")
+        url = await redis.start()
+        a, b = await _nodes(url)
+        await _until(lambda: redis.subscribers(CHANNEL) == 2)
+        ws = FakeSocket()
+        await a.join(drop_id, ws, "E")
+
+        main.hot_cache.entries[drop_id] = object()
+        await b.broadcast(drop_id, {"type": "delta", "data": {"seq": 1}})
+        await _until(lambda: ws.of_type("delta"))
+        assert ws.of_type("delta") == [{"type": "delta", "data": {"seq": 1}}]
+        assert drop_id not in main.hot_cache.entries  # the write happened on b
+        assert a.stats["remoteFrames"] >= 1
+        assert b.bus.stats["published"] >= 1 and a.bus.stats["errors"] == 0
+        assert [b"AUTH", b"s3cret"] in redis.commands
+
+        await a.stop()
+        await b.stop()
+        await redis.stop()
+
+    asyncio.run(scenario())
+
+
+def test_presence_aggregates_across_nodes(monkeypatch, drop_id):
+    monkeypatch.setattr(main, "HUB_PRESENCE_TTL", 0.6)
+
+    async def scenario():
+        redis = FakeRedis()
+        url = await redis.start()
+        a, b = await _nodes(url)
+        await _until(lambda: redis.subscribers(CHANNEL) == 2)
+        wa, wb, wb2 = FakeSocket(), FakeSocket(), FakeSocket()
+        await a.join(drop_id, wa, "E")
+        await _until(lambda: b._online(drop_id) == 1)
+        await b.join(drop_id, wb, "M")
+        await b.join(drop_id, wb2, "M")
+        await _until(lambda: a._online(drop_id) == 3)
+        assert b._online(drop_id) == 3
+        assert {"user": "M", "state": "active"}.items() <= wa.of_type("presence")[0]["data"].items()
+        # E was already online on a when M joined b
+        assert any(f["data"]["user"] == "E" for f in wb.of_type("presence"))
+
+        await b.leave(drop_id, wb2)
+        await _until(lambda: a._online(drop_id) == 2)
+
+        # b dies without saying bye: a stops counting it once its presence goes stale
+        for task in [b.task, *b.bus.tasks]:
+            task.cancel()
+        seen = len(wa.frames)
+        await _until(lambda: a._online(drop_id) == 1, timeout=2.0)
+        await _until(lambda: len(wa.frames) > seen)  # sent through the socket's outbox
+        offline = [f for f in wa.frames[seen:] if f["type"] == "presence"]
+        assert [(f["data"]["user"], f["data"]["state"], f["online"]) for f in offline] == [("M", "offline", 1)]
+        assert a.stats["expiredNodes"] == 1
+
+        await a.stop()
+        await redis.stop()
+
+    asyncio.run(scenario())
+
+
+def test_subscriber_reconnects_and_reannounces(monkeypatch, drop_id):
+    # Heartbeats every 0.3s repeat any announcement lost with the old connections
+    monkeypatch.setattr(main, "HUB_PRESENCE_TTL", 0.9)
+
+    async def scenario():
+        redis = FakeRedis()
+        url = await redis.start()
+        a, b = await _nodes(url)
+        await _until(lambda: redis.subscribers(CHANNEL) == 2)
+        wa = FakeSocket()
+        await a.join(drop_id, wa, "E")
+        await _until(lambda: b._online(drop_id) == 1)
+
+        b.remote.clear()  # so only a's announcement after reconnecting can restore it
+        redis.drop_clients()
+        await _until(lambda: redis.subscribers(CHANNEL) == 2)
+        await _until(lambda: b._online(drop_id) == 1)
+        assert a.bus.stats["errors"] >= 1 and b.bus.stats["errors"] >= 1
+
+        # The publisher's connection was cut too: the first publish may be lost, later ones go through
+        async def delivered():
+            await b.broadcast(drop_id, {"type": "update", "data": {}})
+            await asyncio.sleep(0.1)
+            return bool(wa.of_type("update"))
+        for _ in range(20):
+            if await delivered():
+                break
+        assert wa.of_type("update")
+
+        await a.stop()
+        await b.stop()
+        await redis.stop()
+
+    asyncio.run(scenario())
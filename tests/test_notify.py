@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import json
+import time
+from urllib.parse import parse_qs
+
+import pytest
+
+import main
+
+
+class FakeTwilio:
+    """Answers Messages.json POSTs with the next scripted status (201 once the script runs out)."""
+    def __init__(self, *statuses: int):
+        self.statuses = list(statuses)
+        self.requests = []
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                method, path, _ = head[0].split(" ")
+                headers = {k.strip().lower(): v.strip() for k, v in (line.split(":", 1) for line in head[1:] if line)}
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests.append({"method": method, "path": path, "headers": headers,
+                                      "form": {k: v[0] for k, v in parse_qs(body.decode()).items()}})
+                status = self.statuses.pop(0) if self.statuses else 201
+                out = json.dumps({"sid": f"SM{len(self.requests)}"}).encode()
+                writer.write(b"HTTP/1.1 %d Scripted\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                             % (status, len(out), out))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def bodies(self):
+        return [r["form"]["Body"] for r in self.requests]
+
+
+@pytest.fixture
+def twilio(monkeypatch):
+    monkeypatch.setattr(main, "TWILIO_ACCOUNT_SID", "AC123")
+    monkeypatch.setattr(main, "TWILIO_AUTH_TOKEN", "tok")
+    monkeypatch.setattr(main, "TWILIO_FROM_NUMBER", "+15550000")
+    monkeypatch.setattr(main, "NOTIFY_NUMBERS", ["+15551111"])
+    monkeypatch.setattr(main, "NOTIFY_COALESCE_SECONDS", 0.2)
+    monkeypatch.setattr(main, "NOTIFY_RETRY_SECONDS", 0.05)
+    return monkeypatch
+
+
+async def _until(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def _run(twilio, fake, scenario):
+    async def wrapped():
+        twilio.setattr(main, "TWILIO_API_BASE", await fake.start())
+        try:
+            await scenario(main.SMSDispatcher())
+        finally:
+            await fake.stop()
+            await main.http_out.aclose()
+    asyncio.run(wrapped())
+
+
+def test_request_body_and_auth(twilio):
+    twilio.setattr(main, "NOTIFY_NUMBERS", ["+15551111", "+15552222"])
+    fake = FakeTwilio()
+
+    async def scenario(sms):
+        sms.enqueue("E posted a new message", "d1")
+        await _until(lambda: sms.stats["sent"] == 2)
+        assert {r["form"]["To"] for r in fake.requests} == {"+15551111", "+15552222"}
+        for r in fake.requests:
+            assert r["method"] == "POST"
+            assert r["path"] == "/2010-04-01/Accounts/AC123/Messages.json"
+            assert r["headers"]["authorization"] == "Basic " + base64.b64encode(b"AC123:tok").decode()
+            assert r["headers"]["content-type"] == "application/x-www-form-urlencoded"
+            assert r["form"]["From"] == "+15550000"
+            assert r["form"]["Body"] == "E posted a new message"
+
+    _run(twilio, fake, scenario)
+
+
+def test_retries_5xx_and_429_but_not_4xx(twilio):
+    fake = FakeTwilio(503, 429, 500, 201, 400)
+
+    async def scenario(sms):
+        sms.enqueue("E sent a GIF", "d1")
+        await _until(lambda: sms.stats["sent"] == 1)
+        assert len(fake.requests) == 4
+        assert sms.stats["retries"] == 3
+
+        sms.enqueue("E started a game", "d2")
+        await _until(lambda: sms.stats["failed"] == 1)
+        await asyncio.sleep(0.2)
+        assert len(fake.requests) == 5  # a 400 is final
+        assert sms.stats["retries"] == 3
+
+    _run(twilio, fake, scenario)
+
+
+def test_gives_up_after_max_attempts(twilio):
+    twilio.setattr(main, "NOTIFY_MAX_ATTEMPTS", 3)
+    fake = FakeTwilio(502, 502, 502, 502)
+
+    async def scenario(sms):
+        sms.enqueue("E posted a new message", "d1")
+        await _until(lambda: sms.stats["failed"] == 1)
+        assert len(fake.requests) == 3
+        assert sms.stats["sent"] == 0
+
+    _run(twilio, fake, scenario)
+
+
+def test_coalesces_per_drop(twilio):
+    fake = FakeTwilio()
+
+    async def scenario(sms):
+        sms.enqueue("E posted a new message", "d1")
+        sms.enqueue("E started a game", "d2")
+        sms.enqueue("E sent a GIF", "d1")
+        sms.enqueue("E posted a new message", "d1")  # same text: folded away
+        assert fake.requests == []  # held for the coalescing delay
+        await _until(lambda: sms.stats["sent"] == 2)
+        assert fake.bodies() == ["E posted a new message\nE sent a GIF", "E started a game"]
+        assert sms.stats["queued"] == 2 and sms.stats["coalesced"] == 2
+
+        # Once sent, the next notification for the drop is a new SMS
+        sms.enqueue("E sent a GIF", "d1")
+        await _until(lambda: sms.stats["sent"] == 3)
+        assert fake.bodies()[-1] == "E sent a GIF"
+
+    _run(twilio, fake, scenario)
+
+
+def test_posts_notify_once_per_window(client, twilio, drop_id):
+    """_should_notify keeps repeat messages to one SMS a minute; coalescing never has to."""
+    fake = FakeTwilio()
+    twilio.setattr(main, "TWILIO_API_BASE", client.portal.call(fake.start))
+    twilio.setattr(main, "sms_dispatcher", main.SMSDispatcher())
+    for text in ("one", "two", "three"):
+        assert client.post(f"/api/chat/{drop_id}", data={"text": text, "user": "E"}).status_code == 200
+    client.post(f"/api/chat/{drop_id}", data={"text": "reply", "user": "M"})
+    client.portal.call(_until, lambda: main.sms_dispatcher.stats["sent"] == 1)
+    time.sleep(0.3)
+    assert fake.bodies() == ["E posted a new message"]
+    assert main.sms_dispatcher.stats["queued"] == 1 and main.sms_dispatcher.stats["coalesced"] == 0
+    client.portal.call(fake.stop)
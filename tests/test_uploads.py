@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+
+import httpx
+
+import main
+
+
+def _session(client: httpx.AsyncClient):
+    client.cookies.set(main.SESSION_COOKIE, main._generate_token())
+
+
+async def _init(client, drop_id, size):
+    r = await client.post(f"/api/chat/{drop_id}/uploads", json={"size": size, "mime": "image/png"})
+    assert r.status_code == 200, r.text
+    return r.json()["uploadId"]
+
+
+def test_stalled_append_is_resumed_after_its_lease(monkeypatch, drop_id):
+    """A PUT that stalls mid-body (a dead mobile link, no FIN) keeps the lease; the client's retry
+    is told when it lapses, then resumes from what the stalled request had recorded."""
+    monkeypatch.setattr(main, "UPLOAD_LEASE_SECONDS", 0.6)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            _session(client)
+            upload_id = await _init(client, drop_id, 10)
+            path = f"/api/chat/{drop_id}/uploads/{upload_id}"
+            wake = asyncio.Event()
+
+            async def stalled_body():
+                yield b"AAAA"
+                await asyncio.sleep(0.4)  # past half the lease: the next chunk renews it and records 4
+                yield b"BBBB"
+                await wake.wait()  # the link dies here
+                yield b"ZZ"
+
+            stalled = asyncio.create_task(client.put(f"{path}?offset=0", content=stalled_body()))
+            await asyncio.sleep(0.5)
+
+            assert (await client.get(path)).json()["offset"] == 4
+            r = await client.put(f"{path}?offset=4", content=b"BBBBCC")
+            assert r.status_code == 409
+            assert r.json()["detail"]["offset"] == 4
+            assert 0 < r.json()["detail"]["retryAfter"] <= 0.6
+            assert r.headers["retry-after"] == "1"
+
+            await asyncio.sleep(r.json()["detail"]["retryAfter"] + 0.05)
+            r = await client.put(f"{path}?offset=4", content=b"BBBBCC")
+            assert r.status_code == 200, r.text
+            assert r.json()["offset"] == 10
+
+            # The stalled request wakes up: it has lost the lease, so it writes and records nothing
+            wake.set()
+            assert (await stalled).status_code == 409
+            r = await client.post(f"{path}/commit")
+            assert r.status_code == 200, r.text
+            assert r.json()["blobId"] == hashlib.sha256(b"AAAABBBBCC").hexdigest()
+
+    asyncio.run(scenario())
+
+
+def test_offset_mismatch_has_no_retry_after(client, drop_id):
+    upload_id = client.post(f"/api/chat/{drop_id}/uploads", json={"size": 10}).json()["uploadId"]
+    path = f"/api/chat/{drop_id}/uploads/{upload_id}"
+    assert client.put(f"{path}?offset=0", content=b"AAAAA").json()["offset"] == 5
+    r = client.put(f"{path}?offset=0", content=b"AAAAA")
+    assert r.status_code == 409
+    assert r.json()["detail"] == {"offset": 5}
+    assert "retry-after" not in r.headers
+
+
+def test_commit_refused_while_leased(client, drop_id):
+    upload_id = client.post(f"/api/chat/{drop_id}/uploads", json={"size": 4}).json()["uploadId"]
+    path = f"/api/chat/{drop_id}/uploads/{upload_id}"
+    assert client.put(f"{path}?offset=0", content=b"DATA").status_code == 200
+    assert client.portal.call(main._lease_upload, upload_id, 4, "other")
+    assert client.post(f"{path}/commit").status_code == 409
@@ -0,0 +1,84 @@
+import io
+import time
+
+import pytest
+
+import main
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _image(fmt: str, size=(1600, 900), mode="RGB") -> bytes:
+    """A smooth gradient (compresses small enough to be packed) with a random corner so each call is a new blob.
+
+    The corner is 32 random black/white pixels: single-pixel shades can quantize to the same JPEG.
+    """
+    im = Image.linear_gradient("L").resize(size).convert(mode)
+    bits = main.secrets.randbits(32)
+    for x in range(32):
+        im.putpixel((x, 0), (255 if bits >> x & 1 else 0,) * len(mode))
+    out = io.BytesIO()
+    im.save(out, fmt)
+    return out.getvalue()
+
+
+def _post_image(client, drop_id, data: bytes, mime: str) -> str:
+    r = client.post(f"/api/chat/{drop_id}", data={"user": "M"}, files={"file": ("img", data, mime)})
+    assert r.status_code == 200, r.text
+    return main.hashlib.sha256(data).hexdigest()
+
+
+def _variants(blob_id):
+    with main.engine.connect() as conn:
+        return conn.execute(main.text("select variants from blobs where blob_id=:b"), {"b": blob_id}).scalar()
+
+
+def _wait_for_variants(client, drop_id, blob_id, timeout=20.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        msg = client.get(f"/api/chat/{drop_id}").json()["messages"][-1]
+        if msg.get("imageMedium"):
+            return msg
+        assert _variants(blob_id) != "", "rendering failed"
+        time.sleep(0.1)
+    pytest.fail("variants were not rendered")
+
+
+def _assert_rendered(client, drop_id, blob_id):
+    msg = _wait_for_variants(client, drop_id, blob_id)
+    assert msg["imageThumb"] == f"/blob/{blob_id}/thumb"
+    assert msg["imageMedium"] == f"/blob/{blob_id}/medium"
+    for name, edge in main.IMAGE_VARIANTS.items():
+        with Image.open(main._variant_path(blob_id, name)) as im:
+            assert im.format == "JPEG"
+            assert im.size == (edge, edge * 9 // 16)
+        r = client.get(f"/blob/{blob_id}/{name}")
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "image/jpeg"
+
+
+@pytest.mark.parametrize("fmt,mime,mode", [("JPEG", "image/jpeg", "RGB"), ("PNG", "image/png", "RGBA")])
+def test_upload_renders_variants(client, drop_id, fmt, mime, mode):
+    blob_id = _post_image(client, drop_id, _image(fmt, mode=mode), mime)
+    _assert_rendered(client, drop_id, blob_id)
+
+
+def test_small_image_keeps_original(client, drop_id):
+    blob_id = _post_image(client, drop_id, _image("PNG", size=(200, 100)), "image/png")
+    deadline = time.monotonic() + 20
+    while _variants(blob_id) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _variants(blob_id) == ""  # processed, nothing smaller to make
+    msg = client.get(f"/api/chat/{drop_id}").json()["messages"][-1]
+    assert msg["imageThumb"] == f"/blob/{blob_id}"
+    assert msg["imageMedium"] is None
+    assert not any(main._variant_path(blob_id, name).exists() for name in main.IMAGE_VARIANTS)
+
+
+def test_packed_original_renders_variants(client, drop_id, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "pack_store", main.PackStore(tmp_path / "packs", enabled=True))
+    data = _image("JPEG")
+    assert main.pack_store.accepts(len(data))
+    blob_id = _post_image(client, drop_id, data, "image/jpeg")
+    assert not main._blob_path(blob_id).exists()  # packed, so no shard directory was made for it
+    _assert_rendered(client, drop_id, blob_id)